@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# This file is part of Supysonic.
+#
+# Supysonic is a Python implementation of the Subsonic server API.
+# Copyright (C) 2013-2017  Alban 'spl0k' Féron
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Times the lookups made by the scanner and the API on a synthetic SQLite database, without and with the indexes
+from schema/sqlite.sql.
+
+Usage: python benchmarks/indexes.py [number of tracks]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+TRACKS_PER_ALBUM = 10
+ALBUMS_PER_ARTIST = 10
+GENRES = [ u'Genre {}'.format(i) for i in range(50) ]
+
+def uid():
+    return str(uuid.uuid4())
+
+def create_schema(conn):
+    """ Creates the tables, returns the index statements """
+
+    with open(os.path.join(os.path.dirname(__file__), '..', 'schema', 'sqlite.sql')) as f:
+        statements = [ s.strip() for s in f.read().split(';') if s.strip() ]
+    for statement in statements:
+        if not statement.startswith('CREATE') or ' INDEX ' not in statement:
+            conn.execute(statement)
+    return [ s for s in statements if s.startswith('CREATE') and ' INDEX ' in s ]
+
+# Columns filled for each table. Naming them keeps the statements valid when columns are added to the schema, as
+# long as they are nullable or have a default.
+FOLDER = ('id', 'root', 'name', 'path', 'created', 'has_cover_art', 'cover_art_modification', 'last_scan',
+    'last_modification', 'entry_count', 'rating_sum', 'rating_count', 'rating_avg', 'parent_id')
+ARTIST = ('id', 'name', 'album_count')
+ALBUM = ('id', 'name', 'artist_id', 'song_count', 'duration', 'created', 'year')
+TRACK = ('id', 'disc', 'number', 'title', 'year', 'genre', 'duration', 'album_id', 'artist_id', 'bitrate', 'path', 'size',
+    'content_type', 'created', 'last_modification', 'play_count', 'rating_sum', 'rating_count', 'root_folder_id',
+    'folder_id')
+
+def insert(table, columns):
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+def populate(conn, tracks):
+    root = uid()
+    conn.execute(insert('folder', FOLDER), (root, 1, u'Music', u'/music', 0, 0, 0, 0, 0, 0, 0, 0, None, None))
+
+    samples = { 'paths': [], 'artists': [], 'albums': [], 'folders': [] }
+    track_rows = []
+    for a in range(max(1, tracks // (TRACKS_PER_ALBUM * ALBUMS_PER_ARTIST))):
+        artist, artist_folder = uid(), uid()
+        name = u'Artist {}'.format(a)
+        conn.execute(insert('artist', ARTIST), (artist, name, ALBUMS_PER_ARTIST))
+        conn.execute(insert('folder', FOLDER), (artist_folder, 0, name, u'/music/' + name, 0, 0, 0, 0, 0, 0, 0, 0, None,
+            root))
+        samples['artists'].append((artist, name))
+        samples['folders'].append(artist_folder)
+
+        for b in range(ALBUMS_PER_ARTIST):
+            album, album_folder = uid(), uid()
+            album_path = u'/music/{}/Album {}'.format(name, b)
+            genre = random.choice(GENRES)
+            year = random.randint(1950, 2020)
+            conn.execute(insert('album', ALBUM), (album, u'Album {}'.format(b), artist, TRACKS_PER_ALBUM,
+                180 * TRACKS_PER_ALBUM, 0, year))
+            ratings = [ random.randint(1, 5) for _ in range(random.randint(0, 3)) ]
+            conn.execute(insert('folder', FOLDER), (album_folder, 0, u'Album {}'.format(b), album_path, 0, 0, 0, 0, 0, 0,
+                sum(ratings), len(ratings), float(sum(ratings)) / len(ratings) if ratings else None, artist_folder))
+            samples['albums'].append((album, album_folder))
+
+            for t in range(TRACKS_PER_ALBUM):
+                path = u'{}/{:02} Track.mp3'.format(album_path, t + 1)
+                track_rows.append((uid(), 1, t + 1, u'Track', year, genre, 180, album, artist, 320, path, 4000000,
+                    'audio/mpeg', 0, 0, 0, 0, 0, root, album_folder))
+                samples['paths'].append(path)
+
+    conn.executemany(insert('track', TRACK), track_rows)
+    conn.commit()
+    samples['root'] = root
+    return samples
+
+def queries(samples):
+    rnd = random.Random(42)
+    paths = rnd.sample(samples['paths'], 1000)
+    artists = [ rnd.choice(samples['artists']) for _ in range(1000) ]
+    albums = [ rnd.choice(samples['albums']) for _ in range(1000) ]
+    folders = [ rnd.choice(samples['folders']) for _ in range(1000) ]
+
+    return [
+        ('track by path (x1000)', "SELECT id FROM track WHERE path = ?", [ (p,) for p in paths ]),
+        ('artist by name (x1000)', "SELECT id FROM artist WHERE name = ?", [ (n,) for _, n in artists ]),
+        ('albums of artist (x1000)', "SELECT id FROM album WHERE artist_id = ?", [ (a,) for a, _ in artists ]),
+        ('tracks of album (x1000)', "SELECT id FROM track WHERE album_id = ?", [ (a,) for a, _ in albums ]),
+        ('tracks of folder (x1000)', "SELECT id FROM track WHERE folder_id = ?", [ (f,) for _, f in albums ]),
+        ('children of folder (x1000)', "SELECT id FROM folder WHERE parent_id = ?", [ (f,) for f in folders ]),
+        ('random by genre (x50)', "SELECT id FROM track WHERE genre = ? ORDER BY random() LIMIT 10",
+            [ (rnd.choice(GENRES),) for _ in range(50) ]),
+        ('random by year (x50)', "SELECT id FROM track WHERE year BETWEEN ? AND ? ORDER BY random() LIMIT 10",
+            [ (y, y + 1) for y in (rnd.randint(1950, 2020) for _ in range(50)) ]),
+        ('tracks of root folder (x50)', "SELECT count(*) FROM track WHERE root_folder_id = ?",
+            [ (samples['root'],) ] * 50),
+        ('highest rated folders (x50)',
+            "SELECT id FROM folder WHERE rating_avg IS NOT NULL ORDER BY rating_avg DESC LIMIT 10",
+            [ () ] * 50)
+    ]
+
+def run(conn, benchmark):
+    results = []
+    for name, sql, params in benchmark:
+        start = time.time()
+        for p in params:
+            conn.execute(sql, p).fetchall()
+        results.append(time.time() - start)
+    return results
+
+def main():
+    tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    fd, path = tempfile.mkstemp(suffix = '.db')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        indexes = create_schema(conn)
+        print('Populating {} tracks...'.format(tracks))
+        samples = populate(conn, tracks)
+        benchmark = queries(samples)
+
+        before = run(conn, benchmark)
+        start = time.time()
+        for statement in indexes:
+            conn.execute(statement)
+        conn.commit()
+        print('Created {} indexes in {:.2f}s'.format(len(indexes), time.time() - start))
+        after = run(conn, benchmark)
+        conn.close()
+
+        print('{:<30}{:>12}{:>12}{:>10}'.format('Query', 'Before (s)', 'After (s)', 'Speedup'))
+        for (name, _, _), b, a in zip(benchmark, before, after):
+            print('{:<30}{:>12.3f}{:>12.3f}{:>9.0f}x'.format(name, b, a, b / a if a else float('inf')))
+    finally:
+        os.unlink(path)
+
+if __name__ == '__main__':
+    main()
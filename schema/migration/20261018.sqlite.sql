@@ -0,0 +1,110 @@
+BEGIN TRANSACTION;
+
+ALTER TABLE folder ADD last_modification INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE folder ADD entry_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE folder ADD scan_checkpoint VARCHAR(4096);
+ALTER TABLE folder ADD cover_art VARCHAR(256);
+ALTER TABLE folder ADD cover_art_modification INTEGER NOT NULL DEFAULT 0;
+
+CREATE TABLE scan_job (
+	id CHAR(36) PRIMARY KEY,
+	folder_id CHAR(36) NOT NULL REFERENCES folder,
+	status INTEGER NOT NULL,
+	created INTEGER NOT NULL,
+	started INTEGER NOT NULL,
+	updated INTEGER NOT NULL,
+	finished INTEGER NOT NULL,
+	scanned INTEGER NOT NULL,
+	total INTEGER NOT NULL,
+	added_artists INTEGER NOT NULL,
+	added_albums INTEGER NOT NULL,
+	added_tracks INTEGER NOT NULL,
+	deleted_artists INTEGER NOT NULL,
+	deleted_albums INTEGER NOT NULL,
+	deleted_tracks INTEGER NOT NULL,
+	error VARCHAR(4096)
+);
+
+-- Paths are expected to be unique. Should some be found more than once, only the row with the lowest id is kept: the
+-- subfolders and tracks of the others are moved to it, the stars and ratings given to the others are dropped.
+CREATE TEMPORARY TABLE folder_duplicate AS
+	SELECT d.id AS id, (SELECT k.id FROM folder k WHERE k.path = d.path ORDER BY k.id LIMIT 1) AS keep_id
+	FROM folder d WHERE EXISTS (SELECT 1 FROM folder k WHERE k.path = d.path AND k.id < d.id);
+UPDATE folder SET parent_id = (SELECT keep_id FROM folder_duplicate WHERE folder_duplicate.id = folder.parent_id)
+	WHERE parent_id IN (SELECT id FROM folder_duplicate);
+UPDATE track SET folder_id = (SELECT keep_id FROM folder_duplicate WHERE folder_duplicate.id = track.folder_id)
+	WHERE folder_id IN (SELECT id FROM folder_duplicate);
+UPDATE track SET root_folder_id = (SELECT keep_id FROM folder_duplicate WHERE folder_duplicate.id = track.root_folder_id)
+	WHERE root_folder_id IN (SELECT id FROM folder_duplicate);
+DELETE FROM starred_folder WHERE starred_id IN (SELECT id FROM folder_duplicate);
+DELETE FROM rating_folder WHERE rated_id IN (SELECT id FROM folder_duplicate);
+DELETE FROM folder WHERE id IN (SELECT id FROM folder_duplicate);
+DROP TABLE folder_duplicate;
+
+CREATE TEMPORARY TABLE track_duplicate AS
+	SELECT d.id AS id, (SELECT k.id FROM track k WHERE k.path = d.path ORDER BY k.id LIMIT 1) AS keep_id
+	FROM track d WHERE EXISTS (SELECT 1 FROM track k WHERE k.path = d.path AND k.id < d.id);
+UPDATE user SET last_play_id = (SELECT keep_id FROM track_duplicate WHERE track_duplicate.id = user.last_play_id)
+	WHERE last_play_id IN (SELECT id FROM track_duplicate);
+DELETE FROM starred_track WHERE starred_id IN (SELECT id FROM track_duplicate);
+DELETE FROM rating_track WHERE rated_id IN (SELECT id FROM track_duplicate);
+DELETE FROM track WHERE id IN (SELECT id FROM track_duplicate);
+DROP TABLE track_duplicate;
+
+CREATE UNIQUE INDEX index_folder_path ON folder(path);
+CREATE UNIQUE INDEX index_track_path ON track(path);
+CREATE INDEX index_folder_parent_id ON folder(parent_id);
+CREATE INDEX index_artist_name ON artist(name);
+CREATE INDEX index_album_artist_id ON album(artist_id);
+CREATE INDEX index_track_album_id ON track(album_id);
+CREATE INDEX index_track_artist_id ON track(artist_id);
+CREATE INDEX index_track_folder_id ON track(folder_id);
+CREATE INDEX index_track_root_folder_id ON track(root_folder_id);
+CREATE INDEX index_track_year ON track(year);
+CREATE INDEX index_track_genre ON track(genre);
+
+CREATE TABLE playlist_track (
+	playlist_id CHAR(36) NOT NULL REFERENCES playlist,
+	position INTEGER NOT NULL,
+	track_id CHAR(36) NOT NULL REFERENCES track,
+	PRIMARY KEY (playlist_id, position)
+);
+CREATE INDEX index_playlist_track_track_id ON playlist_track(track_id);
+
+ALTER TABLE artist ADD album_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE album ADD song_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE album ADD duration INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE album ADD created DATETIME;
+ALTER TABLE album ADD year INTEGER;
+ALTER TABLE album ADD cover_folder_id CHAR(36) REFERENCES folder;
+UPDATE artist SET album_count = (SELECT COUNT(*) FROM album WHERE album.artist_id = artist.id);
+UPDATE album SET
+	song_count = (SELECT COUNT(*) FROM track WHERE track.album_id = album.id),
+	duration = (SELECT COALESCE(SUM(duration), 0) FROM track WHERE track.album_id = album.id),
+	created = COALESCE((SELECT MIN(created) FROM track WHERE track.album_id = album.id), CURRENT_TIMESTAMP),
+	year = (SELECT MIN(year) FROM track WHERE track.album_id = album.id AND year != 0),
+	cover_folder_id = (SELECT track.folder_id FROM track JOIN folder ON folder.id = track.folder_id
+		WHERE track.album_id = album.id AND folder.has_cover_art LIMIT 1);
+CREATE INDEX index_album_name ON album(name);
+CREATE INDEX index_album_created ON album(created);
+
+ALTER TABLE folder ADD rating_sum INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE folder ADD rating_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE folder ADD rating_avg REAL;
+ALTER TABLE track ADD rating_sum INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE track ADD rating_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE track ADD rating_avg REAL;
+UPDATE folder SET
+	rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM rating_folder WHERE rated_id = folder.id),
+	rating_count = (SELECT COUNT(*) FROM rating_folder WHERE rated_id = folder.id);
+UPDATE folder SET rating_avg = rating_sum * 1.0 / rating_count WHERE rating_count > 0;
+UPDATE track SET
+	rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM rating_track WHERE rated_id = track.id),
+	rating_count = (SELECT COUNT(*) FROM rating_track WHERE rated_id = track.id);
+UPDATE track SET rating_avg = rating_sum * 1.0 / rating_count WHERE rating_count > 0;
+CREATE INDEX index_folder_rating_avg ON folder(rating_avg);
+
+-- Sizes are filled in when the files are scanned again, or by the watcher's size verifier
+ALTER TABLE track ADD size INTEGER NOT NULL DEFAULT -1;
+
+COMMIT;
@@ -5,19 +5,33 @@ CREATE TABLE folder (
 	path VARCHAR(4096) NOT NULL,
 	created DATETIME NOT NULL,
 	has_cover_art BOOLEAN NOT NULL,
+	cover_art VARCHAR(256),
+	cover_art_modification INTEGER NOT NULL,
 	last_scan INTEGER NOT NULL,
+	last_modification INTEGER NOT NULL,
+	entry_count INTEGER NOT NULL,
+	scan_checkpoint VARCHAR(4096),
+	rating_sum INTEGER NOT NULL,
+	rating_count INTEGER NOT NULL,
+	rating_avg DOUBLE,
 	parent_id CHAR(36) REFERENCES folder
 ) DEFAULT CHARACTER SET utf8 COLLATE utf8_general_ci;
 
 CREATE TABLE artist (
 	id CHAR(36) PRIMARY KEY,
-	name VARCHAR(256) NOT NULL
+	name VARCHAR(256) NOT NULL,
+	album_count INTEGER NOT NULL
 ) DEFAULT CHARACTER SET utf8 COLLATE utf8_general_ci;
 
 CREATE TABLE album (
 	id CHAR(36) PRIMARY KEY,
 	name VARCHAR(256) NOT NULL,
-	artist_id CHAR(36) NOT NULL REFERENCES artist
+	artist_id CHAR(36) NOT NULL REFERENCES artist,
+	song_count INTEGER NOT NULL,
+	duration INTEGER NOT NULL,
+	created DATETIME NOT NULL,
+	year INTEGER,
+	cover_folder_id CHAR(36) REFERENCES folder
 ) DEFAULT CHARACTER SET utf8 COLLATE utf8_general_ci;
 
 CREATE TABLE track (
@@ -32,11 +46,15 @@ CREATE TABLE track (
 	artist_id CHAR(36) NOT NULL REFERENCES artist,
 	bitrate INTEGER NOT NULL,
 	path VARCHAR(4096) NOT NULL,
+	size BIGINT NOT NULL,
 	content_type VARCHAR(32) NOT NULL,
 	created DATETIME NOT NULL,
 	last_modification INTEGER NOT NULL,
 	play_count INTEGER NOT NULL,
 	last_play DATETIME,
+	rating_sum INTEGER NOT NULL,
+	rating_count INTEGER NOT NULL,
+	rating_avg DOUBLE,
 	root_folder_id CHAR(36) NOT NULL REFERENCES folder,
 	folder_id CHAR(36) NOT NULL REFERENCES folder
 ) DEFAULT CHARACTER SET utf8 COLLATE utf8_general_ci;
@@ -121,3 +139,45 @@ CREATE TABLE playlist (
 	tracks TEXT
 ) DEFAULT CHARACTER SET utf8 COLLATE utf8_general_ci;
 
+CREATE TABLE playlist_track (
+	playlist_id CHAR(36) NOT NULL REFERENCES playlist,
+	position INTEGER NOT NULL,
+	track_id CHAR(36) NOT NULL REFERENCES track,
+	PRIMARY KEY (playlist_id, position)
+) DEFAULT CHARACTER SET utf8 COLLATE utf8_general_ci;
+
+CREATE TABLE scan_job (
+	id CHAR(36) PRIMARY KEY,
+	folder_id CHAR(36) NOT NULL REFERENCES folder,
+	status INTEGER NOT NULL,
+	created INTEGER NOT NULL,
+	started INTEGER NOT NULL,
+	updated INTEGER NOT NULL,
+	finished INTEGER NOT NULL,
+	scanned INTEGER NOT NULL,
+	total INTEGER NOT NULL,
+	added_artists INTEGER NOT NULL,
+	added_albums INTEGER NOT NULL,
+	added_tracks INTEGER NOT NULL,
+	deleted_artists INTEGER NOT NULL,
+	deleted_albums INTEGER NOT NULL,
+	deleted_tracks INTEGER NOT NULL,
+	error VARCHAR(4096)
+) DEFAULT CHARACTER SET utf8 COLLATE utf8_general_ci;
+
+-- Paths are too long to be indexed as a whole, only their beginning is and they can't be unique
+CREATE INDEX index_folder_path ON folder(path(255));
+CREATE INDEX index_track_path ON track(path(255));
+CREATE INDEX index_folder_parent_id ON folder(parent_id);
+CREATE INDEX index_folder_rating_avg ON folder(rating_avg);
+CREATE INDEX index_artist_name ON artist(name(255));
+CREATE INDEX index_album_artist_id ON album(artist_id);
+CREATE INDEX index_album_name ON album(name(255));
+CREATE INDEX index_album_created ON album(created);
+CREATE INDEX index_track_album_id ON track(album_id);
+CREATE INDEX index_track_artist_id ON track(artist_id);
+CREATE INDEX index_track_folder_id ON track(folder_id);
+CREATE INDEX index_track_root_folder_id ON track(root_folder_id);
+CREATE INDEX index_track_year ON track(year);
+CREATE INDEX index_track_genre ON track(genre(255));
+CREATE INDEX index_playlist_track_track_id ON playlist_track(track_id);
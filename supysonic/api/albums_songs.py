@@ -23,10 +23,10 @@ import uuid
 
 from datetime import timedelta
 from flask import request, current_app as app
-from storm.expr import Desc, Avg, Min, Max
+from storm.expr import Desc, Avg, Max, Exists, Select, SQL
 from storm.info import ClassAlias
 
-from ..db import Folder, Artist, Album, Track, RatingFolder, StarredFolder, StarredArtist, StarredAlbum, StarredTrack, User
+from ..db import Folder, Artist, Album, Track, StarredFolder, StarredArtist, StarredAlbum, StarredTrack, User
 from ..db import now
 from ..web import store
 
@@ -67,7 +67,7 @@ def rand_songs():
 
     return request.formatter({
         'randomSongs': {
-            'song': [ t.as_subsonic_child(request.user, request.prefs) for t in tracks ]
+            'song': Track.as_subsonic_children(tracks, request.user, request.prefs)
         }
     })
 
@@ -96,13 +96,14 @@ def album_list():
 
         return request.formatter({
             'albumList': {
-                'album': [ a.as_subsonic_child(request.user) for a in albums ]
+                'album': Folder.as_subsonic_children(albums, request.user)
             }
         })
     elif ltype == 'newest':
         query = query.order_by(Desc(Folder.created)).config(distinct = True)
     elif ltype == 'highest':
-        query = query.find(RatingFolder.rated_id == Folder.id).group_by(Folder.id).order_by(Desc(Avg(RatingFolder.rating)))
+        query = store.find(Folder, Folder.rating_avg != None, Exists(Select(SQL('1'), Track.folder_id == Folder.id, tables = Track))) \
+            .order_by(Desc(Folder.rating_avg))
     elif ltype == 'frequent':
         query = query.group_by(Folder.id).order_by(Desc(Avg(Track.play_count)))
     elif ltype == 'recent':
@@ -119,7 +120,7 @@ def album_list():
 
     return request.formatter({
         'albumList': {
-            'album': [ f.as_subsonic_child(request.user) for f in query[offset:offset+size] ]
+            'album': Folder.as_subsonic_children(query[offset:offset+size], request.user)
         }
     })
 
@@ -148,11 +149,11 @@ def album_list_id3():
 
         return request.formatter({
             'albumList2': {
-                'album': [ a.as_subsonic_album(request.user) for a in albums ]
+                'album': Album.as_subsonic_albums(albums, request.user)
             }
         })
     elif ltype == 'newest':
-        query = query.find(Track.album_id == Album.id).group_by(Album.id).order_by(Desc(Min(Track.created)))
+        query = query.order_by(Desc(Album.created))
     elif ltype == 'frequent':
         query = query.find(Track.album_id == Album.id).group_by(Album.id).order_by(Desc(Avg(Track.play_count)))
     elif ltype == 'recent':
@@ -168,32 +169,35 @@ def album_list_id3():
 
     return request.formatter({
         'albumList2': {
-            'album': [ f.as_subsonic_album(request.user) for f in query[offset:offset+size] ]
+            'album': Album.as_subsonic_albums(query[offset:offset+size], request.user)
         }
     })
 
 @app.route('/rest/getNowPlaying.view', methods = [ 'GET', 'POST' ])
 def now_playing():
-    query = store.find(User, Track.id == User.last_play_id)
+    query = store.find((User, Track), Track.id == User.last_play_id)
+    playing = [ (u, t) for u, t in query if u.last_play_date + timedelta(seconds = t.duration * 2) > now() ]
+    children = Track.as_subsonic_children([ t for u, t in playing ], request.user, request.prefs)
 
     return request.formatter({
         'nowPlaying': {
             'entry': [ dict(
-                u.last_play.as_subsonic_child(request.user, request.prefs).items() +
+                child.items() +
                 { 'username': u.name, 'minutesAgo': (now() - u.last_play_date).seconds / 60, 'playerId': 0 }.items()
-            ) for u in query if u.last_play_date + timedelta(seconds = u.last_play.duration * 2) > now() ]
+            ) for (u, t), child in zip(playing, children) ]
         }
     })
 
 @app.route('/rest/getStarred.view', methods = [ 'GET', 'POST' ])
 def get_starred():
-    folders = store.find(StarredFolder, StarredFolder.user_id == User.id, User.name == request.username)
+    starred = ClassAlias(Folder)
+    folders = store.find(starred, StarredFolder.starred_id == starred.id, StarredFolder.user_id == User.id, User.name == request.username)
 
     return request.formatter({
         'starred': {
-            'artist': [ { 'id': str(sf.starred_id), 'name': sf.starred.name } for sf in folders.find(Folder.parent_id == StarredFolder.starred_id, Track.folder_id == Folder.id).config(distinct = True) ],
-            'album': [ sf.starred.as_subsonic_child(request.user) for sf in folders.find(Track.folder_id == StarredFolder.starred_id).config(distinct = True) ],
-            'song': [ st.starred.as_subsonic_child(request.user, request.prefs) for st in store.find(StarredTrack, StarredTrack.user_id == User.id, User.name == request.username) ]
+            'artist': [ { 'id': str(f.id), 'name': f.name } for f in folders.find(Folder.parent_id == starred.id, Track.folder_id == Folder.id).config(distinct = True) ],
+            'album': Folder.as_subsonic_children(folders.find(Track.folder_id == starred.id).config(distinct = True), request.user),
+            'song': Track.as_subsonic_children(store.find(Track, StarredTrack.starred_id == Track.id, StarredTrack.user_id == User.id, User.name == request.username), request.user, request.prefs)
         }
     })
 
@@ -201,9 +205,9 @@ def get_starred():
 def get_starred_id3():
     return request.formatter({
         'starred2': {
-            'artist': [ sa.starred.as_subsonic_artist(request.user) for sa in store.find(StarredArtist, StarredArtist.user_id == User.id, User.name == request.username) ],
-            'album': [ sa.starred.as_subsonic_album(request.user) for sa in store.find(StarredAlbum, StarredAlbum.user_id == User.id, User.name == request.username) ],
-            'song': [ st.starred.as_subsonic_child(request.user, request.prefs) for st in store.find(StarredTrack, StarredTrack.user_id == User.id, User.name == request.username) ]
+            'artist': Artist.as_subsonic_artists(store.find(Artist, StarredArtist.starred_id == Artist.id, StarredArtist.user_id == User.id, User.name == request.username), request.user),
+            'album': Album.as_subsonic_albums(store.find(Album, StarredAlbum.starred_id == Album.id, StarredAlbum.user_id == User.id, User.name == request.username), request.user),
+            'song': Track.as_subsonic_children(store.find(Track, StarredTrack.starred_id == Track.id, StarredTrack.user_id == User.id, User.name == request.username), request.user, request.prefs)
         }
     })
 
@@ -150,26 +150,16 @@ def rate():
         return request.error_formatter(0, 'rating must be between 0 and 5 (inclusive)')
 
     if rating == 0:
-        store.find(RatingTrack, RatingTrack.user_id == request.user.id, RatingTrack.rated_id == uid).remove()
-        store.find(RatingFolder, RatingFolder.user_id == request.user.id, RatingFolder.rated_id == uid).remove()
+        RatingTrack.rate(store, request.user.id, uid, 0)
+        RatingFolder.rate(store, request.user.id, uid, 0)
     else:
-        rated = store.get(Track, uid)
         rating_ent = RatingTrack
-        if not rated:
-            rated = store.get(Folder, uid)
+        if not store.get(Track, uid):
             rating_ent = RatingFolder
-            if not rated:
+            if not store.get(Folder, uid):
                 return request.error_formatter(70, 'Unknown id')
 
-        rating_info = store.get(rating_ent, (request.user.id, uid))
-        if rating_info:
-            rating_info.rating = rating
-        else:
-            rating_info = rating_ent()
-            rating_info.user_id = request.user.id
-            rating_info.rated_id = uid
-            rating_info.rating = rating
-            store.add(rating_info)
+        rating_ent.rate(store, request.user.id, uid, rating)
 
     store.commit()
     return request.formatter({})
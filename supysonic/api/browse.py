@@ -101,7 +101,7 @@ def list_indexes():
                     'name': a.name
                 } for a in sorted(v, key = lambda a: a.name.lower()) ]
             } for k, v in sorted(indexes.iteritems()) ],
-            'child': [ c.as_subsonic_child(request.user, request.prefs) for c in sorted(childs, key = lambda t: t.sort_key()) ]
+            'child': Track.as_subsonic_children(sorted(childs, key = lambda t: t.sort_key()), request.user, request.prefs)
         }
     })
 
@@ -114,7 +114,7 @@ def show_directory():
     directory = {
         'id': str(res.id),
         'name': res.name,
-        'child': [ f.as_subsonic_child(request.user) for f in sorted(res.children, key = lambda c: c.name.lower()) ] + [ t.as_subsonic_child(request.user, request.prefs) for t in sorted(res.tracks, key = lambda t: t.sort_key()) ]
+        'child': Folder.as_subsonic_children(sorted(res.children, key = lambda c: c.name.lower()), request.user) + Track.as_subsonic_children(sorted(res.tracks, key = lambda t: t.sort_key()), request.user, request.prefs)
     }
     if not res.root:
         directory['parent'] = str(res.parent_id)
@@ -125,7 +125,9 @@ def show_directory():
 def list_artists():
     # According to the API page, there are no parameters?
     indexes = {}
-    for artist in store.find(Artist):
+    artists = list(store.find(Artist))
+    infos = dict(zip([ a.id for a in artists ], Artist.as_subsonic_artists(artists, request.user)))
+    for artist in artists:
         index = artist.name[0].upper() if artist.name else '?'
         if index in map(str, xrange(10)):
             index = '#'
@@ -141,7 +143,7 @@ def list_artists():
         'artists': {
             'index': [ {
                 'name': k,
-                'artist': [ a.as_subsonic_artist(request.user) for a in sorted(v, key = lambda a: a.name.lower()) ]
+                'artist': [ infos[a.id] for a in sorted(v, key = lambda a: a.name.lower()) ]
             } for k, v in sorted(indexes.iteritems()) ]
         }
     })
@@ -155,7 +157,7 @@ def artist_info():
     info = res.as_subsonic_artist(request.user)
     albums  = set(res.albums)
     albums |= { t.album for t in res.tracks }
-    info['album'] = [ a.as_subsonic_album(request.user) for a in sorted(albums, key = lambda a: a.sort_key()) ]
+    info['album'] = Album.as_subsonic_albums(sorted(albums, key = lambda a: a.sort_key()), request.user)
 
     return request.formatter({ 'artist': info })
 
@@ -166,7 +168,7 @@ def album_info():
         return res
 
     info = res.as_subsonic_album(request.user)
-    info['song'] = [ t.as_subsonic_child(request.user, request.prefs) for t in sorted(res.tracks, key = lambda t: t.sort_key()) ]
+    info['song'] = Track.as_subsonic_children(sorted(res.tracks, key = lambda t: t.sort_key()), request.user, request.prefs)
 
     return request.formatter({ 'album': info })
 
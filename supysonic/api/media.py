@@ -23,6 +23,7 @@ import mimetypes
 import os.path
 import requests
 import subprocess
+import tempfile
 
 from flask import request, send_file, Response, current_app as app
 from PIL import Image
@@ -141,7 +142,9 @@ def cover_art():
     if not status:
         return res
 
-    if not res.has_cover_art or not os.path.isfile(os.path.join(res.path, 'cover.jpg')):
+    # Folders not scanned since the cover art file name is recorded only know about cover.jpg
+    cover_path = os.path.join(res.path, res.cover_art or 'cover.jpg')
+    if not res.has_cover_art or not os.path.isfile(cover_path):
         return request.error_formatter(70, 'Cover art not found')
 
     size = request.values.get('size')
@@ -151,21 +154,35 @@ def cover_art():
         except:
             return request.error_formatter(0, 'Invalid size value')
     else:
-        return send_file(os.path.join(res.path, 'cover.jpg'))
+        return send_file(cover_path)
 
-    im = Image.open(os.path.join(res.path, 'cover.jpg'))
+    im = Image.open(cover_path)
     if size > im.size[0] and size > im.size[1]:
-        return send_file(os.path.join(res.path, 'cover.jpg'))
+        return send_file(cover_path)
 
+    # Thumbnails of a replaced cover art have a different name
     size_path = os.path.join(app.config['WEBAPP']['cache_dir'], str(size))
-    path = os.path.abspath(os.path.join(size_path, str(res.id)))
+    path = os.path.abspath(os.path.join(size_path, '{}-{}'.format(res.id, res.cover_art_modification)))
     if os.path.exists(path):
         return send_file(path, mimetype = 'image/jpeg')
     if not os.path.exists(size_path):
         os.makedirs(size_path)
 
     im.thumbnail([size, size], Image.ANTIALIAS)
-    im.save(path, 'JPEG')
+    # JPEG has no alpha channel nor palette
+    if im.mode not in ('RGB', 'L'):
+        im = im.convert('RGB')
+
+    # Written aside then moved in place so that a failure doesn't leave a broken thumbnail in the cache
+    fd, tmp_path = tempfile.mkstemp(dir = size_path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            im.save(f, 'JPEG')
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
     return send_file(path, mimetype = 'image/jpeg')
 
 @app.route('/rest/getLyrics.view', methods = [ 'GET', 'POST' ])
@@ -55,7 +55,7 @@ def show_playlist():
         return request.error_formatter('50', 'Private playlist')
 
     info = res.as_subsonic_playlist(request.user)
-    info['entry'] = [ t.as_subsonic_child(request.user, request.prefs) for t in res.get_tracks() ]
+    info['entry'] = Track.as_subsonic_children(res.get_tracks(), request.user, request.prefs)
     return request.formatter({ 'playlist': info })
 
 @app.route('/rest/createPlaylist.view', methods = [ 'GET', 'POST' ])
@@ -109,6 +109,7 @@ def delete_playlist():
     if res.user_id != request.user.id and not request.user.admin:
         return request.error_formatter(50, "You're not allowed to delete a playlist that isn't yours")
 
+    res.clear()
     store.remove(res)
     store.commit()
     return request.formatter({})
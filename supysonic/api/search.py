@@ -25,6 +25,14 @@ from storm.info import ClassAlias
 from ..db import Folder, Track, Artist, Album
 from ..web import store
 
+def _children(entities):
+    """ Formats a list of folders and tracks, keeping their order """
+
+    entities = list(entities)
+    folders = iter(Folder.as_subsonic_children([ e for e in entities if isinstance(e, Folder) ], request.user))
+    tracks = iter(Track.as_subsonic_children([ e for e in entities if isinstance(e, Track) ], request.user, request.prefs))
+    return [ next(folders) if isinstance(e, Folder) else next(tracks) for e in entities ]
+
 @app.route('/rest/search.view', methods = [ 'GET', 'POST' ])
 def old_search():
     artist, album, title, anyf, count, offset, newer_than = map(request.values.get, [ 'artist', 'album', 'title', 'any', 'count', 'offset', 'newerThan' ])
@@ -56,7 +64,7 @@ def old_search():
         return request.formatter({ 'searchResult': {
             'totalHits': folders.count() + tracks.count(),
             'offset': offset,
-            'match': [ r.as_subsonic_child(request.user) if isinstance(r, Folder) else r.as_subsonic_child(request.user, request.prefs) for r in res ]
+            'match': _children(res)
         }})
     else:
         return request.error_formatter(10, 'Missing search parameter')
@@ -64,7 +72,7 @@ def old_search():
     return request.formatter({ 'searchResult': {
         'totalHits': query.count(),
         'offset': offset,
-        'match': [ r.as_subsonic_child(request.user) if isinstance(r, Folder) else r.as_subsonic_child(request.user, request.prefs) for r in query[offset : offset + count] ]
+        'match': _children(query[offset : offset + count])
     }})
 
 @app.route('/rest/search2.view', methods = [ 'GET', 'POST' ])
@@ -92,8 +100,8 @@ def new_search():
 
     return request.formatter({ 'searchResult2': {
         'artist': [ { 'id': str(a.id), 'name': a.name } for a in artist_query ],
-        'album': [ f.as_subsonic_child(request.user) for f in album_query ],
-        'song': [ t.as_subsonic_child(request.user, request.prefs) for t in song_query ]
+        'album': Folder.as_subsonic_children(album_query, request.user),
+        'song': Track.as_subsonic_children(song_query, request.user, request.prefs)
     }})
 
 @app.route('/rest/search3.view', methods = [ 'GET', 'POST' ])
@@ -119,8 +127,8 @@ def search_id3():
     song_query = store.find(Track, Track.title.contains_string(query))[song_offset : song_offset + song_count]
 
     return request.formatter({ 'searchResult3': {
-        'artist': [ a.as_subsonic_artist(request.user) for a in artist_query ],
-        'album': [ a.as_subsonic_album(request.user) for a in album_query ],
-        'song': [ t.as_subsonic_child(request.user, request.prefs) for t in song_query ]
+        'artist': Artist.as_subsonic_artists(artist_query, request.user),
+        'album': Album.as_subsonic_albums(album_query, request.user),
+        'song': Track.as_subsonic_children(song_query, request.user, request.prefs)
     }})
 
@@ -25,9 +25,10 @@ import getpass
 import sys
 import time
 
-from .db import get_store, Folder, User
+from .db import get_pool, Folder, User
 from .managers.folder import FolderManager
 from .managers.user import UserManager
+from .metrics import fetch_metrics
 from .scanner import Scanner
 
 class TimedProgressDisplay:
@@ -105,7 +106,7 @@ class SupysonicCLI(cmd.Cmd):
                 for action, subparser in getattr(self.__class__, command + '_subparsers').choices.iteritems():
                     setattr(self, 'help_{} {}'.format(command, action), subparser.print_help)
 
-        self.__store = get_store(config.BASE['database_uri'])
+        self.__store = get_pool(config.BASE['database_uri'], config.BASE['database_pool_size']).get()
 
     def write_line(self, line = ''):
         self.stdout.write(line + '\n')
@@ -147,6 +148,10 @@ class SupysonicCLI(cmd.Cmd):
     folder_scan_parser = folder_subparsers.add_parser('scan', help = 'Run a scan on specified folders', add_help = False)
     folder_scan_parser.add_argument('folders', metavar = 'folder', nargs = '*', help = 'Folder(s) to be scanned. If ommitted, all folders are scanned')
     folder_scan_parser.add_argument('-f', '--force', action = 'store_true', help = "Force scan of already know files even if they haven't changed")
+    folder_scan_parser.add_argument('-i', '--incremental', action = 'store_true', help = "Only scan directories that changed since the last scan. Files modified in place aren't detected")
+    folder_scan_parser.add_argument('-j', '--jobs', type = int, help = 'Number of processes used to read the tags. 0 uses one process per CPU. Defaults to the scanner_workers setting')
+    folder_scan_parser.add_argument('-c', '--commit-every', type = int, metavar = 'N', help = 'Commit changes to the database every N scanned files. 0 commits once everything is scanned. Defaults to the scanner_commit_every setting')
+    folder_scan_parser.add_argument('-r', '--resume', action = 'store_true', help = 'Resume an interrupted scan from its last commit')
 
     def folder_list(self):
         self.write_line('Name\t\tPath\n----\t\t----')
@@ -166,21 +171,35 @@ class SupysonicCLI(cmd.Cmd):
         else:
             self.write_line("Deleted folder '{}'".format(name))
 
-    def folder_scan(self, folders, force):
+    def folder_scan(self, folders, force, incremental, jobs, commit_every, resume):
         extensions = self.__config.BASE['scanner_extensions']
         if extensions:
             extensions = extensions.split(' ')
-        scanner = Scanner(self.__store, force = force, extensions = extensions)
+        cover_names = self.__config.BASE['scanner_cover_names']
+        if cover_names:
+            cover_names = cover_names.split(' ')
+        if jobs is None:
+            jobs = self.__config.BASE['scanner_workers']
+        if jobs < 0:
+            self.write_error_line('Invalid number of jobs')
+            return
+        if commit_every is None:
+            commit_every = self.__config.BASE['scanner_commit_every']
+        if commit_every < 0:
+            self.write_error_line('Invalid commit interval')
+            return
+        scanner = Scanner(self.__store, force = force, extensions = extensions, workers = jobs, incremental = incremental, commit_every = commit_every,
+            cover_names = cover_names)
         if folders:
             folders = map(lambda n: self.__store.find(Folder, Folder.name == n, Folder.root == True).one() or n, folders)
             if any(map(lambda f: isinstance(f, basestring), folders)):
                 self.write_line("No such folder(s): " + ' '.join(f for f in folders if isinstance(f, basestring)))
             for folder in filter(lambda f: isinstance(f, Folder), folders):
-                scanner.scan(folder, TimedProgressDisplay(folder.name, self.stdout))
+                scanner.scan(folder, TimedProgressDisplay(folder.name, self.stdout), resume)
                 self.write_line()
         else:
             for folder in self.__store.find(Folder, Folder.root == True):
-                scanner.scan(folder, TimedProgressDisplay(folder.name, self.stdout))
+                scanner.scan(folder, TimedProgressDisplay(folder.name, self.stdout), resume)
                 self.write_line()
 
         scanner.finish()
@@ -191,6 +210,40 @@ class SupysonicCLI(cmd.Cmd):
         self.write_line('Added: %i artists, %i albums, %i tracks' % (added[0], added[1], added[2]))
         self.write_line('Deleted: %i artists, %i albums, %i tracks' % (deleted[0], deleted[1], deleted[2]))
 
+    watcher_parser = CLIParser(prog = 'watcher', add_help = False)
+    watcher_subparsers = watcher_parser.add_subparsers(dest = 'action')
+    watcher_status_parser = watcher_subparsers.add_parser('status', help = "Shows the watcher daemon's metrics", add_help = False)
+    watcher_status_parser.add_argument('address', nargs = '?', help = 'host:port the metrics are served on. Defaults to the metrics_address setting')
+
+    def watcher_status(self, address):
+        address = address or self.__config.DAEMON['metrics_address']
+        if not address:
+            self.write_error_line('No metrics address set')
+            return
+
+        try:
+            metrics = fetch_metrics(address)
+        except Exception, e:
+            self.write_error_line("Can't query the watcher: {}".format(e))
+            return
+
+        def value(name):
+            return metrics.get(name, ({}, 0))[1]
+
+        def average(name):
+            count = value(name + '_count')
+            return value(name + '_sum') * 1000 / count if count else 0
+
+        self.write_line('Pending events: %i' % value('queue_depth'))
+        self.write_line('Oldest pending event: %.1fs' % value('oldest_event_age_seconds'))
+        self.write_line('Processed events: %i (%.2f/s)' % (value('events_processed_total'), value('events_per_second')))
+        self.write_line('Average scan time: %.1fms (%i files)' % (average('scan_seconds'), value('scan_seconds_count')))
+        self.write_line('Average commit time: %.1fms (%i commits)' % (average('commit_seconds'), value('commit_seconds_count')))
+        self.write_line('Errors: %i' % value('errors_total'))
+        if 'last_error_timestamp_seconds' in metrics:
+            labels, timestamp = metrics['last_error_timestamp_seconds']
+            self.write_line(u'Last error: {} ({})'.format(labels.get('message'), time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))))
+
     user_parser = CLIParser(prog = 'user', add_help = False)
     user_subparsers = user_parser.add_subparsers(dest = 'action')
     user_subparsers.add_parser('list', help = 'List users', add_help = False)
@@ -21,7 +21,11 @@ class DefaultConfig(object):
     tempdir = os.path.join(tempfile.gettempdir(), 'supysonic')
     BASE = {
         'database_uri': 'sqlite://' + os.path.join(tempdir, 'supysonic.db'),
-        'scanner_extensions': None
+        'database_pool_size': 10,
+        'scanner_extensions': None,
+        'scanner_cover_names': None,
+        'scanner_workers': 1,
+        'scanner_commit_every': 1000
     }
     WEBAPP = {
         'cache_dir': tempdir,
@@ -33,6 +37,15 @@ class DefaultConfig(object):
     }
     DAEMON = {
         'wait_delay': 5,
+        'settle_delay': 1,
+        'max_wait_delay': 60,
+        'max_watches': None,
+        'watch_depth': 1,
+        'poll_interval': 60,
+        'journal_file': os.path.join(tempdir, 'watcher.journal'),
+        'startup_scan': True,
+        'metrics_address': None,
+        'size_check_interval': 0,
         'log_file': None,
         'log_level': 'WARNING'
     }
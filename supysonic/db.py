@@ -21,16 +21,59 @@
 from storm.properties import *
 from storm.references import Reference, ReferenceSet
 from storm.database import create_database
+from storm.expr import And, Count, Func, Min, Select, SQL, Sum, Update
 from storm.store import Store
+from storm.uri import URI
 from storm.variables import Variable
 
 import uuid, datetime, time
+import logging
 import mimetypes
 import os.path
+import threading
+
+# Maximum number of values in the IN lists of bulk queries, to stay under the databases' limits on parameters
+IN_CHUNK_SIZE = 500
 
 def now():
     return datetime.datetime.now().replace(microsecond = 0)
 
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        yield values[i:i + IN_CHUNK_SIZE]
+
+def _get_many(store, cls, ids):
+    """ Returns the objects of a class having one of the given ids, indexed by id """
+
+    objects = {}
+    for chunk in _chunks(ids):
+        objects.update((o.id, o) for o in store.find(cls, cls.id.is_in(chunk)))
+    return objects
+
+def _annotations(store, starred_cls, rating_cls, user, ids):
+    """ Returns the starring dates and ratings given by a user to a list of objects, as dicts indexed by object id """
+
+    starred, ratings = {}, {}
+    for chunk in _chunks(ids):
+        starred.update(store.find((starred_cls.starred_id, starred_cls.date), starred_cls.user_id == user.id,
+            starred_cls.starred_id.is_in(chunk)))
+        if rating_cls is None:
+            continue
+        ratings.update(store.find((rating_cls.rated_id, rating_cls.rating), rating_cls.user_id == user.id,
+            rating_cls.rated_id.is_in(chunk)))
+    return starred, ratings
+
+def _average_rating(rated):
+    return float(rated.rating_sum) / rated.rating_count if rated.rating_count else None
+
+def _from_db(column, value):
+    """ Converts a raw value, as returned by the database for an aggregate of a column, to the column's type """
+
+    variable = column.variable_factory(allow_none = True)
+    variable.set(value, from_db = True)
+    return variable.get()
+
 class UnicodeOrStrVariable(Variable):
     __slots__ = ()
 
@@ -52,58 +95,109 @@ class Folder(object):
     path = Unicode() # unique
     created = DateTime(default_factory = now)
     has_cover_art = Bool(default = False)
+    cover_art = Unicode() # nullable
+    cover_art_modification = Int(default = 0)
     last_scan = Int(default = 0)
+    last_modification = Int(default = 0)
+    entry_count = Int(default = 0)
+    scan_checkpoint = Unicode() # nullable
+    rating_sum = Int(default = 0) # totals of the ratings, maintained by BaseRating.rate
+    rating_count = Int(default = 0)
+    rating_avg = Float() # nullable, rating_sum / rating_count
 
     parent_id = UUID() # nullable
     parent = Reference(parent_id, id)
     children = ReferenceSet(id, parent_id)
 
     def as_subsonic_child(self, user):
-        info = {
-            'id': str(self.id),
-            'isDir': True,
-            'title': self.name,
-            'album': self.name,
-            'created': self.created.isoformat()
-        }
-        if not self.root:
-            info['parent'] = str(self.parent_id)
-            info['artist'] = self.parent.name
-        if self.has_cover_art:
-            info['coverArt'] = str(self.id)
-
-        starred = Store.of(self).get(StarredFolder, (user.id, self.id))
-        if starred:
-            info['starred'] = starred.date.isoformat()
-
-        rating = Store.of(self).get(RatingFolder, (user.id, self.id))
-        if rating:
-            info['userRating'] = rating.rating
-        avgRating = Store.of(self).find(RatingFolder, RatingFolder.rated_id == self.id).avg(RatingFolder.rating)
-        if avgRating:
-            info['averageRating'] = avgRating
+        return Folder.as_subsonic_children([ self ], user)[0]
 
-        return info
+    @staticmethod
+    def as_subsonic_children(folders, user):
+        """ Same as as_subsonic_child for a list of folders, fetching their parents and annotations with a few queries for
+        the whole list """
+
+        folders = list(folders)
+        if not folders:
+            return []
+
+        store = Store.of(folders[0])
+        parents = _get_many(store, Folder, { f.parent_id for f in folders if not f.root })
+        starred, ratings = _annotations(store, StarredFolder, RatingFolder, user, { f.id for f in folders })
+
+        children = []
+        for folder in folders:
+            info = {
+                'id': str(folder.id),
+                'isDir': True,
+                'title': folder.name,
+                'album': folder.name,
+                'created': folder.created.isoformat()
+            }
+            if not folder.root:
+                info['parent'] = str(folder.parent_id)
+                info['artist'] = parents[folder.parent_id].name
+            if folder.has_cover_art:
+                info['coverArt'] = str(folder.id)
+
+            if folder.id in starred:
+                info['starred'] = starred[folder.id].isoformat()
+
+            if folder.id in ratings:
+                info['userRating'] = ratings[folder.id]
+            avgRating = _average_rating(folder)
+            if avgRating:
+                info['averageRating'] = avgRating
+
+            children.append(info)
+
+        return children
 
 class Artist(object):
     __storm_table__ = 'artist'
 
     id = UUID(primary = True, default_factory = uuid.uuid4)
     name = Unicode() # unique
+    album_count = Int(default = 0) # maintained by the scanner, see update_stats
 
     def as_subsonic_artist(self, user):
-        info = {
-            'id': str(self.id),
-            'name': self.name,
-            # coverArt
-            'albumCount': self.albums.count()
-        }
+        return Artist.as_subsonic_artists([ self ], user)[0]
 
-        starred = Store.of(self).get(StarredArtist, (user.id, self.id))
-        if starred:
-            info['starred'] = starred.date.isoformat()
+    @staticmethod
+    def as_subsonic_artists(artists, user):
+        """ Same as as_subsonic_artist for a list of artists, fetching their stars with a single query """
 
-        return info
+        artists = list(artists)
+        if not artists:
+            return []
+
+        store = Store.of(artists[0])
+        starred = _annotations(store, StarredArtist, None, user, { a.id for a in artists })[0]
+
+        infos = []
+        for artist in artists:
+            info = {
+                'id': str(artist.id),
+                'name': artist.name,
+                # coverArt
+                'albumCount': artist.album_count
+            }
+
+            if artist.id in starred:
+                info['starred'] = starred[artist.id].isoformat()
+
+            infos.append(info)
+
+        return infos
+
+    @staticmethod
+    def update_stats(store, ids):
+        """ Recounts the albums of the given artists """
+
+        for chunk in _chunks(ids):
+            counts = dict(store.find((Album.artist_id, Count()), Album.artist_id.is_in(chunk)).group_by(Album.artist_id))
+            for artist in store.find(Artist, Artist.id.is_in(chunk)):
+                artist.album_count = counts.get(artist.id, 0)
 
 class Album(object):
     __storm_table__ = 'album'
@@ -113,30 +207,74 @@ class Album(object):
     artist_id = UUID()
     artist = Reference(artist_id, Artist.id)
 
+    # Figures about the tracks of the album, maintained by the scanner, see update_stats
+    song_count = Int(default = 0)
+    duration = Int(default = 0)
+    created = DateTime(default_factory = now)
+    year = Int() # nullable
+    cover_folder_id = UUID() # nullable
+
     def as_subsonic_album(self, user):
-        info = {
-            'id': str(self.id),
-            'name': self.name,
-            'artist': self.artist.name,
-            'artistId': str(self.artist_id),
-            'songCount': self.tracks.count(),
-            'duration': sum(self.tracks.values(Track.duration)),
-            'created': min(self.tracks.values(Track.created)).isoformat()
-        }
+        return Album.as_subsonic_albums([ self ], user)[0]
 
-        track_with_cover = self.tracks.find(Track.folder_id == Folder.id, Folder.has_cover_art).any()
-        if track_with_cover:
-            info['coverArt'] = str(track_with_cover.folder_id)
+    @staticmethod
+    def as_subsonic_albums(albums, user):
+        """ Same as as_subsonic_album for a list of albums, fetching their artists and stars with a query each """
 
-        starred = Store.of(self).get(StarredAlbum, (user.id, self.id))
-        if starred:
-            info['starred'] = starred.date.isoformat()
+        albums = list(albums)
+        if not albums:
+            return []
 
-        return info
+        store = Store.of(albums[0])
+        artists = _get_many(store, Artist, { a.artist_id for a in albums })
+        starred = _annotations(store, StarredAlbum, None, user, { a.id for a in albums })[0]
+
+        infos = []
+        for album in albums:
+            info = {
+                'id': str(album.id),
+                'name': album.name,
+                'artist': artists[album.artist_id].name,
+                'artistId': str(album.artist_id),
+                'songCount': album.song_count,
+                'duration': album.duration,
+                'created': album.created.isoformat()
+            }
+
+            if album.cover_folder_id:
+                info['coverArt'] = str(album.cover_folder_id)
+
+            if album.id in starred:
+                info['starred'] = starred[album.id].isoformat()
+
+            infos.append(info)
+
+        return infos
+
+    @staticmethod
+    def update_stats(store, ids):
+        """ Recomputes the figures about the tracks of the given albums """
+
+        for chunk in _chunks(ids):
+            stats = {}
+            for album_id, count, duration, created in store.find((Track.album_id, Count(), Sum(Track.duration),
+                    Min(Track.created)), Track.album_id.is_in(chunk)).group_by(Track.album_id):
+                stats[album_id] = (count, int(duration or 0), _from_db(Track.created, created))
+            years = dict(store.find((Track.album_id, Min(Track.year)), Track.album_id.is_in(chunk), Track.year != 0)
+                .group_by(Track.album_id))
+            covers = {}
+            for album_id, folder_id in store.find((Track.album_id, Track.folder_id), Track.album_id.is_in(chunk),
+                    Track.folder_id == Folder.id, Folder.has_cover_art).config(distinct = True):
+                covers.setdefault(album_id, folder_id)
+
+            for album in store.find(Album, Album.id.is_in(chunk)):
+                album.song_count, album.duration, created = stats.get(album.id, (0, 0, None))
+                album.created = created or album.created
+                album.year = years.get(album.id)
+                album.cover_folder_id = covers.get(album.id)
 
     def sort_key(self):
-        year = min(map(lambda t: t.year if t.year else 9999, self.tracks))
-        return '%i%s' % (year, self.name.lower())
+        return '%i%s' % (self.year or 9999, self.name.lower())
 
 Artist.albums = ReferenceSet(Artist.id, Album.artist_id)
 
@@ -157,6 +295,7 @@ class Track(object):
     bitrate = Int()
 
     path = Unicode() # unique
+    size = Int(default = -1) # -1 if unknown
     content_type = Unicode()
     created = DateTime(default_factory = now)
     last_modification = Int()
@@ -164,57 +303,81 @@ class Track(object):
     play_count = Int(default = 0)
     last_play = DateTime() # nullable
 
+    rating_sum = Int(default = 0) # totals of the ratings, maintained by BaseRating.rate
+    rating_count = Int(default = 0)
+    rating_avg = Float() # nullable, rating_sum / rating_count
+
     root_folder_id = UUID()
     root_folder = Reference(root_folder_id, Folder.id)
     folder_id = UUID()
     folder = Reference(folder_id, Folder.id)
 
     def as_subsonic_child(self, user, prefs):
-        info = {
-            'id': str(self.id),
-            'parent': str(self.folder_id),
-            'isDir': False,
-            'title': self.title,
-            'album': self.album.name,
-            'artist': self.artist.name,
-            'track': self.number,
-            'size': os.path.getsize(self.path) if os.path.isfile(self.path) else -1,
-            'contentType': self.content_type,
-            'suffix': self.suffix(),
-            'duration': self.duration,
-            'bitRate': self.bitrate,
-            'path': self.path[len(self.root_folder.path) + 1:],
-            'isVideo': False,
-            'discNumber': self.disc,
-            'created': self.created.isoformat(),
-            'albumId': str(self.album_id),
-            'artistId': str(self.artist_id),
-            'type': 'music'
-        }
-
-        if self.year:
-            info['year'] = self.year
-        if self.genre:
-            info['genre'] = self.genre
-        if self.folder.has_cover_art:
-            info['coverArt'] = str(self.folder_id)
+        return Track.as_subsonic_children([ self ], user, prefs)[0]
 
-        starred = Store.of(self).get(StarredTrack, (user.id, self.id))
-        if starred:
-            info['starred'] = starred.date.isoformat()
+    @staticmethod
+    def as_subsonic_children(tracks, user, prefs):
+        """ Same as as_subsonic_child for a list of tracks, fetching what they refer to with a few queries for the whole
+        list rather than several queries per track """
 
-        rating = Store.of(self).get(RatingTrack, (user.id, self.id))
-        if rating:
-            info['userRating'] = rating.rating
-        avgRating = Store.of(self).find(RatingTrack, RatingTrack.rated_id == self.id).avg(RatingTrack.rating)
-        if avgRating:
-            info['averageRating'] = avgRating
+        tracks = list(tracks)
+        if not tracks:
+            return []
 
-        if prefs and prefs.format and prefs.format != self.suffix():
-            info['transcodedSuffix'] = prefs.format
-            info['transcodedContentType'] = mimetypes.guess_type('dummyname.' + prefs.format, False)[0] or 'application/octet-stream'
-
-        return info
+        store = Store.of(tracks[0])
+        ids = { t.id for t in tracks }
+        albums = _get_many(store, Album, { t.album_id for t in tracks })
+        artists = _get_many(store, Artist, { t.artist_id for t in tracks })
+        folders = _get_many(store, Folder, { t.folder_id for t in tracks } | { t.root_folder_id for t in tracks })
+        starred, ratings = _annotations(store, StarredTrack, RatingTrack, user, ids)
+
+        children = []
+        for track in tracks:
+            info = {
+                'id': str(track.id),
+                'parent': str(track.folder_id),
+                'isDir': False,
+                'title': track.title,
+                'album': albums[track.album_id].name,
+                'artist': artists[track.artist_id].name,
+                'track': track.number,
+                'size': track.size,
+                'contentType': track.content_type,
+                'suffix': track.suffix(),
+                'duration': track.duration,
+                'bitRate': track.bitrate,
+                'path': track.path[len(folders[track.root_folder_id].path) + 1:],
+                'isVideo': False,
+                'discNumber': track.disc,
+                'created': track.created.isoformat(),
+                'albumId': str(track.album_id),
+                'artistId': str(track.artist_id),
+                'type': 'music'
+            }
+
+            if track.year:
+                info['year'] = track.year
+            if track.genre:
+                info['genre'] = track.genre
+            if folders[track.folder_id].has_cover_art:
+                info['coverArt'] = str(track.folder_id)
+
+            if track.id in starred:
+                info['starred'] = starred[track.id].isoformat()
+
+            if track.id in ratings:
+                info['userRating'] = ratings[track.id]
+            avgRating = _average_rating(track)
+            if avgRating:
+                info['averageRating'] = avgRating
+
+            if prefs and prefs.format and prefs.format != track.suffix():
+                info['transcodedSuffix'] = prefs.format
+                info['transcodedContentType'] = mimetypes.guess_type('dummyname.' + prefs.format, False)[0] or 'application/octet-stream'
+
+            children.append(info)
+
+        return children
 
     def duration_str(self):
         ret = '%02i:%02i' % ((self.duration % 3600) / 60, self.duration % 60)
@@ -313,13 +476,60 @@ class BaseRating(object):
 
     user = Reference(user_id, User.id)
 
+    @classmethod
+    def rate(cls, store, user_id, rated_id, rating):
+        """ Sets the rating given by a user to an object, or removes it if rating is 0, and updates the rating totals of
+        the object in the same transaction """
+
+        current = store.get(cls, (user_id, rated_id))
+        delta_sum = rating - (current.rating if current else 0)
+        delta_count = int(rating > 0) - int(current is not None)
+
+        if current and rating:
+            current.rating = rating
+        elif current:
+            store.remove(current)
+        elif rating:
+            current = cls()
+            current.user_id = user_id
+            current.rated_id = rated_id
+            current.rating = rating
+            store.add(current)
+
+        if delta_sum or delta_count:
+            rated_cls = cls._rated_cls
+            store.find(rated_cls, rated_cls.id == rated_id).set(rating_sum = rated_cls.rating_sum + delta_sum,
+                rating_count = rated_cls.rating_count + delta_count)
+            cls.__update_average(store, rated_cls.id == rated_id)
+
+    @classmethod
+    def remove_user(cls, store, user_id):
+        """ Removes all the ratings given by a user, taking them out of the rating totals of the rated objects """
+
+        rated_cls = cls._rated_cls
+        for rating in xrange(1, 6):
+            rated_ids = Select(cls.rated_id, And(cls.user_id == user_id, cls.rating == rating))
+            store.find(rated_cls, rated_cls.id.is_in(rated_ids)).set(rating_sum = rated_cls.rating_sum - rating,
+                rating_count = rated_cls.rating_count - 1)
+        cls.__update_average(store, rated_cls.id.is_in(Select(cls.rated_id, cls.user_id == user_id)))
+        store.find(cls, cls.user_id == user_id).remove()
+
+    @classmethod
+    def __update_average(cls, store, condition):
+        # Done once the totals are written, as MySQL doesn't see the columns assigned by an UPDATE the way the others do
+        rated_cls = cls._rated_cls
+        store.find(rated_cls, condition).set(
+            rating_avg = rated_cls.rating_sum * SQL('1.0') / Func('NULLIF', rated_cls.rating_count, 0))
+
 class RatingFolder(BaseRating):
     __storm_table__ = 'rating_folder'
+    _rated_cls = Folder
 
     rated = Reference(BaseRating.rated_id, Folder.id)
 
 class RatingTrack(BaseRating):
     __storm_table__ = 'rating_track'
+    _rated_cls = Track
 
     rated = Reference(BaseRating.rated_id, Track.id)
 
@@ -340,6 +550,16 @@ class ChatMessage(object):
             'message': self.message
         }
 
+class PlaylistTrack(object):
+    __storm_table__ = 'playlist_track'
+    __storm_primary__ = 'playlist_id', 'position'
+
+    playlist_id = UUID()
+    position = Int()
+    track_id = UUID()
+
+    track = Reference(track_id, Track.id)
+
 class Playlist(object):
     __storm_table__ = 'playlist'
 
@@ -349,52 +569,79 @@ class Playlist(object):
     comment = Unicode() # nullable
     public = Bool(default = False)
     created = DateTime(default_factory = now)
-    tracks = Unicode()
+    tracks = Unicode() # Legacy comma-separated track ids, moved to playlist_track on first access
 
     user = Reference(user_id, User.id)
 
     def as_subsonic_playlist(self, user):
-        tracks = self.get_tracks()
+        tracks = self.__find_tracks()
         info = {
             'id': str(self.id),
             'name': self.name if self.user_id == user.id else '[%s] %s' % (self.user.name, self.name),
             'owner': self.user.name,
             'public': self.public,
-            'songCount': len(tracks),
-            'duration': sum(map(lambda t: t.duration, tracks)),
+            'songCount': tracks.count(),
+            'duration': tracks.sum(Track.duration) or 0,
             'created': self.created.isoformat()
         }
         if self.comment:
             info['comment'] = self.comment
         return info
 
-    def get_tracks(self):
+    def __migrate(self):
+        """ Moves the tracks from the legacy column to their own table, dropping the unknown ids. Committing the
+        change is left to the caller. """
+
         if not self.tracks:
-            return []
+            return
 
-        tracks = []
-        should_fix = False
         store = Store.of(self)
-
+        ids = []
         for t in self.tracks.split(','):
             try:
-                tid = uuid.UUID(t)
-                track = store.get(Track, tid)
-                if track:
-                    tracks.append(track)
-                else:
-                    should_fix = True
-            except:
-                should_fix = True
-
-        if should_fix:
-            self.tracks = ','.join(map(lambda t: str(t.id), tracks))
-            store.commit()
+                ids.append(uuid.UUID(t))
+            except ValueError:
+                pass
+        self.tracks = None
+
+        known = set()
+        for chunk in _chunks(set(ids)):
+            known.update(store.find(Track.id, Track.id.is_in(chunk)))
+        # The legacy column, when set, holds the whole playlist
+        self.__entries().remove()
+        position = 0
+        for tid in ids:
+            if tid in known:
+                self.__add_entry(position, tid)
+                position += 1
+
+    def __find_tracks(self):
+        self.__migrate()
+        return Store.of(self).find(Track, PlaylistTrack.playlist_id == self.id, PlaylistTrack.track_id == Track.id)
+
+    def __entries(self):
+        return Store.of(self).find(PlaylistTrack, PlaylistTrack.playlist_id == self.id)
+
+    def __next_position(self):
+        # Writing to the playlist row holds back the other transactions appending to it until this one ends, so that
+        # they don't pick the same position
+        Store.of(self).execute(Update({ Playlist.name: Playlist.name }, Playlist.id == self.id, Playlist))
+        last = self.__entries().max(PlaylistTrack.position)
+        return 0 if last is None else last + 1
+
+    def __add_entry(self, position, tid):
+        entry = PlaylistTrack()
+        entry.playlist_id = self.id
+        entry.position = position
+        entry.track_id = tid
+        Store.of(self).add(entry)
 
-        return tracks
+    def get_tracks(self):
+        return list(self.__find_tracks().order_by(PlaylistTrack.position))
 
     def clear(self):
-        self.tracks = ""
+        self.tracks = None
+        self.__entries().remove()
 
     def add(self, track):
         if isinstance(track, uuid.UUID):
@@ -404,22 +651,194 @@ class Playlist(object):
         elif isinstance(track, basestring):
             tid = uuid.UUID(track)
 
-        if self.tracks and len(self.tracks) > 0:
-            self.tracks = "{},{}".format(self.tracks, tid)
-        else:
-            self.tracks = str(tid)
+        self.__migrate()
+        self.__add_entry(self.__next_position(), tid)
 
     def remove_at_indexes(self, indexes):
-        tracks = self.tracks.split(',')
-        for i in indexes:
-            if i < 0 or i >= len(tracks):
-                continue
-            tracks[i] = None
+        self.__migrate()
+
+        positions = list(self.__entries().order_by(PlaylistTrack.position).values(PlaylistTrack.position))
+        to_remove = set(positions[i] for i in indexes if 0 <= i < len(positions))
+        for chunk in _chunks(to_remove):
+            self.__entries().find(PlaylistTrack.position.is_in(chunk)).remove()
+
+class ScanJob(object):
+    __storm_table__ = 'scan_job'
 
-        self.tracks = ','.join(t for t in tracks if t)
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+
+    id = UUID(primary = True, default_factory = uuid.uuid4)
+    folder_id = UUID()
+    status = Int(default = QUEUED)
+    created = Int(default_factory = lambda: int(time.time()))
+    started = Int(default = 0)
+    updated = Int(default = 0)
+    finished = Int(default = 0)
+    scanned = Int(default = 0)
+    total = Int(default = 0)
+    added_artists = Int(default = 0)
+    added_albums = Int(default = 0)
+    added_tracks = Int(default = 0)
+    deleted_artists = Int(default = 0)
+    deleted_albums = Int(default = 0)
+    deleted_tracks = Int(default = 0)
+    error = Unicode() # nullable
+
+    folder = Reference(folder_id, Folder.id)
+
+    def is_active(self):
+        return self.status in (ScanJob.QUEUED, ScanJob.RUNNING)
+
+    def as_progress(self):
+        elapsed = (self.finished or self.updated) - self.started
+        rate = float(self.scanned) / elapsed if self.started and elapsed > 0 else None
+        eta = None
+        if self.status == ScanJob.RUNNING and rate:
+            eta = int((self.total - self.scanned) / rate)
+
+        return {
+            'id': str(self.id),
+            'folder': str(self.folder_id),
+            'status': ('queued', 'running', 'done', 'failed')[self.status],
+            'scanned': self.scanned,
+            'total': self.total,
+            'rate': rate,
+            'eta': eta,
+            'added': [ self.added_artists, self.added_albums, self.added_tracks ],
+            'deleted': [ self.deleted_artists, self.deleted_albums, self.deleted_tracks ],
+            'error': self.error
+        }
 
 def get_store(database_uri):
     database = create_database(database_uri)
     store = Store(database)
     return store
 
+class StorePool(object):
+    """ Keeps a bounded number of stores, and thus of database connections, open to be reused. Stores that stayed idle
+    for a while are checked before being handed out again.
+
+    SQLite connections can't be used, nor even closed, from another thread than the one that opened them. They are
+    cheap to open, so SQLite stores aren't pooled: each one is opened when asked for and closed when given back. """
+
+    # Idle time after which a store is checked before being reused
+    CHECK_AFTER = 30
+
+    def __init__(self, database_uri, size = 10, timeout = 30):
+        uri = URI(database_uri)
+        self.__database = create_database(uri)
+        self.__disabled = uri.scheme == 'sqlite'
+        self.__size = max(1, size)
+        self.__timeout = timeout
+        self.__cond = threading.Condition()
+        self.__idle = [] # (time it was put back, store), most recently used last
+        self.__count = 0 # stores currently open, idle or not
+
+    @property
+    def size(self):
+        return self.__size
+
+    def get(self):
+        """ Returns a store, opening a new connection only if there isn't an idle one """
+
+        if self.__disabled:
+            return Store(self.__database)
+
+        deadline = time.time() + self.__timeout
+        entry = None
+        with self.__cond:
+            while True:
+                if self.__idle:
+                    entry = self.__idle.pop()
+                    break
+
+                if self.__count < self.__size:
+                    self.__count += 1
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError('Timed out waiting for a database connection')
+                self.__cond.wait(remaining)
+
+        if entry is None:
+            return self.__open()
+
+        idle_since, store = entry
+        if idle_since + self.CHECK_AFTER < time.time() and not self.__is_healthy(store):
+            store.close()
+            return self.__open()
+        return store
+
+    def put(self, store):
+        """ Gives a store back. Any pending change is rolled back """
+
+        if self.__disabled:
+            store.close()
+            return
+
+        try:
+            store.rollback()
+        except Exception:
+            with self.__cond:
+                self.__close(store)
+            return
+
+        with self.__cond:
+            self.__idle.append((time.time(), store))
+            self.__cond.notify()
+
+    def close(self):
+        """ Closes the idle stores """
+
+        with self.__cond:
+            while self.__idle:
+                self.__close(self.__idle.pop()[1])
+
+    def __open(self):
+        try:
+            return Store(self.__database)
+        except Exception:
+            with self.__cond:
+                self.__count -= 1
+                self.__cond.notify()
+            raise
+
+    def __close(self, store):
+        """ Must be called with the lock held """
+
+        try:
+            store.close()
+        except Exception:
+            pass
+        self.__count -= 1
+        self.__cond.notify()
+
+    @staticmethod
+    def __is_healthy(store):
+        try:
+            store.execute('SELECT 1')
+            store.rollback()
+            return True
+        except Exception:
+            return False
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(database_uri, size = None):
+    """ Returns the store pool of a database, created on first use with the given size, 10 by default. Its size can't
+    be changed afterwards. """
+
+    with _pools_lock:
+        pool = _pools.get(database_uri)
+        if pool is None:
+            pool = _pools[database_uri] = StorePool(database_uri, 10 if size is None else size)
+        elif size is not None and max(1, size) != pool.size:
+            logging.getLogger(__name__).warning('Database pool of size %i requested, using the existing one of size %i',
+                size, pool.size)
+        return pool
+
@@ -0,0 +1,154 @@
+# coding: utf-8
+
+# This file is part of Supysonic.
+#
+# Supysonic is a Python implementation of the Subsonic server API.
+# Copyright (C) 2013-2017  Alban 'spl0k' Féron
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os.path
+
+from .db import Folder
+
+class _Node(object):
+    __slots__ = ('children', 'path', 'id', 'root')
+
+    def __init__(self):
+        self.children = {}
+        self.path = None
+        self.id = None
+        self.root = False
+
+def _components(path):
+    return [ c for c in path.split(os.sep) if c ]
+
+class FolderTrie(object):
+    """ Maps folder paths to their ids, indexed by path component.
+
+    Finding the folders containing a path, or checking if a path contains any folder, takes a number of steps
+    bounded by the depth of the path instead of a look at every folder.
+    """
+
+    def __init__(self, folders = ()):
+        self.__root = _Node()
+        self.__len = 0
+        for path, fid, root in folders:
+            self.add(path, fid, root)
+
+    @staticmethod
+    def load(store, *args):
+        """ Builds a trie from the folders matching the given conditions """
+        return FolderTrie(store.find((Folder.path, Folder.id, Folder.root), *args))
+
+    def __len__(self):
+        return self.__len
+
+    def __node(self, path):
+        node = self.__root
+        for name in _components(path):
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, path):
+        node = self.__node(path)
+        return node is not None and node.id is not None
+
+    def __getitem__(self, path):
+        node = self.__node(path)
+        if node is None or node.id is None:
+            raise KeyError(path)
+        return node.id
+
+    def __setitem__(self, path, fid):
+        self.add(path, fid)
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+        self.discard(path)
+
+    def add(self, path, fid, root = False):
+        node = self.__root
+        for name in _components(path):
+            node = node.children.setdefault(name, _Node())
+        if node.id is None:
+            self.__len += 1
+        node.path = path
+        node.id = fid
+        node.root = root
+
+    def discard(self, path):
+        """ Removes a folder, along with every folder it contains """
+
+        nodes = [ self.__root ]
+        names = _components(path)
+        for name in names:
+            node = nodes[-1].children.get(name)
+            if node is None:
+                return
+            nodes.append(node)
+
+        stack = [ nodes[-1] ]
+        while stack:
+            node = stack.pop()
+            if node.id is not None:
+                self.__len -= 1
+            stack.extend(node.children.itervalues())
+
+        if not names:
+            self.__root = _Node()
+            return
+
+        # Prune the branch up to the closest node still holding something
+        for name, parent in zip(reversed(names), reversed(nodes[:-1])):
+            del parent.children[name]
+            if parent.id is not None or parent.children:
+                break
+
+    def ancestor(self, path):
+        """ Returns the (path, id) of the deepest folder being or containing the given path, or None """
+
+        found = None
+        node = self.__root
+        for name in _components(path):
+            node = node.children.get(name)
+            if node is None:
+                break
+            if node.id is not None:
+                found = node
+        return (found.path, found.id) if found else None
+
+    def root(self, path):
+        """ Returns the (path, id) of the root folder being or containing the given path, or None """
+
+        node = self.__root
+        for name in _components(path):
+            node = node.children.get(name)
+            if node is None:
+                return None
+            if node.root:
+                return node.path, node.id
+        return None
+
+    def has_ancestor(self, path):
+        """ Tells if there is a folder being or containing the given path """
+        return self.ancestor(path) is not None
+
+    def has_descendant(self, path):
+        """ Tells if there is a folder strictly below the given path """
+        node = self.__node(path)
+        return node is not None and bool(node.children)
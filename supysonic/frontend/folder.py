@@ -21,12 +21,13 @@
 import os.path
 import uuid
 
-from flask import request, flash, render_template, redirect, url_for, current_app as app
+from flask import request, flash, render_template, redirect, url_for, jsonify, current_app as app
+from storm.uri import URI
 
 from ..db import Folder
 from ..managers.user import UserManager
 from ..managers.folder import FolderManager
-from ..scanner import Scanner
+from ..scanjobs import ScanJobRunner, submit_scan, latest_jobs, run_pending_jobs
 from ..web import store
 
 from . import admin_only
@@ -34,7 +35,7 @@ from . import admin_only
 @app.route('/folder')
 @admin_only
 def folder_index():
-    return render_template('folders.html', folders = store.find(Folder, Folder.root == True))
+    return render_template('folders.html', folders = store.find(Folder, Folder.root == True), jobs = latest_jobs(store))
 
 @app.route('/folder/add')
 @admin_only
@@ -81,29 +82,45 @@ def del_folder(id):
 
     return redirect(url_for('folder_index'))
 
+runner = None
+
+def start_scan_jobs():
+    global runner
+
+    # An in-memory database can't be shared with another thread
+    uri = URI(app.config['BASE']['database_uri'])
+    if uri.scheme == 'sqlite' and uri.database in (None, ':memory:'):
+        run_pending_jobs(store, app.config['BASE'], app.logger)
+        return
+
+    if runner is None or not runner.is_alive():
+        runner = ScanJobRunner(app.config['BASE'], app.logger)
+        runner.start()
+    else:
+        runner.wakeup()
+
 @app.route('/folder/scan')
 @app.route('/folder/scan/<id>')
 @admin_only
 def scan_folder(id = None):
-    extensions = app.config['BASE']['scanner_extensions']
-    if extensions:
-        extensions = extensions.split(' ')
-    scanner = Scanner(store, extensions = extensions)
     if id is None:
-        for folder in store.find(Folder, Folder.root == True):
-            scanner.scan(folder)
+        folders = store.find(Folder, Folder.root == True)
     else:
         status, folder = FolderManager.get(store, id)
         if status != FolderManager.SUCCESS:
             flash(FolderManager.error_str(status))
             return redirect(url_for('folder_index'))
-        scanner.scan(folder)
+        folders = [ folder ]
 
-    scanner.finish()
-    added, deleted = scanner.stats()
-    store.commit()
+    for folder in folders:
+        submit_scan(store, folder)
+    start_scan_jobs()
 
-    flash('Added: %i artists, %i albums, %i tracks' % (added[0], added[1], added[2]))
-    flash('Deleted: %i artists, %i albums, %i tracks' % (deleted[0], deleted[1], deleted[2]))
+    flash('Scan started')
     return redirect(url_for('folder_index'))
 
+@app.route('/folder/scan/status')
+@admin_only
+def scan_status():
+    return jsonify({ str(fid): job.as_progress() for fid, job in latest_jobs(store).iteritems() })
+
@@ -86,6 +86,7 @@ def playlist_delete(uid):
     elif playlist.user_id != request.user.id:
         flash("You're not allowed to delete this playlist")
     else:
+        playlist.clear()
         store.remove(playlist)
         store.commit()
         flash('Playlist deleted')
@@ -21,7 +21,8 @@
 import os.path
 import uuid
 
-from ..db import Folder, Artist, Album, Track, StarredFolder, RatingFolder
+from ..db import Folder, Artist, Album, Track, StarredFolder, RatingFolder, ScanJob
+from ..foldertrie import FolderTrie
 from ..scanner import Scanner
 
 class FolderManager:
@@ -59,11 +60,11 @@ class FolderManager:
         path = unicode(os.path.abspath(path))
         if not os.path.isdir(path):
             return FolderManager.INVALID_PATH
-        if not store.find(Folder, Folder.path == path).is_empty():
+        # Every folder is below a root folder, looking at the roots is enough to find overlaps
+        roots = FolderTrie.load(store, Folder.root == True)
+        if roots.has_ancestor(path):
             return FolderManager.PATH_EXISTS
-        if any(path.startswith(p) for p in store.find(Folder).values(Folder.path)):
-            return FolderManager.PATH_EXISTS
-        if not store.find(Folder, Folder.path.startswith(path)).is_empty():
+        if roots.has_descendant(path):
             return FolderManager.SUBPATH_EXISTS
 
         folder = Folder()
@@ -92,6 +93,7 @@ class FolderManager:
 
         store.find(StarredFolder, StarredFolder.starred_id == uid).remove()
         store.find(RatingFolder, RatingFolder.rated_id == uid).remove()
+        store.find(ScanJob, ScanJob.folder_id == uid).remove()
 
         store.remove(folder)
         store.commit()
@@ -72,10 +72,11 @@ class UserManager:
         store.find(StarredArtist, StarredArtist.user_id == user.id).remove()
         store.find(StarredAlbum,  StarredAlbum.user_id  == user.id).remove()
         store.find(StarredTrack,  StarredTrack.user_id  == user.id).remove()
-        store.find(RatingFolder, RatingFolder.user_id == user.id).remove()
-        store.find(RatingTrack,  RatingTrack.user_id  == user.id).remove()
+        RatingFolder.remove_user(store, user.id)
+        RatingTrack.remove_user(store,  user.id)
         store.find(ChatMessage, ChatMessage.user_id == user.id).remove()
         for playlist in store.find(Playlist, Playlist.user_id == user.id):
+            playlist.clear()
             store.remove(playlist)
 
         store.remove(user)
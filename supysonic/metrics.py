@@ -0,0 +1,169 @@
+# coding: utf-8
+
+# This file is part of Supysonic.
+#
+# Supysonic is a Python implementation of the Subsonic server API.
+# Copyright (C) 2013-2017  Alban 'spl0k' Féron
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import time
+import urllib2
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from collections import deque
+from threading import Thread, Lock
+
+# Events processed over that many seconds are used to compute the processing rate
+RATE_WINDOW = 60
+
+_label_re = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+_escape_re = re.compile(r'\\(.)')
+
+def parse_address(address):
+    """ Splits a 'host:port' string. The host defaults to localhost """
+
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+class WatcherMetrics(object):
+    """ Figures about the work done by the watcher's processing queue """
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__started = time.time()
+        self.__processed = 0
+        self.__chunks = deque() # (time, number of events) of the recently processed chunks
+        self.__scans = 0
+        self.__scan_time = 0.0
+        self.__commits = 0
+        self.__commit_time = 0.0
+        self.__errors = 0
+        self.__last_error = None # (time, message)
+
+    def processed(self, count):
+        now = time.time()
+        with self.__lock:
+            self.__processed += count
+            self.__chunks.append((now, count))
+            while self.__chunks[0][0] < now - RATE_WINDOW:
+                self.__chunks.popleft()
+
+    def scanned(self, count, duration):
+        with self.__lock:
+            self.__scans += count
+            self.__scan_time += duration
+
+    def committed(self, duration):
+        with self.__lock:
+            self.__commits += 1
+            self.__commit_time += duration
+
+    def error(self, e):
+        with self.__lock:
+            self.__errors += 1
+            self.__last_error = (time.time(), unicode(e))
+
+    def exposition(self, depth, oldest):
+        """ Formats the metrics in the Prometheus text format. depth and oldest are the number of pending events and
+        the time the oldest of them was queued, if any """
+
+        now = time.time()
+        with self.__lock:
+            window = min(RATE_WINDOW, now - self.__started) or 1
+            rate = sum(count for t, count in self.__chunks if t >= now - RATE_WINDOW) / window
+            metrics = [
+                ('queue_depth', 'gauge', 'Number of events waiting to be processed', depth),
+                ('oldest_event_age_seconds', 'gauge', 'Time since the oldest pending event was queued',
+                    now - oldest if oldest else 0),
+                ('events_processed_total', 'counter', 'Number of events processed', self.__processed),
+                ('events_per_second', 'gauge', 'Events processed per second over the last minute', rate),
+                ('scan_seconds_sum', 'counter', 'Time spent scanning files', self.__scan_time),
+                ('scan_seconds_count', 'counter', 'Number of scanned files', self.__scans),
+                ('commit_seconds_sum', 'counter', 'Time spent committing to the database', self.__commit_time),
+                ('commit_seconds_count', 'counter', 'Number of commits', self.__commits),
+                ('errors_total', 'counter', 'Number of failed chunks of events', self.__errors)
+            ]
+            last_error = self.__last_error
+
+        lines = []
+        for name, kind, description, value in metrics:
+            lines.append('# HELP supysonic_watcher_{} {}'.format(name, description))
+            lines.append('# TYPE supysonic_watcher_{} {}'.format(name, kind))
+            lines.append('supysonic_watcher_{} {}'.format(name, repr(float(value)) if isinstance(value, float) else value))
+
+        if last_error:
+            message = last_error[1].replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            lines.append('# HELP supysonic_watcher_last_error_timestamp_seconds Time of the last error')
+            lines.append('# TYPE supysonic_watcher_last_error_timestamp_seconds gauge')
+            lines.append(u'supysonic_watcher_last_error_timestamp_seconds{{message="{}"}} {}'.format(message, int(last_error[0])))
+
+        return u'\n'.join(lines).encode('utf-8') + '\n'
+
+class MetricsServer(Thread):
+    """ Serves the metrics of a processing queue over HTTP """
+
+    def __init__(self, address, queue):
+        super(MetricsServer, self).__init__()
+        self.daemon = True
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = queue.metrics.exposition(*queue.pending())
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = HTTPServer(parse_address(address), Handler)
+
+    @property
+    def port(self):
+        return self.__server.server_address[1]
+
+    def run(self):
+        self.__server.serve_forever()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+def fetch_metrics(address, timeout = 5):
+    """ Queries a watcher's metrics, returned as a dict mapping names, without their prefix, to a (labels, value)
+    tuple """
+
+    host, port = parse_address(address)
+    body = urllib2.urlopen('http://{}:{}/metrics'.format(host, port), timeout = timeout).read().decode('utf-8')
+
+    metrics = {}
+    for line in body.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name, _, value = line.rpartition(' ')
+        labels = {}
+        if '{' in name:
+            name, _, raw = name.partition('{')
+            for key, label in _label_re.findall(raw):
+                labels[key] = _escape_re.sub(lambda m: '\n' if m.group(1) == 'n' else m.group(1), label)
+        metrics[name.replace('supysonic_watcher_', '', 1)] = (labels, float(value))
+    return metrics
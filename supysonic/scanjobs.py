@@ -0,0 +1,275 @@
+# coding: utf-8
+
+# This file is part of Supysonic.
+#
+# Supysonic is a Python implementation of the Subsonic server API.
+# Copyright (C) 2013-2017  Alban 'spl0k' Féron
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+
+from storm.database import create_database
+from storm.expr import Alias, And, Exists, Not, Select, SQL, Update
+from storm.info import ClassAlias
+from storm.store import Store
+from storm.uri import URI
+from threading import Thread, Condition
+
+from . import db
+from .db import ScanJob
+from .scanner import Scanner
+
+# A running job whose progress hasn't been saved for that long is considered dead
+STALE_DELAY = 600
+# Interval at which the progress of a running job is saved
+HEARTBEAT_DELAY = 30
+
+# Ids of the jobs run by this process, known to be alive whether or not their progress is saved
+_active_jobs = set()
+
+def current_job(store, folder_id):
+    """ Returns the queued or running job of a root folder, if any """
+
+    now = int(time.time())
+    for job in store.find(ScanJob, ScanJob.folder_id == folder_id, ScanJob.status.is_in((ScanJob.QUEUED, ScanJob.RUNNING))):
+        if job.status == ScanJob.RUNNING and job.updated + STALE_DELAY < now and job.id not in _active_jobs:
+            job.status = ScanJob.FAILED
+            job.finished = job.updated
+            job.error = u'Interrupted'
+            continue
+        return job
+    return None
+
+def submit_scan(store, folder):
+    """ Queues a scan of a root folder. There is at most one pending job per folder, if there is already one it is
+    returned instead of queueing a new one """
+
+    job = current_job(store, folder.id)
+    if job is None:
+        # Only the latest job of a folder is of interest
+        store.find(ScanJob, ScanJob.folder_id == folder.id, ScanJob.status.is_in((ScanJob.DONE, ScanJob.FAILED))).remove()
+        job = ScanJob()
+        job.folder_id = folder.id
+        store.add(job)
+        store.commit()
+
+        # Another request might have queued one at the same time. The oldest one is kept.
+        queued = list(store.find(ScanJob, ScanJob.folder_id == folder.id, ScanJob.status == ScanJob.QUEUED)
+            .order_by(ScanJob.created, ScanJob.id))
+        if len(queued) > 1:
+            store.find(ScanJob, ScanJob.id.is_in([ j.id for j in queued[1:] ])).remove()
+            job = queued[0]
+    store.commit()
+    return job
+
+def latest_jobs(store):
+    """ Returns the latest job of each root folder, indexed by folder id """
+
+    jobs = {}
+    for job in store.find(ScanJob).order_by(ScanJob.created):
+        jobs[job.folder_id] = job
+    return jobs
+
+def _running(folder_id, now):
+    """ Matches when a job of the given folder is running and still alive """
+
+    running = ClassAlias(ScanJob)
+    return Exists(Select(SQL('1'), And(running.folder_id == folder_id, running.status == ScanJob.RUNNING,
+        running.updated + STALE_DELAY >= now), tables = running))
+
+def run_pending_jobs(store, config, logger = None):
+    """ Runs the queued jobs, oldest first, until there is none left. Jobs of a folder already being scanned are
+    left for later. """
+
+    logger = logger or logging.getLogger(__name__)
+    while True:
+        now = int(time.time())
+        job = store.find(ScanJob, ScanJob.status == ScanJob.QUEUED, Not(_running(ScanJob.folder_id, now))) \
+            .order_by(ScanJob.created).first()
+        if job is None:
+            return
+
+        # Another process might have taken it, or another job of the same folder, in the meantime. MySQL doesn't let
+        # the subquery of an UPDATE read from the updated table, unless through a derived table.
+        running = Alias(Select(ScanJob.id, And(ScanJob.folder_id == job.folder_id, ScanJob.status == ScanJob.RUNNING,
+            ScanJob.updated + STALE_DELAY >= now)), '_running')
+        result = store.execute(Update({ ScanJob.status: ScanJob.RUNNING, ScanJob.started: now, ScanJob.updated: now },
+            And(ScanJob.id == job.id, ScanJob.status == ScanJob.QUEUED,
+                Not(Exists(Select(SQL('1'), tables = running)))), ScanJob))
+        claimed = result.rowcount == 1
+        store.commit()
+        store.invalidate(job)
+        if claimed:
+            _run_job(store, job, config, logger)
+
+def _run_job(store, job, config, logger):
+    extensions = config['scanner_extensions']
+    if extensions:
+        extensions = extensions.split(' ')
+    cover_names = config['scanner_cover_names']
+    if cover_names:
+        cover_names = cover_names.split(' ')
+    scanner = Scanner(store, extensions = extensions, workers = config['scanner_workers'],
+        commit_every = config['scanner_commit_every'], cover_names = cover_names)
+
+    counts = [ 0, 0 ]
+    def progress(scanned, total):
+        counts[:] = scanned, total
+
+    def values():
+        (added_artists, added_albums, added_tracks), (deleted_artists, deleted_albums, deleted_tracks) = scanner.stats()
+        return {
+            ScanJob.scanned: counts[0], ScanJob.total: counts[1],
+            ScanJob.added_artists: added_artists, ScanJob.added_albums: added_albums, ScanJob.added_tracks: added_tracks,
+            ScanJob.deleted_artists: deleted_artists, ScanJob.deleted_albums: deleted_albums,
+            ScanJob.deleted_tracks: deleted_tracks
+        }
+
+    # The job row is left to the heartbeat while the scan runs, which saves the progress whether or not the scanner
+    # commits anything
+    heartbeat = _Heartbeat(config['database_uri'], job.id, values, logger)
+    heartbeat.start()
+    _active_jobs.add(job.id)
+    try:
+        folder = job.folder
+        if folder is None:
+            raise Exception('Folder not found')
+
+        logger.info("Scanning '%s'", folder.path)
+        scanner.scan(folder, progress)
+        scanner.finish()
+        heartbeat.stop()
+        # The row was updated behind the store's back
+        store.invalidate(job)
+        for column, value in values().iteritems():
+            setattr(job, column.name, value)
+        job.status = ScanJob.DONE
+    except Exception, e:
+        heartbeat.stop()
+        logger.exception("Scan job %s failed", job.id)
+        store.rollback()
+        try:
+            # Progress was committed along the way, clean up what the scan left behind
+            scanner.finish()
+        except Exception:
+            logger.exception("Error while cleaning up after scan job %s", job.id)
+            store.rollback()
+            scanner.abort()
+        job.status = ScanJob.FAILED
+        job.error = unicode(e)
+
+    job.finished = job.updated = int(time.time())
+    try:
+        store.commit()
+    finally:
+        _active_jobs.discard(job.id)
+
+class _Heartbeat(Thread):
+    """ Saves the progress of a running job every HEARTBEAT_DELAY seconds, in short transactions of its own """
+
+    def __init__(self, database_uri, job_id, values, logger):
+        super(_Heartbeat, self).__init__()
+        self.daemon = True
+
+        self.__database_uri = database_uri
+        self.__job_id = job_id
+        self.__values = values
+        self.__logger = logger
+        self.__cond = Condition()
+        self.__running = True
+
+    def run(self):
+        # Another SQLite connection can't write while the scanner's transaction is open, and the scanner couldn't write
+        # anymore after another connection did with write-ahead logging. Jobs run by this process are known to be alive
+        # anyway, see current_job.
+        if URI(self.__database_uri).scheme == 'sqlite':
+            return
+
+        while True:
+            with self.__cond:
+                if self.__running:
+                    self.__cond.wait(HEARTBEAT_DELAY)
+                if not self.__running:
+                    break
+
+            try:
+                self.beat()
+            except Exception:
+                self.__logger.warning("Couldn't save the progress of scan job %s", self.__job_id, exc_info = True)
+
+    def beat(self):
+        """ Saves the progress """
+
+        store = Store(create_database(self.__database_uri))
+        try:
+            values = self.__values()
+            values[ScanJob.updated] = int(time.time())
+            store.execute(Update(values, And(ScanJob.id == self.__job_id, ScanJob.status == ScanJob.RUNNING), ScanJob))
+            store.commit()
+        finally:
+            store.close()
+
+    def stop(self):
+        """ Stops saving the progress, waiting for an ongoing save to end """
+
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify()
+        self.join()
+
+class ScanJobRunner(Thread):
+    """ Runs the queued scan jobs in the background, one at a time """
+
+    def __init__(self, config, logger = None):
+        super(ScanJobRunner, self).__init__()
+        self.daemon = True
+
+        self.__config = config
+        self.__logger = logger or logging.getLogger(__name__)
+        self.__cond = Condition()
+        # Jobs might have been queued before this runner started
+        self.__pending = True
+        self.__running = True
+
+    def run(self):
+        pool = db.get_pool(self.__config['database_uri'], self.__config['database_pool_size'])
+        while self.__running:
+            with self.__cond:
+                while self.__running and not self.__pending:
+                    self.__cond.wait()
+                self.__pending = False
+
+            if not self.__running:
+                break
+
+            # Only hold a connection while there is something to do
+            store = pool.get()
+            try:
+                run_pending_jobs(store, self.__config, self.__logger)
+            except Exception:
+                self.__logger.exception('Error while running scan jobs')
+            finally:
+                pool.put(store)
+
+    def wakeup(self):
+        with self.__cond:
+            self.__pending = True
+            self.__cond.notify()
+
+    def stop(self):
+        self.__running = False
+        with self.__cond:
+            self.__cond.notify()
@@ -19,45 +19,171 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os, os.path
+import itertools
 import mimetypes
+import multiprocessing
 import mutagen
+import stat
 import time
 
-from storm.expr import ComparableExpr, compile, Like
-from storm.exceptions import NotSupportedError
+from storm.databases.mysql import compile as mysql_compile
+from storm.expr import BinaryOper, ComparableExpr, compile, And, Func, Or, Select, Exists, Not, SQL
+from storm.info import ClassAlias
 
 from .db import Folder, Artist, Album, Track, User
 from .db import StarredFolder, StarredArtist, StarredAlbum, StarredTrack
-from .db import RatingFolder, RatingTrack
-
-# Hacking in support for a concatenation expression
-class Concat(ComparableExpr):
-    __slots__ = ("left", "right", "db")
-
-    def __init__(self, left, right, db):
-        self.left = left
-        self.right = right
-        self.db = db
-
-@compile.when(Concat)
-def compile_concat(compile, concat, state):
-    left = compile(concat.left, state)
-    right = compile(concat.right, state)
-    if concat.db in ('sqlite', 'postgres'):
-        statement = "%s||%s"
-    elif concat.db == 'mysql':
-        statement = "CONCAT(%s, %s)"
-    else:
-        raise NotSupportedError("Unspported database (%s)" % concat.db)
-    return statement % (left, right)
+from .db import RatingFolder, RatingTrack, PlaylistTrack
+from .foldertrie import FolderTrie
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+class _Concat(BinaryOper):
+    """ Concatenates two strings, CONCAT() on MySQL where || is a logical or """
+
+    __slots__ = ()
+    oper = ' || '
+
+@mysql_compile.when(_Concat)
+def _compile_mysql_concat(compile, concat, state):
+    return 'CONCAT(%s, %s)' % (compile(concat.expr1, state), compile(concat.expr2, state))
+
+class _Binary(ComparableExpr):
+    """ Compares a string byte by byte on MySQL, where the default collation ignores case """
+
+    __slots__ = ('expr',)
+
+    def __init__(self, expr):
+        self.expr = expr
+
+@compile.when(_Binary)
+def _compile_binary(compile, binary, state):
+    return compile(binary.expr, state)
+
+@mysql_compile.when(_Binary)
+def _compile_mysql_binary(compile, binary, state):
+    return 'BINARY ' + compile(binary.expr, state)
+
+class _DirEntry(object):
+    """ Minimal replacement for os.DirEntry when scandir isn't available. The stat result is cached so each
+    entry is stat'ed at most once """
+
+    __slots__ = ('name', 'path', '_stat')
+
+    def __init__(self, root, name):
+        self.name = name
+        self.path = os.path.join(root, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+def _scandir(path):
+    if scandir is not None:
+        return scandir(path)
+    return [ _DirEntry(path, name) for name in os.listdir(path) ]
+
+def _below(column, path):
+    """ Matches the paths located below a directory. LIKE ignores case on SQLite and MySQL, the prefix is compared
+    exactly so that directories whose names only differ by case are told apart. """
+
+    prefix = path + os.sep
+    return And(column.startswith(prefix), _Binary(Func('SUBSTR', column, 1, len(prefix))) == prefix)
+
+def _chunks(ids, size = 500):
+    """ Splits a collection of ids in lists small enough to be used in an IN clause """
+
+    ids = list(ids)
+    for i in xrange(0, len(ids), size):
+        yield ids[i:i + size]
+
+def _try_load_tag(path):
+    try:
+        return mutagen.File(path, easy = True)
+    except:
+        return None
+
+def _try_read_tag(metadata, field, default = None, transform = lambda x: x[0]):
+    try:
+        value = metadata[field]
+        if not value:
+            return default
+        if transform:
+            value = transform(value)
+            return value if value else default
+    except:
+        return default
+
+def read_metadata(path, st):
+    """ Reads the tags and audio properties of a file.
+
+    This doesn't access the database so it can be run in a worker process.
+
+    :param path: path of the file to read
+    :param st: result of os.stat() for the file
+    :return: a dict with the track metadata, or None if the file couldn't be parsed
+    """
+
+    tag = _try_load_tag(path)
+    if not tag:
+        return None
+
+    artist = _try_read_tag(tag, 'artist', '')
+    return {
+        'artist':      artist,
+        'album':       _try_read_tag(tag, 'album', ''),
+        'albumartist': _try_read_tag(tag, 'albumartist', artist),
+        'disc':     _try_read_tag(tag, 'discnumber',  1, lambda x: int(x[0].split('/')[0])),
+        'number':   _try_read_tag(tag, 'tracknumber', 1, lambda x: int(x[0].split('/')[0])),
+        'title':    _try_read_tag(tag, 'title', ''),
+        'year':     _try_read_tag(tag, 'date', None, lambda x: int(x[0].split('-')[0])),
+        'genre':    _try_read_tag(tag, 'genre'),
+        'duration': int(tag.info.length),
+        'bitrate':  (tag.info.bitrate if hasattr(tag.info, 'bitrate') else int(st.st_size * 8 / tag.info.length)) / 1000,
+        'content_type': mimetypes.guess_type(path, False)[0] or 'application/octet-stream',
+        'size': st.st_size,
+        'last_modification': int(st.st_mtime)
+    }
+
+def _read_metadata(args):
+    return read_metadata(*args)
+
+# Looked up in this order, the first one found in a directory being its cover art
+DEFAULT_COVER_NAMES = [ 'cover.jpg', 'cover.png', 'folder.jpg', 'folder.png', 'front.jpg', 'front.png' ]
 
 class Scanner:
-    def __init__(self, store, force = False, extensions = None):
+    def __init__(self, store, force = False, extensions = None, workers = 1, incremental = False, commit_every = 0,
+            cover_names = None):
         if extensions is not None and not isinstance(extensions, list):
             raise TypeError('Invalid extensions type')
+        if cover_names is not None and not isinstance(cover_names, list):
+            raise TypeError('Invalid cover names type')
+        if not isinstance(workers, (int, long)) or workers < 0:
+            raise TypeError('Invalid workers count')
+        if not isinstance(commit_every, (int, long)) or commit_every < 0:
+            raise TypeError('Invalid commit interval')
 
         self.__store = store
         self.__force = force
+        self.__incremental = incremental and not force
+        self.__workers = workers or multiprocessing.cpu_count()
+        self.__commit_every = commit_every
 
         self.__added_artists = 0
         self.__added_albums  = 0
@@ -67,118 +193,384 @@ class Scanner:
         self.__deleted_tracks  = 0
 
         self.__extensions = extensions
+        self.__cover_names = [ n.lower() for n in (cover_names or DEFAULT_COVER_NAMES) ]
 
         self.__folders_to_check = set()
         self.__artists_to_check = set()
         self.__albums_to_check = set()
+        # Albums and artists whose figures changed since the last commit made by scan()
+        self.__albums_to_update = set()
+        self.__artists_to_update = set()
+
+        # Identity maps, saving a lookup query for each scanned file
+        self.__tracks = {} # path -> (id, last_modification)
+        self.__artists = {} # name -> id
+        self.__albums = {} # (artist id, name) -> id
+        self.__folders = FolderTrie() # path -> id
+        self.__directories = {} # path -> (last_modification, entry_count)
+        self.__covers = {} # path -> (cover art file name, last_modification) or None
+        self.__maps_loaded = False
+        self.__folders_loaded = False
 
     def __del__(self):
-        if self.__folders_to_check or self.__artists_to_check or self.__albums_to_check:
+        try:
+            pending = self.__folders_to_check or self.__artists_to_check or self.__albums_to_check
+        except AttributeError: # The constructor raised
+            return
+        if pending:
             raise Exception("There's still something to check. Did you run Scanner.finish()?")
 
-    def scan(self, folder, progress_callback = None):
+    def scan(self, folder, progress_callback = None, resume = False):
+        """ Scans a root folder.
+
+        When committing every few files, a checkpoint is saved along with each commit. If the scan is interrupted,
+        it can then be resumed by passing resume = True, skipping the files processed before the checkpoint.
+        """
+
         if not isinstance(folder, Folder):
             raise TypeError('Expecting Folder instance, got ' + str(type(folder)))
 
+        self.__load_identity_maps(folder)
+
         # Scan new/updated files
-        files = [ os.path.join(root, f) for root, _, fs in os.walk(folder.path) for f in fs if self.__is_valid_path(os.path.join(root, f)) ]
+        directories = {}
+        covers = {}
+        files = [ (path, st) for path, st in self.__walk(folder.path, directories, covers) if st or path in self.__tracks ]
         total = len(files)
         current = 0
 
-        for path in files:
-            self.scan_file(path)
+        # Process files in a stable order so a checkpoint tells which files were already processed
+        files.sort(key = lambda f: f[0].split(os.sep))
+        checkpoint = None
+        if resume and folder.scan_checkpoint:
+            checkpoint = os.path.join(folder.path, folder.scan_checkpoint).split(os.sep)
+
+        # Only files that are new or have changed need their tags to be read
+        to_read = []
+        for path, st in files:
+            if checkpoint and path.split(os.sep) <= checkpoint:
+                current += 1
+                if progress_callback:
+                    progress_callback(current, total)
+            elif path in self.__tracks and (st is None or not self.__is_modified(st, self.__tracks[path][1])):
+                current += 1
+                if progress_callback:
+                    progress_callback(current, total)
+            else:
+                # The identity map holds every track of this root folder, a miss means it is a new file
+                to_read.append((path, st, lambda path = path: self.__get_cached(Track, self.__tracks, path)))
+
+        for stored, path in enumerate(self.__read_and_store(to_read), 1):
             current += 1
             if progress_callback:
                 progress_callback(current, total)
 
-        # Remove files that have been deleted
-        for track in [ t for t in self.__store.find(Track, Track.root_folder_id == folder.id) if not self.__is_valid_path(t.path) ]:
-            self.remove_file(track.path)
+            if self.__commit_every and stored % self.__commit_every == 0:
+                folder.scan_checkpoint = path[len(folder.path) + 1:]
+                self.__update_stats()
+                self.__store.commit()
+
+        # Remove files that have been deleted. The identity map holds the paths of the root folder's tracks
+        walked = set(path for path, _ in files)
+        deleted = [ path for path in self.__tracks if path not in walked ]
+        if deleted:
+            self.__remove_tracks([ self.__tracks.pop(path)[0] for path in deleted ])
+            self.__store.invalidate()
+
+        # Remember the state and cover art of the walked directories. Only the folders for which something changed
+        # are loaded and updated.
+        for path, state in directories.iteritems():
+            cover = covers[path]
+            if self.__directories.get(path) == state and self.__covers.get(path) == cover:
+                continue
 
-        # Update cover art info
-        folders = [ folder ]
-        while folders:
-            f = folders.pop()
-            f.has_cover_art = os.path.isfile(os.path.join(f.path, 'cover.jpg'))
-            folders += f.children
+            f = self.__get_cached(Folder, self.__folders, path)
+            if not f:
+                continue
+
+            f.last_modification, f.entry_count = state
+            if f.has_cover_art != (cover is not None):
+                # The cover art of the albums having tracks in this folder might change
+                self.__albums_to_check.update(self.__store.find(Track.album_id, Track.folder_id == f.id).config(distinct = True))
+            f.has_cover_art = cover is not None
+            f.cover_art, f.cover_art_modification = cover or (None, 0)
+            self.__directories[path] = state
+            self.__covers[path] = cover
 
         folder.last_scan = int(time.time())
+        folder.scan_checkpoint = None
+
+    def __load_identity_maps(self, folder):
+        self.__tracks = { path: (tid, last_modification) for path, tid, last_modification in
+            self.__store.find((Track.path, Track.id, Track.last_modification), Track.root_folder_id == folder.id) }
+
+        self.__load_folders()
+        if self.__maps_loaded:
+            return
+
+        self.__artists.update(self.__store.find((Artist.name, Artist.id)))
+        self.__albums.update(((artist_id, name), aid) for aid, name, artist_id in self.__store.find((Album.id, Album.name, Album.artist_id)))
+        self.__maps_loaded = True
+
+    def __load_folders(self):
+        if self.__folders_loaded:
+            return
+
+        for path, fid, root, last_modification, entry_count, cover_art, cover_art_modification in self.__store.find((Folder.path,
+                Folder.id, Folder.root, Folder.last_modification, Folder.entry_count, Folder.cover_art, Folder.cover_art_modification)):
+            self.__folders.add(path, fid, root)
+            self.__directories[path] = (last_modification, entry_count)
+            self.__covers[path] = (cover_art, cover_art_modification) if cover_art else None
+        self.__folders_loaded = True
+
+    def __get_cached(self, cls, cache, key):
+        if key not in cache:
+            return None
+
+        obj = self.__store.get(cls, cache[key][0] if cls is Track else cache[key])
+        if obj is None:
+            del cache[key]
+        return obj
 
     def finish(self):
-        for album in [ a for a in self.__albums_to_check if not a.tracks.count() ]:
-            self.__store.find(StarredAlbum, StarredAlbum.starred_id == album.id).remove()
+        """ Removes the albums, artists and folders left empty by the scan, along with their stars and ratings, and
+        updates the figures kept about the albums and artists whose tracks changed """
 
-            self.__artists_to_check.add(album.artist)
-            self.__store.remove(album)
-            self.__deleted_albums += 1
-        self.__albums_to_check.clear()
+        deleted = False
+        # Covered by the checks below
+        self.__albums_to_update = set()
+        self.__artists_to_update = set()
 
-        for artist in [ a for a in self.__artists_to_check if not a.albums.count() and not a.tracks.count() ]:
-            self.__store.find(StarredArtist, StarredArtist.starred_id == artist.id).remove()
+        albums = self.__albums_to_check
+        self.__albums_to_check = set()
+        for chunk in _chunks(albums):
+            ids = list(self.__store.find(Album.id, Album.id.is_in(chunk),
+                Not(Exists(Select(SQL('1'), Track.album_id == Album.id, tables = Track)))))
+            if not ids:
+                continue
 
-            self.__store.remove(artist)
-            self.__deleted_artists += 1
-        self.__artists_to_check.clear()
+            self.__artists_to_check.update(self.__store.find(Album.artist_id, Album.id.is_in(ids)).config(distinct = True))
+            self.__store.find(StarredAlbum, StarredAlbum.starred_id.is_in(ids)).remove()
+            self.__deleted_albums += self.__store.find(Album, Album.id.is_in(ids)).remove()
+            deleted = True
+        Album.update_stats(self.__store, albums)
 
-        while self.__folders_to_check:
-            folder = self.__folders_to_check.pop()
-            if folder.root:
+        artists = self.__artists_to_check
+        self.__artists_to_check = set()
+        for chunk in _chunks(artists):
+            ids = list(self.__store.find(Artist.id, Artist.id.is_in(chunk),
+                Not(Exists(Select(SQL('1'), Album.artist_id == Artist.id, tables = Album))),
+                Not(Exists(Select(SQL('1'), Track.artist_id == Artist.id, tables = Track)))))
+            if not ids:
                 continue
 
-            if not folder.tracks.count() and not folder.children.count():
-                self.__store.find(StarredFolder, StarredFolder.starred_id == folder.id).remove()
-                self.__store.find(RatingFolder, RatingFolder.rated_id == folder.id).remove()
+            self.__store.find(StarredArtist, StarredArtist.starred_id.is_in(ids)).remove()
+            self.__deleted_artists += self.__store.find(Artist, Artist.id.is_in(ids)).remove()
+            deleted = True
+        Artist.update_stats(self.__store, artists)
 
-                self.__folders_to_check.add(folder.parent)
-                self.__store.remove(folder)
+        # Prune empty folders one level at a time, walking up to the root
+        child = ClassAlias(Folder)
+        folders = self.__folders_to_check
+        self.__folders_to_check = set()
+        while folders:
+            parents = set()
+            for chunk in _chunks(folders):
+                empty = list(self.__store.find((Folder.id, Folder.parent_id, Folder.path), Folder.id.is_in(chunk), Folder.root == False,
+                    Not(Exists(Select(SQL('1'), Track.folder_id == Folder.id, tables = Track))),
+                    Not(Exists(Select(SQL('1'), child.parent_id == Folder.id, tables = child)))))
+                if not empty:
+                    continue
+
+                ids = [ fid for fid, _, _ in empty ]
+                parents.update(parent_id for _, parent_id, _ in empty)
+                for _, _, path in empty:
+                    self.__folders.discard(path)
+                    self.__directories.pop(path, None)
+                    self.__covers.pop(path, None)
+                self.__store.find(StarredFolder, StarredFolder.starred_id.is_in(ids)).remove()
+                self.__store.find(RatingFolder, RatingFolder.rated_id.is_in(ids)).remove()
+                self.__store.find(Folder, Folder.id.is_in(ids)).remove()
+                deleted = True
+            folders = parents
+
+        # Rows were deleted behind Storm's back, make sure it doesn't hand out stale objects. The identity maps clean
+        # themselves up as they find out the rows don't exist anymore.
+        if deleted:
+            self.__store.invalidate()
+
+    def __update_stats(self):
+        """ Brings the figures of the albums and artists of the files stored since the last commit up to date, so that
+        what gets committed is consistent even if the scan doesn't get to finish """
+
+        Album.update_stats(self.__store, self.__albums_to_update)
+        Artist.update_stats(self.__store, self.__artists_to_update)
+        self.__albums_to_update = set()
+        self.__artists_to_update = set()
+
+    def abort(self):
+        """ Forgets about what was left to check, for when the changes made by the scanner were rolled back. The
+        scanner shouldn't be used afterwards. """
+
+        self.__folders_to_check.clear()
+        self.__artists_to_check.clear()
+        self.__albums_to_check.clear()
+        self.__albums_to_update.clear()
+        self.__artists_to_update.clear()
 
-    def __is_valid_path(self, path):
-        if not os.path.exists(path):
-            return False
+    def __walk(self, path, states, covers):
+        """ Yields the path and stat result of every valid file below the given directory. Each file is stat'ed once,
+        and only if its extension matches.
+
+        In incremental mode, files from directories whose modification time and number of entries didn't change
+        since the last scan are yielded without being stat'ed, with None in place of the stat result. The state of
+        the other directories is stored in the states dict, and their cover art, picked from their listing, in the
+        covers dict. """
+
+        try:
+            directories = [ (path, os.stat(path)) ]
+        except OSError:
+            return
+
+        while directories:
+            dirpath, dirstat = directories.pop()
+            try:
+                entries = list(_scandir(dirpath))
+            except OSError:
+                continue
+
+            state = (int(dirstat.st_mtime), len(entries))
+            unchanged = self.__incremental and self.__directories.get(dirpath) == state
+            if not unchanged:
+                states[dirpath] = state
+                covers[dirpath] = self.__find_cover(entries)
+
+            for entry in entries:
+                # Known tracks of an unchanged directory are still there and are still files
+                if unchanged and entry.path in self.__tracks:
+                    yield entry.path, None
+                    continue
+
+                if entry.is_dir():
+                    # Don't follow symlinks to directories, as os.walk()
+                    if not entry.is_symlink():
+                        try:
+                            directories.append((entry.path, entry.stat()))
+                        except OSError:
+                            pass
+                    continue
+
+                if unchanged or not self.__is_valid_name(entry.name):
+                    continue
+
+                try:
+                    st = entry.stat()
+                except OSError: # Broken symlink
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    yield entry.path, st
+
+    def __find_cover(self, entries):
+        candidates = [ (self.__cover_names.index(e.name.lower()), e) for e in entries if e.name.lower() in self.__cover_names ]
+        for _, entry in sorted(candidates, key = lambda c: c[0]):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                return entry.name, int(st.st_mtime)
+        return None
+
+    def __is_valid_name(self, name):
         if not self.__extensions:
             return True
-        return os.path.splitext(path)[1][1:].lower() in self.__extensions
+        return os.path.splitext(name)[1][1:].lower() in self.__extensions
+
+    def __read_and_store(self, to_read):
+        """ Reads the tags of the (path, stat result, track getter) items and stores them, yielding each path once
+        stored. Tags are read by the worker processes while database updates stay on this thread, in the order of
+        the items. """
+
+        pool = multiprocessing.Pool(self.__workers) if self.__workers > 1 and len(to_read) > 1 else None
+        try:
+            args = [ (path, st) for path, st, _ in to_read ]
+            metadata = pool.imap(_read_metadata, args, 16) if pool else itertools.imap(_read_metadata, args)
+            for (path, _, get_track), meta in itertools.izip(to_read, metadata):
+                self.__store_file(path, get_track(), meta)
+                yield path
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
 
     def scan_file(self, path):
         if not isinstance(path, basestring):
             raise TypeError('Expecting string, got ' + str(type(path)))
 
-        tr = self.__store.find(Track, Track.path == path).one()
+        self.scan_files([ path ])
+
+    def scan_files(self, paths):
+        """ Scans the given files, which must be located in a root folder. Inexistent and unchanged files are
+        skipped """
+
+        to_read = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            if path in self.__tracks:
+                if not self.__is_modified(st, self.__tracks[path][1]):
+                    continue
+                tr = self.__get_cached(Track, self.__tracks, path)
+            else:
+                tr = self.__store.find(Track, Track.path == path).one()
+                if tr and not self.__is_modified(st, tr.last_modification):
+                    continue
+
+            to_read.append((path, st, lambda tr = tr: tr))
+
+        for _ in self.__read_and_store(to_read):
+            pass
+
+    def __is_modified(self, st, last_modification):
+        return self.__force or int(st.st_mtime) > last_modification
+
+    def __get_track(self, path):
+        tr = self.__get_cached(Track, self.__tracks, path)
+        if tr is None:
+            tr = self.__store.find(Track, Track.path == path).one()
+        return tr
+
+    def __store_file(self, path, tr, metadata):
         add = False
         if tr:
-            if not self.__force and not int(os.path.getmtime(path)) > tr.last_modification:
-                return
-
-            tag = self.__try_load_tag(path)
-            if not tag:
+            if not metadata:
                 self.remove_file(path)
                 return
         else:
-            tag = self.__try_load_tag(path)
-            if not tag:
+            if not metadata:
                 return
 
             tr = Track()
             tr.path = path
             add = True
 
-        artist      = self.__try_read_tag(tag, 'artist', '')
-        album       = self.__try_read_tag(tag, 'album', '')
-        albumartist = self.__try_read_tag(tag, 'albumartist', artist)
+        tr.disc     = metadata['disc']
+        tr.number   = metadata['number']
+        tr.title    = metadata['title']
+        tr.year     = metadata['year']
+        tr.genre    = metadata['genre']
+        tr.duration = metadata['duration']
 
-        tr.disc     = self.__try_read_tag(tag, 'discnumber',  1, lambda x: int(x[0].split('/')[0]))
-        tr.number   = self.__try_read_tag(tag, 'tracknumber', 1, lambda x: int(x[0].split('/')[0]))
-        tr.title    = self.__try_read_tag(tag, 'title', '')
-        tr.year     = self.__try_read_tag(tag, 'date', None, lambda x: int(x[0].split('-')[0]))
-        tr.genre    = self.__try_read_tag(tag, 'genre')
-        tr.duration = int(tag.info.length)
+        tr.bitrate  = metadata['bitrate']
+        tr.content_type = metadata['content_type']
+        tr.size = metadata['size']
+        tr.last_modification = metadata['last_modification']
 
-        tr.bitrate  = (tag.info.bitrate if hasattr(tag.info, 'bitrate') else int(os.path.getsize(path) * 8 / tag.info.length)) / 1000
-        tr.content_type = mimetypes.guess_type(path, False)[0] or 'application/octet-stream'
-        tr.last_modification = os.path.getmtime(path)
-
-        tralbum = self.__find_album(albumartist, album)
-        trartist = self.__find_artist(artist)
+        tralbum = self.__find_album(metadata['albumartist'], metadata['album'])
+        trartist = self.__find_artist(metadata['artist'])
 
         if add:
             trroot = self.__find_root_folder(path)
@@ -194,32 +586,45 @@ class Scanner:
             self.__store.add(tr)
             self.__added_tracks += 1
         else:
-            if tr.album.id != tralbum.id:
-                self.__albums_to_check.add(tr.album)
+            if tr.album_id != tralbum.id:
+                self.__albums_to_check.add(tr.album_id)
+                self.__albums_to_update.add(tr.album_id)
                 tr.album = tralbum
 
-            if tr.artist.id != trartist.id:
-                self.__artists_to_check.add(tr.artist)
+            if tr.artist_id != trartist.id:
+                self.__artists_to_check.add(tr.artist_id)
                 tr.artist = trartist
+        self.__albums_to_check.add(tralbum.id)
+        self.__artists_to_check.add(tralbum.artist_id)
+        self.__albums_to_update.add(tralbum.id)
+        self.__artists_to_update.add(tralbum.artist_id)
+
+        self.__tracks[path] = (tr.id, tr.last_modification)
 
     def remove_file(self, path):
         if not isinstance(path, basestring):
             raise TypeError('Expecting string, got ' + str(type(path)))
 
-        tr = self.__store.find(Track, Track.path == path).one()
+        tr = self.__get_track(path)
         if not tr:
             return
 
-        self.__store.find(StarredTrack, StarredTrack.starred_id == tr.id).remove()
-        self.__store.find(RatingTrack, RatingTrack.rated_id == tr.id).remove()
-        # Playlist autofix themselves
-        self.__store.find(User, User.last_play_id == tr.id).set(last_play_id = None)
+        self.__tracks.pop(path, None)
+        self.__remove_tracks([ tr.id ])
+        self.__store.invalidate(tr)
 
-        self.__folders_to_check.add(tr.folder)
-        self.__albums_to_check.add(tr.album)
-        self.__artists_to_check.add(tr.artist)
-        self.__store.remove(tr)
-        self.__deleted_tracks += 1
+    def __remove_tracks(self, ids):
+        for chunk in _chunks(ids):
+            for folder_id, album_id, artist_id in self.__store.find((Track.folder_id, Track.album_id, Track.artist_id), Track.id.is_in(chunk)):
+                self.__folders_to_check.add(folder_id)
+                self.__albums_to_check.add(album_id)
+                self.__artists_to_check.add(artist_id)
+
+            self.__store.find(StarredTrack, StarredTrack.starred_id.is_in(chunk)).remove()
+            self.__store.find(RatingTrack, RatingTrack.rated_id.is_in(chunk)).remove()
+            self.__store.find(PlaylistTrack, PlaylistTrack.track_id.is_in(chunk)).remove()
+            self.__store.find(User, User.last_play_id.is_in(chunk)).set(last_play_id = None)
+            self.__deleted_tracks += self.__store.find(Track, Track.id.is_in(chunk)).remove()
 
     def move_file(self, src_path, dst_path):
         if not isinstance(src_path, basestring):
@@ -230,12 +635,13 @@ class Scanner:
         if src_path == dst_path:
             return
 
-        tr = self.__store.find(Track, Track.path == src_path).one()
+        tr = self.__get_track(src_path)
         if not tr:
             return
 
-        self.__folders_to_check.add(tr.folder)
-        tr_dst = self.__store.find(Track, Track.path == dst_path).one()
+        self.__folders_to_check.add(tr.folder_id)
+        self.__albums_to_check.add(tr.album_id)
+        tr_dst = self.__get_track(dst_path)
         if tr_dst:
             tr.root_folder = tr_dst.root_folder
             tr.folder = tr_dst.folder
@@ -247,92 +653,190 @@ class Scanner:
             tr.folder = folder
         tr.path = dst_path
 
+        self.__tracks.pop(src_path, None)
+        self.__tracks[dst_path] = (tr.id, tr.last_modification)
+
+    def move_directory(self, src_path, dst_path):
+        """ Moves a directory along with everything it contains, rewriting the paths with a few bulk statements.
+        Tags aren't read again. """
+
+        if not isinstance(src_path, basestring):
+            raise TypeError('Expecting string, got ' + str(type(src_path)))
+        if not isinstance(dst_path, basestring):
+            raise TypeError('Expecting string, got ' + str(type(dst_path)))
+
+        if src_path == dst_path:
+            return
+
+        # Folders only exist for directories holding tracks, or one of their ancestors
+        folder = self.__store.find(Folder, Folder.path == src_path, Folder.root == False).one()
+        if folder is None:
+            return
+
+        if not self.__store.find(Folder, Folder.path == dst_path).is_empty():
+            # Merging folders, let the files be moved one by one
+            for path in list(self.__store.find(Track.path, _below(Track.path, src_path))):
+                self.move_file(path, dst_path + path[len(src_path):])
+            return
+
+        root = self.__find_root_folder(dst_path)
+        parent = self.__find_folder(dst_path)
+        self.__folders_to_check.add(folder.parent_id)
+        folder.name = os.path.basename(dst_path)
+        folder.path = dst_path
+        folder.parent = parent
+
+        prefix_len = len(src_path) + 1
+        for cls in (Folder, Track):
+            self.__store.find(cls, _below(cls.path, src_path)).set(
+                path = _Concat(dst_path, Func('SUBSTR', cls.path, prefix_len)))
+        self.__store.find(Track, _below(Track.path, dst_path), Track.root_folder_id != root.id).set(
+            root_folder_id = root.id)
+
+        self.__forget_directory(src_path)
+        self.__folders[dst_path] = folder.id
+        # Rows were updated behind Storm's back
+        self.__store.invalidate()
+
+    def remove_directory(self, path):
+        """ Removes the tracks located in a directory, and the folders left empty once finish() is called """
+
+        if not isinstance(path, basestring):
+            raise TypeError('Expecting string, got ' + str(type(path)))
+
+        self.__remove_tracks(list(self.__store.find(Track.id, _below(Track.path, path))))
+        self.__folders_to_check.update(self.__store.find(Folder.id,
+            Or(Folder.path == path, _below(Folder.path, path)), Folder.root == False))
+
+        self.__forget_directory(path)
+        self.__store.invalidate()
+
+    def scan_directory(self, path):
+        """ Scans the files located directly in a directory, and removes the tracks and folders of the entries that
+        don't exist anymore. Subdirectories aren't looked into. """
+
+        if not isinstance(path, basestring):
+            raise TypeError('Expecting string, got ' + str(type(path)))
+
+        try:
+            entries = list(_scandir(path))
+        except OSError:
+            return
+
+        self.scan_files([ e.path for e in entries if self.__is_valid_name(e.name) and not e.is_dir() ])
+
+        folder = self.__store.find(Folder, Folder.path == path).one()
+        if folder is None:
+            return
+
+        names = set(e.name for e in entries)
+        gone = [ (tid, tpath) for tid, tpath in self.__store.find((Track.id, Track.path), Track.folder_id == folder.id)
+            if os.path.basename(tpath) not in names ]
+        if gone:
+            for _, tpath in gone:
+                self.__tracks.pop(tpath, None)
+            self.__remove_tracks([ tid for tid, _ in gone ])
+            self.__store.invalidate()
+
+        for fpath in list(self.__store.find(Folder.path, Folder.parent_id == folder.id)):
+            if os.path.basename(fpath) not in names:
+                self.remove_directory(fpath)
+
+    def __forget_directory(self, path):
+        prefix = path + os.sep
+        for cache in (self.__tracks, self.__directories, self.__covers):
+            for key in [ k for k in cache if k == path or k.startswith(prefix) ]:
+                del cache[key]
+        self.__folders.discard(path)
+
     def __find_album(self, artist, album):
         ar = self.__find_artist(artist)
-        al = ar.albums.find(name = album).one()
+        al = self.__get_cached(Album, self.__albums, (ar.id, album))
         if al:
             return al
 
-        al = Album()
-        al.name = album
-        al.artist = ar
+        al = ar.albums.find(name = album).one()
+        if not al:
+            al = Album()
+            al.name = album
+            al.artist = ar
 
-        self.__store.add(al)
-        self.__added_albums += 1
+            self.__store.add(al)
+            self.__added_albums += 1
 
+        self.__albums[(ar.id, album)] = al.id
         return al
 
     def __find_artist(self, artist):
-        ar = self.__store.find(Artist, Artist.name == artist).one()
+        ar = self.__get_cached(Artist, self.__artists, artist)
         if ar:
             return ar
 
-        ar = Artist()
-        ar.name = artist
+        ar = self.__store.find(Artist, Artist.name == artist).one()
+        if not ar:
+            ar = Artist()
+            ar.name = artist
 
-        self.__store.add(ar)
-        self.__added_artists += 1
+            self.__store.add(ar)
+            self.__added_artists += 1
 
+        self.__artists[artist] = ar.id
         return ar
 
     def __find_root_folder(self, path):
         path = os.path.dirname(path)
-        db = self.__store.get_database().__module__[len('storm.databases.'):]
-        folders = self.__store.find(Folder, Like(path, Concat(Folder.path, u'%', db)), Folder.root == True)
-        count = folders.count()
-        if count > 1:
-            raise Exception("Found multiple root folders for '{}'.".format(path))
-        elif count == 0:
+        self.__load_folders()
+
+        root = self.__folders.root(path)
+        if root is None:
+            # Root folders might have been added since the folders were loaded
+            for rpath, rid in self.__store.find((Folder.path, Folder.id), Folder.root == True):
+                self.__folders.add(rpath, rid, True)
+            root = self.__folders.root(path)
+
+        folder = self.__store.get(Folder, root[1]) if root else None
+        if folder is None:
             raise Exception("Couldn't find the root folder for '{}'.\nDon't scan files that aren't located in a defined music folder".format(path))
-        return folders.one()
+        return folder
 
     def __find_folder(self, path):
         path = os.path.dirname(path)
-        folders = self.__store.find(Folder, Folder.path == path)
-        count = folders.count()
-        if count > 1:
-            raise Exception("Found multiple folders for '{}'.".format(path))
-        elif count == 1:
-            return folders.one()
+        self.__load_folders()
 
-        db = self.__store.get_database().__module__[len('storm.databases.'):]
-        folder = self.__store.find(Folder, Like(path, Concat(Folder.path, os.sep + u'%', db))).order_by(Folder.path).last()
+        folder = self.__get_cached(Folder, self.__folders, path)
+        if folder:
+            return folder
 
-        full_path = folder.path
-        path = path[len(folder.path) + 1:]
+        # Start from the closest known folder, forgetting those that don't exist anymore
+        while True:
+            parent = self.__folders.ancestor(path)
+            if parent is None:
+                raise Exception("Couldn't find a parent folder for '{}'.".format(path))
+            folder = self.__get_cached(Folder, self.__folders, parent[0])
+            if folder:
+                break
 
-        for name in path.split(os.sep):
+        full_path = folder.path
+        for name in path[len(folder.path):].split(os.sep):
+            if not name:
+                continue
             full_path = os.path.join(full_path, name)
 
-            fold = Folder()
-            fold.root = False
-            fold.name = name
-            fold.path = full_path
-            fold.parent = folder
-
-            self.__store.add(fold)
-
+            # Someone else might have created it since the folders were loaded
+            fold = self.__store.find(Folder, Folder.path == full_path).one()
+            if fold is None:
+                fold = Folder()
+                fold.root = False
+                fold.name = name
+                fold.path = full_path
+                fold.parent = folder
+                self.__store.add(fold)
+
+            self.__folders[full_path] = fold.id
             folder = fold
 
         return folder
 
-    def __try_load_tag(self, path):
-        try:
-            return mutagen.File(path, easy = True)
-        except:
-            return None
-
-    def __try_read_tag(self, metadata, field, default = None, transform = lambda x: x[0]):
-        try:
-            value = metadata[field]
-            if not value:
-                return default
-            if transform:
-                value = transform(value)
-                return value if value else default
-        except:
-            return default
-
     def stats(self):
         return (self.__added_artists, self.__added_albums, self.__added_tracks), (self.__deleted_artists, self.__deleted_albums, self.__deleted_tracks)
 
@@ -15,3 +15,55 @@ $(function () {
 $('#confirm-delete').on('show.bs.modal', function(e) {
   $(this).find('.btn-ok').attr('href', $(e.relatedTarget).data('href'));
 });
+
+function formatScanProgress(progress) {
+  var stats = function(counts) {
+    return counts[0] + ' artists, ' + counts[1] + ' albums, ' + counts[2] + ' tracks';
+  };
+
+  switch (progress.status) {
+    case 'queued':
+      return 'Queued';
+    case 'running':
+      var text = 'Scanning: ' + progress.scanned + '/' + progress.total + ' files';
+      if (progress.rate !== null)
+        text += ', ' + progress.rate.toFixed(1) + ' files/s';
+      if (progress.eta !== null)
+        text += ', ' + Math.floor(progress.eta / 60) + 'm' + ('0' + progress.eta % 60).slice(-2) + 's left';
+      return text;
+    case 'done':
+      return 'Added: ' + stats(progress.added) + '. Deleted: ' + stats(progress.deleted);
+    default:
+      return 'Failed: ' + progress.error;
+  }
+}
+
+function showScanProgress(cell, progress) {
+  cell.text(progress ? formatScanProgress(progress) : '');
+  return progress && (progress.status == 'queued' || progress.status == 'running');
+}
+
+/* Polls the progress of the scans as long as one of them is pending */
+$(function () {
+  var url = $('#scan-toolbar').data('status-url');
+  if (!url)
+    return;
+
+  var active = false;
+  $('.scan-status').each(function () {
+    active = showScanProgress($(this), $(this).data('progress')) || active;
+  });
+
+  var poll = function () {
+    $.getJSON(url, function (jobs) {
+      var active = false;
+      $('.scan-status').each(function () {
+        active = showScanProgress($(this), jobs[$(this).data('folder')]) || active;
+      });
+      if (active)
+        setTimeout(poll, 2000);
+    });
+  };
+  if (active)
+    setTimeout(poll, 2000);
+});
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+# This file is part of Supysonic.
+#
+# Supysonic is a Python implementation of the Subsonic server API.
+# Copyright (C) 2013-2017  Alban 'spl0k' Féron
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import stat
+
+from threading import Thread, Condition
+
+from . import db
+from .db import Track
+
+# Number of tracks checked at once
+BATCH_SIZE = 100
+
+def file_size(path):
+    """ Returns the size of a file, or -1 if it doesn't exist or isn't a regular file """
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return -1
+    return st.st_size if stat.S_ISREG(st.st_mode) else -1
+
+def verify_sizes(store, after = None, count = BATCH_SIZE):
+    """ Checks the stored size of up to count tracks, in id order starting after the given id, and fixes those that
+    don't match their file anymore. Returns the id of the last checked track, or None once all of them went through """
+
+    query = store.find((Track.id, Track.path, Track.size))
+    if after is not None:
+        query = query.find(Track.id > after)
+    tracks = list(query.order_by(Track.id)[:count])
+
+    for tid, path, size in tracks:
+        actual = file_size(path)
+        if actual != size:
+            store.find(Track, Track.id == tid).set(size = actual)
+    store.commit()
+
+    return tracks[-1][0] if len(tracks) == count else None
+
+class SizeVerifier(Thread):
+    """ Goes through the tracks in the background, a batch every few seconds, fixing the sizes of the files that
+    changed without the scanner noticing, or that were scanned before sizes were stored. Once every track was
+    checked, it starts over. """
+
+    def __init__(self, database_uri, interval, pool_size = None, logger = None):
+        super(SizeVerifier, self).__init__()
+        self.daemon = True
+
+        self.__database_uri = database_uri
+        self.__pool_size = pool_size
+        self.__interval = interval
+        self.__logger = logger or logging.getLogger(__name__)
+        self.__cond = Condition()
+        self.__running = True
+
+    def run(self):
+        pool = db.get_pool(self.__database_uri, self.__pool_size)
+        last = None
+        while self.__running:
+            with self.__cond:
+                self.__cond.wait(self.__interval)
+            if not self.__running:
+                break
+
+            store = pool.get()
+            try:
+                last = verify_sizes(store, last)
+            except Exception:
+                self.__logger.exception('Error while verifying file sizes')
+                store.rollback()
+            finally:
+                pool.put(store)
+
+    def stop(self):
+        self.__running = False
+        with self.__cond:
+            self.__cond.notify()
@@ -18,22 +18,39 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import heapq
+import itertools
+import json
 import logging
+import math
+import os
+import os.path
 import time
 
 from logging.handlers import TimedRotatingFileHandler
 from signal import signal, SIGTERM, SIGINT
-from threading import Thread, Condition, Timer
+from threading import Thread, Condition
 from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
+from watchdog.events import PatternMatchingEventHandler, EVENT_TYPE_MOVED, EVENT_TYPE_DELETED
 
 from . import db
-from .scanner import Scanner
+from .db import Folder
+from .metrics import WatcherMetrics, MetricsServer
+from .scanner import Scanner, _scandir
+from .verifier import SizeVerifier
 
-OP_SCAN     = 1
-OP_REMOVE   = 2
-OP_MOVE     = 4
-FLAG_CREATE = 8
+OP_SCAN        = 1
+OP_REMOVE      = 2
+OP_MOVE        = 4
+FLAG_CREATE    = 8
+FLAG_DIRECTORY = 16
+
+# Number of files changed recently in a directory above which it is considered busy. Busy directories have to be
+# quiet for the whole wait delay before their files are processed.
+BUSY_ACTIVITY = 2
+
+# Number of times the processing of an item is attempted before giving up on it
+MAX_ATTEMPTS = 3
 
 class SupysonicWatcherEventHandler(PatternMatchingEventHandler):
     def __init__(self, extensions, queue, logger):
@@ -45,7 +62,15 @@ class SupysonicWatcherEventHandler(PatternMatchingEventHandler):
 
     def dispatch(self, event):
         try:
-            super(SupysonicWatcherEventHandler, self).dispatch(event)
+            # Directories are ignored by the pattern matching, except for moves and removals which are handled as a
+            # whole rather than file by file
+            if event.is_directory:
+                if event.event_type == EVENT_TYPE_MOVED:
+                    self.on_directory_moved(event)
+                elif event.event_type == EVENT_TYPE_DELETED:
+                    self.on_directory_deleted(event)
+            else:
+                super(SupysonicWatcherEventHandler, self).dispatch(event)
         except Exception, e:
             self.__logger.critical(e)
 
@@ -65,15 +90,26 @@ class SupysonicWatcherEventHandler(PatternMatchingEventHandler):
         self.__logger.debug("File moved: '%s' -> '%s'", event.src_path, event.dest_path)
         self.__queue.put(event.dest_path, OP_MOVE, src_path = event.src_path)
 
+    def on_directory_moved(self, event):
+        self.__logger.debug("Directory moved: '%s' -> '%s'", event.src_path, event.dest_path)
+        self.__queue.put(event.dest_path, OP_MOVE | FLAG_DIRECTORY, src_path = event.src_path)
+
+    def on_directory_deleted(self, event):
+        self.__logger.debug("Directory deleted: '%s'", event.src_path)
+        self.__queue.put(event.src_path, OP_REMOVE | FLAG_DIRECTORY)
+
 class Event(object):
     def __init__(self, path, operation, **kwargs):
         if operation & (OP_SCAN | OP_REMOVE) == (OP_SCAN | OP_REMOVE):
             raise Exception("Flags SCAN and REMOVE both set")
 
         self.__path = path
-        self.__time = time.time()
+        self.__created = self.__time = time.time()
         self.__op = operation
         self.__src = kwargs.get("src_path")
+        self.stat = None # (size, modification time) the last time the file was checked
+        self.deadline = None # When the event is due, as last pushed in the queue
+        self.attempts = 0 # Number of times processing the event failed
 
     def set(self, operation, **kwargs):
         if operation & (OP_SCAN | OP_REMOVE) == (OP_SCAN | OP_REMOVE):
@@ -100,6 +136,10 @@ class Event(object):
     def time(self):
         return self.__time
 
+    @property
+    def created(self):
+        return self.__created
+
     @property
     def operation(self):
         return self.__op
@@ -109,16 +149,40 @@ class Event(object):
         return self.__src
 
 class ScannerProcessingQueue(Thread):
-    def __init__(self, database_uri, delay, logger):
+    def __init__(self, database_uri, delay, logger, workers = 1, commit_every = 0, journal = None, startup_scan = False,
+            settle_delay = None, max_delay = None, extensions = None, cover_names = None):
         super(ScannerProcessingQueue, self).__init__()
 
         self.__logger = logger
         self.__timeout = delay
+        # Files from quiet directories only need to be left alone for settle_delay, but nothing waits more than
+        # max_delay, no matter how busy its directory is
+        self.__settle_delay = delay if settle_delay is None else min(settle_delay, delay)
+        self.__max_delay = max_delay
         self.__database_uri = database_uri
+        self.__workers = workers
+        self.__commit_every = commit_every
+        self.__extensions = extensions
+        self.__cover_names = cover_names
         self.__cond = Condition()
-        self.__timer = None
-        self.__queue = {}
+        self.__queue = {} # path -> Event
+        self.__directory_moves = {} # destination path -> source path, of the pending directory moves
+        self.__activity = {} # directory -> (time of the last change, number of files changed recently)
+        # (deadline, sequence, path) entries ordered by the time the events are due. Entries aren't updated when an
+        # event changes, a new one is pushed instead and the outdated ones are dropped when reaching the top of the heap.
+        self.__heap = []
+        self.__sequence = itertools.count()
         self.__running = True
+        self.metrics = WatcherMetrics()
+
+        # Every put item is appended to the journal, which is compacted once the items are processed and committed.
+        # Items still pending when the daemon stopped are put back in the queue.
+        self.__journal_path = journal
+        self.__journal = None
+        self.__journal_entries = 0
+        self.__startup_scan = startup_scan
+        if journal:
+            self.__replay_journal()
 
     def run(self):
         try:
@@ -128,82 +192,469 @@ class ScannerProcessingQueue(Thread):
             raise e
 
     def __run(self):
-        while self.__running:
-            time.sleep(0.1)
+        pool = db.get_pool(self.__database_uri)
+        store = pool.get()
+        if self.__startup_scan:
+            try:
+                self.__check_folders(store)
+            except Exception:
+                self.__logger.exception("Error while checking folders for changes")
+                store.rollback()
+
+        scanner = self.__scanner(store)
+        try:
+            while self.__running:
+                with self.__cond:
+                    # Sleep until the oldest event settles, or something changes
+                    delay = self.__next_delay()
+                    while self.__running and delay != 0:
+                        self.__cond.wait(delay)
+                        delay = self.__next_delay()
+
+                # Settled events are processed in bounded chunks, each one being committed on its own
+                items = self.__next_items()
+                while items:
+                    try:
+                        self.__process(scanner, items)
+                        scanner.finish()
+                        start = time.time()
+                        store.commit()
+                        self.metrics.committed(time.time() - start)
+                    except Exception, e:
+                        # The items are tried again later. Being back in the queue, they are kept by the journal.
+                        self.__logger.exception("Error while processing %i items", len(items))
+                        self.metrics.error(e)
+                        store.rollback()
+                        scanner.abort()
+                        scanner = self.__scanner(store)
+                        self.__requeue(items)
+                    else:
+                        self.__logger.debug("Committed %i items", len(items))
+                        self.metrics.processed(len(items))
+                        self.__compact_journal()
+                    items = self.__next_items()
+        finally:
+            pool.put(store)
+            if self.__journal:
+                self.__journal.close()
+
+    def __check_folders(self, store):
+        """ Catches up with the changes made while the daemon wasn't running. Only the directories whose modification
+        time or number of entries changed since they were last scanned are looked at """
+
+        scanner = self.__scanner(store, incremental = True, commit_every = self.__commit_every)
+        for folder in store.find(Folder, Folder.root == True):
+            if not self.__running:
+                break
+
+            self.__logger.info("Checking '%s' for changes", folder.path)
+            scanner.scan(folder)
+            scanner.finish()
+            store.commit()
 
-            with self.__cond:
-                self.__cond.wait()
+        added, deleted = scanner.stats()
+        self.__logger.info("Startup check done: %i tracks added, %i tracks removed", added[2], deleted[2])
 
-                if not self.__queue:
-                    continue
+    def __scanner(self, store, **kwargs):
+        return Scanner(store, extensions = self.__extensions, workers = self.__workers, cover_names = self.__cover_names,
+            **kwargs)
 
-            self.__logger.debug("Instantiating scanner")
-            store = db.get_store(self.__database_uri)
-            scanner = Scanner(store)
+    def __replay_journal(self):
+        try:
+            with open(self.__journal_path) as f:
+                records = f.readlines()
+        except IOError:
+            records = []
+
+        for record in records:
+            try:
+                path, operation, src_path = json.loads(record)
+            except ValueError: # Partially written when the daemon died
+                continue
+            self.put(path, operation, src_path = src_path)
+
+        if self.__queue:
+            self.__logger.info("Restored %i pending items from the journal", len(self.__queue))
+
+        # Start over from what is actually pending
+        with self.__cond:
+            self.__rewrite_journal()
+
+    def __write_journal(self, path, operation, src_path):
+        """ Must be called with the lock held """
+
+        if self.__journal is None:
+            return
+        self.__journal.write(json.dumps([ path, operation, src_path ]) + '\n')
+        self.__journal.flush()
+        self.__journal_entries += 1
+
+    def __rewrite_journal(self):
+        """ Replaces the journal by the items currently pending. Must be called with the lock held """
+
+        if self.__journal is not None:
+            self.__journal.close()
+
+        directory = os.path.dirname(self.__journal_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        tmp_path = self.__journal_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for event in sorted(self.__queue.itervalues(), key = lambda e: e.time):
+                f.write(json.dumps([ event.path, event.operation, event.src_path ]) + '\n')
+        os.rename(tmp_path, self.__journal_path)
+
+        self.__journal = open(self.__journal_path, 'a')
+        self.__journal_entries = len(self.__queue)
+
+    def __compact_journal(self):
+        with self.__cond:
+            if self.__journal is None:
+                return
+            if not self.__queue:
+                self.__journal.truncate(0)
+                self.__journal_entries = 0
+            elif self.__journal_entries > 2 * len(self.__queue) + 1000:
+                self.__rewrite_journal()
+
+    def __process(self, scanner, items):
+        # Scans are grouped to read the tags in parallel. Operations on different files don't depend on each other,
+        # but directory operations may affect any of them and are applied in order.
+        scans = []
+        for item in items:
+            if item.operation & FLAG_DIRECTORY:
+                self.__scan_files(scanner, scans)
+                scans = []
 
-            item = self.__next_item()
-            while item:
-                if item.operation & OP_MOVE:
-                    self.__logger.info("Moving: '%s' -> '%s'", item.src_path, item.path)
-                    scanner.move_file(item.src_path, item.path)
                 if item.operation & OP_SCAN:
-                    self.__logger.info("Scanning: '%s'", item.path)
-                    scanner.scan_file(item.path)
+                    self.__logger.info("Scanning directory: '%s'", item.path)
+                    scanner.scan_directory(item.path)
+                if item.operation & OP_MOVE:
+                    self.__logger.info("Moving directory: '%s' -> '%s'", item.src_path, item.path)
+                    scanner.move_directory(item.src_path, item.path)
                 if item.operation & OP_REMOVE:
-                    self.__logger.info("Removing: '%s'", item.path)
-                    scanner.remove_file(item.path)
-                item = self.__next_item()
+                    self.__logger.info("Removing directory: '%s'", item.path)
+                    scanner.remove_directory(item.path)
+                continue
+
+            if item.operation & OP_MOVE:
+                self.__logger.info("Moving: '%s' -> '%s'", item.src_path, item.path)
+                scanner.move_file(item.src_path, item.path)
+            if item.operation & OP_SCAN:
+                self.__logger.info("Scanning: '%s'", item.path)
+                scans.append(item.path)
+            if item.operation & OP_REMOVE:
+                self.__logger.info("Removing: '%s'", item.path)
+                scanner.remove_file(item.path)
+
+        self.__scan_files(scanner, scans)
+
+    def __scan_files(self, scanner, paths):
+        if not paths:
+            return
 
-            scanner.finish()
-            store.commit()
-            store.close()
-            self.__logger.debug("Freeing scanner")
-            del scanner
+        start = time.time()
+        scanner.scan_files(paths)
+        self.metrics.scanned(len(paths), time.time() - start)
 
     def stop(self):
         self.__running = False
         with self.__cond:
             self.__cond.notify()
 
+    def pending(self):
+        """ Returns the number of pending events and the time the oldest one was queued, None if there is none """
+
+        with self.__cond:
+            if not self.__queue:
+                return 0, None
+            return len(self.__queue), min(event.created for event in self.__queue.itervalues())
+
     def put(self, path, operation, **kwargs):
         if not self.__running:
             raise RuntimeError("Trying to put an item in a stopped queue")
 
         with self.__cond:
+            self.__write_journal(path, operation, kwargs.get("src_path"))
+
+            if operation & OP_MOVE and self.__is_directory_move_part(path, kwargs["src_path"]):
+                # The move of a parent directory already takes care of it, only keep what was pending on the source
+                previous = self.__queue.pop(kwargs["src_path"], None)
+                if previous is None:
+                    return
+                operation = previous.operation & ~OP_MOVE
+                if previous.operation & OP_MOVE and not operation & OP_REMOVE:
+                    operation |= OP_SCAN
+                kwargs = {}
+
+            if operation & OP_MOVE and operation & FLAG_DIRECTORY:
+                self.__directory_moves[path] = kwargs["src_path"]
+
             if path in self.__queue:
                 event = self.__queue[path]
                 event.set(operation, **kwargs)
             else:
                 event = Event(path, operation, **kwargs)
                 self.__queue[path] = event
+                self.__add_activity(path, event.time)
 
             if operation & OP_MOVE and kwargs["src_path"] in self.__queue:
                 previous = self.__queue[kwargs["src_path"]]
                 event.set(previous.operation, src_path = previous.src_path)
                 del self.__queue[kwargs["src_path"]]
+                self.__directory_moves.pop(kwargs["src_path"], None)
+
+            self.__push(event, self.__deadline(event))
+            self.__cond.notify()
 
-            if self.__timer:
-                self.__timer.cancel()
-            self.__timer = Timer(self.__timeout, self.__wakeup)
-            self.__timer.start()
+    def __requeue(self, items):
+        """ Puts back items whose processing failed, ahead of the changes that happened to the same paths since """
 
-    def __wakeup(self):
         with self.__cond:
+            for item in items:
+                item.attempts += 1
+                if item.attempts >= MAX_ATTEMPTS:
+                    self.__logger.error("Giving up on '%s' after %i attempts", item.path, item.attempts)
+                    continue
+
+                newer = self.__queue.get(item.path)
+                if newer is not None:
+                    item.set(newer.operation, src_path = newer.src_path)
+                self.__queue[item.path] = item
+                if item.operation & OP_MOVE and item.operation & FLAG_DIRECTORY:
+                    self.__directory_moves[item.path] = item.src_path
+
+                # Left alone for a while, whatever went wrong might be over by then
+                self.__push(item, max(self.__deadline(item), time.time() + self.__timeout))
+
             self.__cond.notify()
-            self.__timer = None
+
+    def __push(self, event, deadline):
+        """ Must be called with the lock held """
+
+        event.deadline = deadline
+        heapq.heappush(self.__heap, (deadline, next(self.__sequence), event.path))
+        # Don't let outdated entries pile up when the same paths keep changing
+        if len(self.__heap) > 2 * len(self.__queue) + 64:
+            self.__heap = [ (e.deadline, next(self.__sequence), p) for p, e in self.__queue.iteritems() ]
+            heapq.heapify(self.__heap)
+
+    def __add_activity(self, path, now):
+        """ Counts a newly changed file in its directory. The count decays with time, so that it reflects the recent
+        rate of changes. Must be called with the lock held """
+
+        directory = os.path.dirname(path)
+        last, activity = self.__activity.get(directory, (now, 0.0))
+        if self.__timeout:
+            activity *= math.exp((last - now) / self.__timeout)
+        self.__activity[directory] = (now, activity + 1)
+
+        # Forget about the directories that have long been quiet
+        if len(self.__activity) > 2 * len(self.__queue) + 64:
+            horizon = now - 10 * self.__timeout
+            self.__activity = { d: a for d, a in self.__activity.iteritems() if a[0] > horizon }
+
+    def __deadline(self, event):
+        """ Returns when an event is due. Must be called with the lock held """
+
+        deadline = event.time + self.__settle_delay
+        if event.operation & FLAG_DIRECTORY:
+            deadline = event.time + self.__timeout
+        else:
+            last, activity = self.__activity.get(os.path.dirname(event.path), (0, 0))
+            if activity >= BUSY_ACTIVITY:
+                deadline = max(event.time, last) + self.__timeout
+
+        if self.__max_delay is not None:
+            deadline = min(deadline, event.created + self.__max_delay)
+        return deadline
+
+    def __is_stable(self, event, now):
+        """ Tells if a file is done being written to, that is if its size didn't change since it was last checked and
+        it wasn't modified recently. Must be called with the lock held """
+
+        if event.operation & (FLAG_DIRECTORY | OP_REMOVE) or not event.operation & OP_SCAN:
+            return True
+        if self.__max_delay is not None and now >= event.created + self.__max_delay:
+            return True
+
+        try:
+            st = os.stat(event.path)
+        except OSError:
+            return True
+
+        previous, event.stat = event.stat, (st.st_size, st.st_mtime)
+        if previous is not None and previous[0] != st.st_size:
+            return False
+        return st.st_mtime <= now - self.__settle_delay
+
+    def __is_directory_move_part(self, path, src_path):
+        """ Tells if moving src_path to path is the consequence of a pending directory move. Must be called with
+        the lock held """
+
+        if not self.__directory_moves:
+            return False
+
+        parent = os.path.dirname(path)
+        while parent not in self.__directory_moves:
+            if parent == os.path.dirname(parent):
+                return False
+            parent = os.path.dirname(parent)
+
+        return src_path == self.__directory_moves[parent] + path[len(parent):]
+
+    def __peek(self):
+        """ Returns the first due pending event, dropping outdated heap entries. Must be called with the lock held """
+
+        while self.__heap:
+            deadline, _, path = self.__heap[0]
+            event = self.__queue.get(path)
+            if event is not None and event.deadline == deadline:
+                return event
+            heapq.heappop(self.__heap)
+        return None
+
+    def __next_delay(self):
+        """ Returns how long to wait for the first event to be due, None if there is none. Must be called with the
+        lock held """
+
+        event = self.__peek()
+        while event is not None and self.__running:
+            # Its directory might have become busy since the event was pushed
+            deadline = self.__deadline(event)
+            if deadline <= event.deadline:
+                return max(0, event.deadline - time.time())
+            self.__push(event, deadline)
+            event = self.__peek()
+
+        return None if event is None else 0
+
+    def __next_items(self):
+        items = []
+        item = self.__next_item()
+        while item:
+            items.append(item)
+            if len(items) == self.__commit_every:
+                break
+            item = self.__next_item()
+        return items
 
     def __next_item(self):
         with self.__cond:
-            if not self.__queue:
-                return None
+            while self.__next_delay() == 0:
+                _, _, path = heapq.heappop(self.__heap)
+                event = self.__queue[path]
 
-            next = min(self.__queue.iteritems(), key = lambda i: i[1].time)
-            if not self.__running or next[1].time + self.__timeout <= time.time():
-                del self.__queue[next[0]]
-                return next[1]
+                # Files still being written to are checked again later, they would have to be scanned again otherwise
+                now = time.time()
+                if self.__running and not self.__is_stable(event, now):
+                    self.__push(event, now + self.__settle_delay)
+                    continue
+
+                del self.__queue[path]
+                if event.operation & FLAG_DIRECTORY:
+                    self.__directory_moves.pop(path, None)
+                return event
 
             return None
 
+def inotify_watch_limit():
+    """ Returns the maximum number of inotify watches a user can have, None if unknown """
+
+    try:
+        with open('/proc/sys/fs/inotify/max_user_watches') as f:
+            return int(f.read())
+    except (IOError, ValueError):
+        return None
+
+class DirectoryPoller(Thread):
+    """ Looks for changes in the directories that aren't watched. A directory whose modification time changed since
+    the previous pass is queued to be scanned, as well as every new directory. Files modified in place aren't
+    detected. """
+
+    def __init__(self, roots, queue, interval, logger):
+        super(DirectoryPoller, self).__init__()
+
+        self.__roots = roots
+        self.__queue = queue
+        self.__interval = interval
+        self.__logger = logger
+        self.__watched = set()
+        self.__states = {} # path -> (modification time, names of the subdirectories)
+        self.__cond = Condition()
+        self.__running = True
+
+    def walk(self, report = True):
+        """ Goes through every directory below the roots. Only the directories that changed are listed, the others
+        are just stat'ed. Returns the number of directories found at each depth. """
+
+        levels = []
+        states = {}
+        for root in self.__roots:
+            directories = [ (root, 0) ]
+            while directories:
+                path, depth = directories.pop()
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+
+                previous = self.__states.get(path)
+                if previous is not None and previous[0] == mtime:
+                    subdirs = previous[1]
+                else:
+                    try:
+                        subdirs = tuple(e.name for e in _scandir(path) if e.is_dir() and not e.is_symlink())
+                    except OSError:
+                        continue
+                    if report and path not in self.__watched:
+                        self.__queue.put(path, OP_SCAN | FLAG_DIRECTORY)
+
+                states[path] = (mtime, subdirs)
+                if depth == len(levels):
+                    levels.append(0)
+                levels[depth] += 1
+                directories.extend((os.path.join(path, name), depth + 1) for name in subdirs)
+
+        self.__states = states
+        return levels
+
+    def directories(self, depth):
+        """ Returns the directories found by the last walk less than depth levels below their root """
+
+        for root in self.__roots:
+            directories = [ (root, 0) ]
+            while directories:
+                path, level = directories.pop()
+                if level >= depth or path not in self.__states:
+                    continue
+                yield path
+                directories.extend((os.path.join(path, name), level + 1) for name in self.__states[path][1])
+
+    def watch(self, paths):
+        """ Sets the directories watched by other means, which shouldn't be reported """
+        self.__watched = set(paths)
+
+    def run(self):
+        while self.__running:
+            with self.__cond:
+                self.__cond.wait(self.__interval)
+            if not self.__running:
+                break
+
+            start = time.time()
+            try:
+                self.walk()
+            except Exception:
+                self.__logger.exception("Error while polling directories")
+            self.__logger.debug("Polled %i directories in %.1fs", len(self.__states), time.time() - start)
+
+    def stop(self):
+        self.__running = False
+        with self.__cond:
+            self.__cond.notify()
+
 class SupysonicWatcher(object):
     def __init__(self, config):
         self.__config = config
@@ -227,22 +678,52 @@ class SupysonicWatcher(object):
             }
             logger.setLevel(mapping.get(self.__config.DAEMON['log_level'].upper(), logging.NOTSET))
 
-        store = db.get_store(self.__config.BASE['database_uri'])
+        pool = db.get_pool(self.__config.BASE['database_uri'], self.__config.BASE['database_pool_size'])
+        store = pool.get()
         folders = store.find(db.Folder, db.Folder.root == True)
 
         if not folders.count():
             logger.info("No folder set. Exiting.")
-            store.close()
+            pool.put(store)
             return
 
-        queue = ScannerProcessingQueue(self.__config.BASE['database_uri'], self.__config.DAEMON['wait_delay'], logger)
+        extensions = self.__config.BASE['scanner_extensions']
+        if extensions:
+            extensions = extensions.split(' ')
+        cover_names = self.__config.BASE['scanner_cover_names']
+        if cover_names:
+            cover_names = cover_names.split(' ')
+
+        queue = ScannerProcessingQueue(self.__config.BASE['database_uri'], self.__config.DAEMON['wait_delay'], logger,
+            self.__config.BASE['scanner_workers'], self.__config.BASE['scanner_commit_every'],
+            self.__config.DAEMON['journal_file'], self.__config.DAEMON['startup_scan'],
+            self.__config.DAEMON['settle_delay'], self.__config.DAEMON['max_wait_delay'], extensions, cover_names)
         handler = SupysonicWatcherEventHandler(self.__config.BASE['scanner_extensions'], queue, logger)
         observer = Observer()
 
-        for folder in folders:
-            logger.info("Starting watcher for %s", folder.path)
-            observer.schedule(handler, folder.path, recursive = True)
-        store.close()
+        # Each watched directory takes an inotify watch. If there aren't enough of them, only the top levels are watched
+        # and the directories below them are polled.
+        roots = [ folder.path for folder in folders ]
+        pool.put(store)
+        poller = DirectoryPoller(roots, queue, self.__config.DAEMON['poll_interval'], logger)
+        needed = sum(poller.walk(report = False))
+        budget = self.__config.DAEMON['max_watches'] or inotify_watch_limit()
+        logger.info("%i directories to watch, %s watches available", needed, budget or 'unknown')
+
+        if budget is None or needed <= budget:
+            poller = None
+            for root in roots:
+                logger.info("Starting watcher for %s", root)
+                observer.schedule(handler, root, recursive = True)
+        else:
+            depth = self.__config.DAEMON['watch_depth']
+            watched = list(poller.directories(depth))
+            logger.warning("Not enough inotify watches for %i directories (%i available). Watching the %i directories of "
+                "the top %i levels and polling the others every %is. Raise fs.inotify.max_user_watches to watch "
+                "everything.", needed, budget, len(watched), depth, self.__config.DAEMON['poll_interval'])
+            poller.watch(watched)
+            for path in watched:
+                observer.schedule(handler, path, recursive = False)
 
         try:
             signal(SIGTERM, self.__terminate)
@@ -250,12 +731,39 @@ class SupysonicWatcher(object):
         except:
             logger.warning('Unable to set signal handlers')
 
+        metrics_server = None
+        if self.__config.DAEMON['metrics_address']:
+            try:
+                metrics_server = MetricsServer(self.__config.DAEMON['metrics_address'], queue)
+            except Exception, e:
+                logger.error("Unable to serve metrics on '%s': %s", self.__config.DAEMON['metrics_address'], e)
+
+        verifier = None
+        if self.__config.DAEMON['size_check_interval']:
+            verifier = SizeVerifier(self.__config.BASE['database_uri'], self.__config.DAEMON['size_check_interval'],
+                self.__config.BASE['database_pool_size'], logger)
+
         queue.start()
         observer.start()
+        if poller:
+            poller.start()
+        if verifier:
+            verifier.start()
+        if metrics_server:
+            logger.info("Serving metrics on port %i", metrics_server.port)
+            metrics_server.start()
         while self.__running:
             time.sleep(2)
 
         logger.info("Stopping watcher")
+        if verifier:
+            verifier.stop()
+            verifier.join()
+        if poller:
+            poller.stop()
+            poller.join()
+        if metrics_server:
+            metrics_server.stop()
         observer.stop()
         observer.join()
         queue.stop()
@@ -16,18 +16,20 @@ from os import makedirs, path
 from werkzeug.local import LocalProxy
 
 from .config import IniConfig
-from .db import get_store
+from .db import get_pool
 
-# Supysonic database open
+# Supysonic database open, the connection is taken from a pool
 def get_db():
     if not hasattr(g, 'database'):
-        g.database = get_store(current_app.config['BASE']['database_uri'])
+        config = current_app.config['BASE']
+        g.database_pool = get_pool(config['database_uri'], config['database_pool_size'])
+        g.database = g.database_pool.get()
     return g.database
 
-# Supysonic database close
+# Supysonic database close, giving the connection back to the pool
 def close_db(error):
     if hasattr(g, 'database'):
-        g.database.close()
+        g.database_pool.put(g.database)
 
 store = LocalProxy(get_db)
 
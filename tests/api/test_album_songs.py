@@ -11,7 +11,8 @@
 
 import uuid
 
-from supysonic.db import Folder, Artist, Album, Track
+from supysonic.db import Folder, Artist, Album, Track, User
+from supysonic.db import StarredFolder, StarredArtist, StarredAlbum, StarredTrack, RatingFolder
 
 from .apitestbase import ApiTestBase
 
@@ -49,6 +50,9 @@ class AlbumSongsTestCase(ApiTestBase):
         track.last_modification = 0
 
         self.store.add(track)
+        # Done by the scanner in normal conditions
+        Album.update_stats(self.store, self.store.find(Album.id))
+        Artist.update_stats(self.store, self.store.find(Artist.id))
         self.store.commit()
 
     def test_get_album_list(self):
@@ -71,6 +75,29 @@ class AlbumSongsTestCase(ApiTestBase):
         rv, child = self._make_request('getAlbumList', { 'type': 'random' }, tag = 'albumList')
         self.assertEqual(len(child), 0)
 
+    def test_get_album_list_highest(self):
+        root = self.store.find(Folder).one()
+        other = Folder()
+        other.name = 'Other'
+        other.path = 'tests/assets/other'
+        other.parent = root
+        track = self.store.find(Track).one()
+        copy = Track()
+        for attr in ('title', 'disc', 'number', 'duration', 'bitrate', 'content_type', 'last_modification', 'album_id',
+                'artist_id', 'root_folder_id'):
+            setattr(copy, attr, getattr(track, attr))
+        copy.path = 'tests/assets/other/empty'
+        copy.folder_id = other.id
+        self.store.add(copy)
+
+        RatingFolder.rate(self.store, uuid.uuid4(), root.id, 4)
+        RatingFolder.rate(self.store, uuid.uuid4(), other.id, 5)
+        RatingFolder.rate(self.store, uuid.uuid4(), other.id, 4)
+        self.store.commit()
+
+        rv, child = self._make_request('getAlbumList', { 'type': 'highest' }, tag = 'albumList')
+        self.assertEqual([ c.get('id') for c in child ], [ str(other.id), str(root.id) ])
+
     def test_get_album_list2(self):
         self._make_request('getAlbumList2', error = 10)
         self._make_request('getAlbumList2', { 'type': 'void' }, error = 0)
@@ -112,9 +139,33 @@ class AlbumSongsTestCase(ApiTestBase):
     def test_get_starred(self):
         self._make_request('getStarred', tag = 'starred')
 
+        self.__star_everything()
+        rv, child = self._make_request('getStarred', tag = 'starred')
+        self.assertEqual(len(self._xpath(child, './album')), 1)
+        self.assertEqual(len(self._xpath(child, './song')), 1)
+
     def test_get_starred2(self):
         self._make_request('getStarred2', tag = 'starred2')
 
+        self.__star_everything()
+        # The formatter doesn't keep the element order required by the schema
+        rv, child = self._make_request('getStarred2', tag = 'starred2', skip_xsd = True)
+        self.assertEqual(len(self._xpath(child, './artist')), 1)
+        self.assertEqual(len(self._xpath(child, './album')), 1)
+        self.assertEqual(self._xpath(child, './album')[0].get('songCount'), '1')
+        self.assertEqual(len(self._xpath(child, './song')), 1)
+
+    def __star_everything(self):
+        user = self.store.find(User, User.name == u'alice').one()
+        track = self.store.find(Track).one()
+        for cls, starred_id in [ (StarredFolder, track.folder_id), (StarredArtist, track.artist_id),
+                (StarredAlbum, track.album_id), (StarredTrack, track.id) ]:
+            starred = cls()
+            starred.user_id = user.id
+            starred.starred_id = starred_id
+            self.store.add(starred)
+        self.store.commit()
+
 if __name__ == '__main__':
     unittest.main()
 
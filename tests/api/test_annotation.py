@@ -26,7 +26,7 @@ class AnnotationTestCase(ApiTestBase):
 
         folder = Folder()
         folder.name = 'Folder'
-        folder.path = 'tests/assets'
+        folder.path = 'tests/assets/folder'
         folder.parent = root
 
         artist = Artist()
@@ -130,8 +130,10 @@ class AnnotationTestCase(ApiTestBase):
         for i in range(1, 6):
             self._make_request('setRating', { 'id': str(self.track.id), 'rating': i }, skip_post = True)
             self.assertEqual(self.track.as_subsonic_child(self.user, prefs)['userRating'], i)
+            self.assertEqual(self.track.as_subsonic_child(self.user, prefs)['averageRating'], i)
         self._make_request('setRating', { 'id': str(self.track.id), 'rating': 0 }, skip_post = True)
         self.assertNotIn('userRating', self.track.as_subsonic_child(self.user, prefs))
+        self.assertNotIn('averageRating', self.track.as_subsonic_child(self.user, prefs))
 
         self.assertNotIn('userRating', self.folder.as_subsonic_child(self.user))
         for i in range(1, 6):
@@ -68,6 +68,9 @@ class BrowseTestCase(ApiTestBase):
                     track.folder = afolder
                     self.store.add(track)
 
+        # Done by the scanner in normal conditions
+        Album.update_stats(self.store, self.store.find(Album.id))
+        Artist.update_stats(self.store, self.store.find(Artist.id))
         self.store.commit()
 
         self.assertEqual(self.store.find(Folder).count(), 11)
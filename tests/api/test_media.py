@@ -10,6 +10,8 @@
 # Distributed under terms of the GNU AGPLv3 license.
 
 import os.path
+import shutil
+import tempfile
 import uuid
 from io import BytesIO
 from PIL import Image
@@ -118,6 +120,33 @@ class MediaTestCase(ApiTestBase):
 
         # TODO test non square covers
 
+    def test_get_cover_art_transparent(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            Image.new('RGBA', (300, 300), (255, 0, 0, 128)).save(os.path.join(tmpdir, 'cover.png'))
+            folder = Folder()
+            folder.name = 'Transparent'
+            folder.path = tmpdir
+            folder.root = True
+            folder.has_cover_art = True
+            folder.cover_art = 'cover.png'
+            self.store.add(folder)
+            self.store.commit()
+
+            args = { 'u': 'alice', 'p': 'Alic3', 'c': 'tests', 'id': str(folder.id), 'size': 100 }
+            rv = self.client.get('/rest/getCoverArt.view', query_string = args)
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(rv.mimetype, 'image/jpeg')
+            im = Image.open(BytesIO(rv.data))
+            self.assertEqual(im.format, 'JPEG')
+            self.assertEqual(im.size, (100, 100))
+
+            size_path = os.path.join(self.client.application.config['WEBAPP']['cache_dir'], '100')
+            self.assertEqual(len(os.listdir(size_path)), 1)
+            self.assertTrue(all(os.path.getsize(os.path.join(size_path, f)) for f in os.listdir(size_path)))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_get_lyrics(self):
         self._make_request('getLyrics', error = 10)
         self._make_request('getLyrics', { 'artist': 'artist' }, error = 10)
@@ -42,7 +42,7 @@ class PlaylistTestCase(ApiTestBase):
             track.album = album
             track.artist = artist
             track.bitrate = 320
-            track.path = 'tests/assets/empty'
+            track.path = 'tests/assets/' + song.lower()
             track.content_type = 'audio/mpeg'
             track.last_modification = 0
             track.root_folder = root
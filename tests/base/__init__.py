@@ -12,9 +12,13 @@ import unittest
 
 from .test_cli import CLITestCase
 from .test_config import ConfigTestCase
-from .test_db import DbTestCase
+from .test_db import DbTestCase, StorePoolTestCase
+from .test_foldertrie import FolderTrieTestCase
 from .test_lastfm import LastFmTestCase
+from .test_metrics import MetricsTestCase
+from .test_scanjobs import ScanJobsTestCase
 from .test_scanner import ScannerTestCase
+from .test_verifier import SizeVerifierTestCase
 from .test_watcher import suite as watcher_suite
 
 def suite():
@@ -22,8 +26,13 @@ def suite():
 
     suite.addTest(unittest.makeSuite(ConfigTestCase))
     suite.addTest(unittest.makeSuite(DbTestCase))
+    suite.addTest(unittest.makeSuite(StorePoolTestCase))
+    suite.addTest(unittest.makeSuite(FolderTrieTestCase))
     suite.addTest(unittest.makeSuite(ScannerTestCase))
+    suite.addTest(unittest.makeSuite(ScanJobsTestCase))
+    suite.addTest(unittest.makeSuite(SizeVerifierTestCase))
     suite.addTest(watcher_suite())
+    suite.addTest(unittest.makeSuite(MetricsTestCase))
     suite.addTest(unittest.makeSuite(CLITestCase))
     suite.addTest(unittest.makeSuite(LastFmTestCase))
 
@@ -93,6 +93,11 @@ class CLITestCase(unittest.TestCase):
             with tempfile.NamedTemporaryFile(dir = d):
                 self.__cli.onecmd('folder scan')
                 self.__cli.onecmd('folder scan tmpfolder nonexistent')
+                self.__cli.onecmd('folder scan -j 2 tmpfolder')
+                self.__cli.onecmd('folder scan -i tmpfolder')
+                self.__cli.onecmd('folder scan -c 1 tmpfolder')
+                self.__cli.onecmd('folder scan -r tmpfolder')
+                self.__cli.onecmd('folder scan -j -1 tmpfolder')
 
     def test_user_add(self):
         self.__cli.onecmd('user add -p Alic3 alice')
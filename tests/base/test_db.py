@@ -10,14 +10,25 @@
 # Distributed under terms of the GNU AGPLv3 license.
 
 import unittest
-import io, re
+import io, os, re
 from collections import namedtuple
+import tempfile
+import logging
 import uuid
 
+from storm.tracer import install_tracer, remove_tracer_type
+
 from supysonic import db
 
 date_regex = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$')
 
+class StatementCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def connection_raw_execute(self, connection, raw_cursor, statement, params):
+        self.count += 1
+
 class DbTestCase(unittest.TestCase):
     def setUp(self):
         self.store = db.get_store(u'sqlite:')
@@ -68,6 +79,7 @@ class DbTestCase(unittest.TestCase):
         track1.duration = 3
         track1.bitrate = 320
         track1.path = u'tests/assets/empty'
+        track1.size = 0
         track1.content_type = u'audio/mpeg'
         track1.last_modification = 1234
         track1.root_folder = root
@@ -82,7 +94,8 @@ class DbTestCase(unittest.TestCase):
         track2.number = 2
         track2.duration = 5
         track2.bitrate = 96
-        track2.path = u'tests/assets/empty'
+        track2.path = u'tests/assets/23bytes'
+        track2.size = 23
         track2.content_type = u'audio/mpeg'
         track2.last_modification = 1234
         track2.root_folder = root
@@ -141,19 +154,13 @@ class DbTestCase(unittest.TestCase):
         star.user_id = user.id
         star.starred_id = root_folder.id
 
-        rating_user = db.RatingFolder()
-        rating_user.user_id = user.id
-        rating_user.rated_id = root_folder.id
-        rating_user.rating = 2
-
-        rating_other = db.RatingFolder()
-        rating_other.user_id = uuid.uuid4()
-        rating_other.rated_id = root_folder.id
-        rating_other.rating = 5
+        other_id = uuid.uuid4()
+        db.RatingFolder.rate(self.store, user.id, root_folder.id, 4)
+        db.RatingFolder.rate(self.store, user.id, root_folder.id, 2)
+        db.RatingFolder.rate(self.store, other_id, root_folder.id, 5)
+        db.RatingFolder.rate(self.store, other_id, child_folder.id, 1)
 
         self.store.add(star)
-        self.store.add(rating_user)
-        self.store.add(rating_other)
 
         root = root_folder.as_subsonic_child(user)
         self.assertIn(u'starred', root)
@@ -166,6 +173,17 @@ class DbTestCase(unittest.TestCase):
         child = child_folder.as_subsonic_child(user)
         self.assertNotIn(u'starred', child)
         self.assertNotIn(u'userRating', child)
+        self.assertEqual(child[u'averageRating'], 1.0)
+
+        self.assertEqual((root_folder.rating_avg, child_folder.rating_avg), (3.5, 1.0))
+
+        db.RatingFolder.rate(self.store, other_id, child_folder.id, 0)
+        self.assertNotIn(u'averageRating', child_folder.as_subsonic_child(user))
+        self.assertIsNone(child_folder.rating_avg)
+
+        db.RatingFolder.remove_user(self.store, user.id)
+        self.assertEqual((root_folder.rating_sum, root_folder.rating_count, root_folder.rating_avg), (5, 1, 5.0))
+        self.assertEqual(self.store.find(db.RatingFolder).count(), 1)
 
     def test_artist(self):
         artist = db.Artist()
@@ -199,6 +217,7 @@ class DbTestCase(unittest.TestCase):
         album.name = u'The Album After The Frist One'
         artist.albums.add(album)
 
+        db.Artist.update_stats(self.store, [ artist.id ])
         artist_dict = artist.as_subsonic_artist(user)
         self.assertEqual(artist_dict[u'albumCount'], 2)
 
@@ -222,9 +241,11 @@ class DbTestCase(unittest.TestCase):
         self.store.add(star)
 
         # No tracks, shouldn't be stored under normal circumstances
-        self.assertRaises(ValueError, album.as_subsonic_album, user)
+        self.assertEqual(album.as_subsonic_album(user)[u'songCount'], 0)
 
-        self.create_some_tracks(artist, album)
+        track1, track2 = self.create_some_tracks(artist, album)
+        track2.year = 2001
+        db.Album.update_stats(self.store, [ album.id ])
 
         album_dict = album.as_subsonic_album(user)
         self.assertIsInstance(album_dict, dict)
@@ -243,6 +264,40 @@ class DbTestCase(unittest.TestCase):
         self.assertEqual(album_dict[u'duration'], 8)
         self.assertRegexpMatches(album_dict[u'created'], date_regex)
         self.assertRegexpMatches(album_dict[u'starred'], date_regex)
+        self.assertEqual(album_dict[u'coverArt'], str(track1.folder_id))
+        self.assertEqual(album.created, track1.created)
+        self.assertEqual(album.sort_key(), u'2001test album')
+
+    def test_album_list(self):
+        track1, track2 = self.create_some_tracks()
+        other = db.Album()
+        other.artist = track1.artist
+        other.name = u'Other Album'
+        track2.album = other
+        db.Album.update_stats(self.store, self.store.find(db.Album.id))
+        db.Artist.update_stats(self.store, [ track1.artist_id ])
+        self.store.commit()
+
+        # Assuming SQLite doesn't enforce foreign key constraints
+        MockUser = namedtuple(u'User', [ u'id' ])
+        user = MockUser(uuid.uuid4())
+
+        albums = list(self.store.find(db.Album).order_by(db.Album.name))
+        counter = StatementCounter()
+        install_tracer(counter)
+        try:
+            infos = db.Album.as_subsonic_albums(albums, user)
+        finally:
+            remove_tracer_type(StatementCounter)
+        self.assertEqual(counter.count, 2)
+
+        self.assertEqual(infos, [ a.as_subsonic_album(user) for a in albums ])
+        self.assertEqual([ i[u'name'] for i in infos ], [ u'Other Album', u'Test Album' ])
+        self.assertEqual([ i[u'duration'] for i in infos ], [ 5, 3 ])
+        self.assertEqual(infos[0][u'coverArt'], str(track2.folder_id))
+
+        artist_dict, = db.Artist.as_subsonic_artists([ track1.artist ], user)
+        self.assertEqual(artist_dict[u'albumCount'], 2)
 
     def test_track(self):
         track1, track2 = self.create_some_tracks()
@@ -260,6 +315,44 @@ class DbTestCase(unittest.TestCase):
         self.assertFalse(track1_dict[u'isDir'])
         # ... we'll test the rest against the API XSD.
 
+    def test_track_children(self):
+        track1, track2 = self.create_some_tracks()
+        playlist = self.create_playlist()
+        user = playlist.user
+
+        starred = db.StarredTrack()
+        starred.user = user
+        starred.starred_id = track2.id
+        self.store.add(starred)
+        db.RatingTrack.rate(self.store, user.id, track2.id, 4)
+        db.RatingTrack.rate(self.store, uuid.uuid4(), track2.id, 1)
+        self.store.commit()
+
+        self.assertEqual(db.Track.as_subsonic_children([], user, None), [])
+
+        # Reload the tracks invalidated by the commit
+        tracks = list(self.store.find(db.Track).order_by(db.Track.number))
+        counter = StatementCounter()
+        install_tracer(counter)
+        try:
+            children = db.Track.as_subsonic_children(tracks, user, None)
+        finally:
+            remove_tracer_type(StatementCounter)
+        self.assertEqual(counter.count, 5)
+
+        self.assertEqual(children, [ track1.as_subsonic_child(user, None), track2.as_subsonic_child(user, None) ])
+        self.assertEqual(children[0][u'size'], 0)
+        self.assertEqual(children[0][u'path'], u'assets/empty')
+        self.assertEqual(children[0][u'album'], u'Test Album')
+        self.assertEqual(children[0][u'coverArt'], str(track1.folder_id))
+        self.assertNotIn(u'starred', children[0])
+        self.assertNotIn(u'userRating', children[0])
+        self.assertNotIn(u'averageRating', children[0])
+        self.assertEqual(children[1][u'size'], 23)
+        self.assertRegexpMatches(children[1][u'starred'], date_regex)
+        self.assertEqual(children[1][u'userRating'], 4)
+        self.assertEqual(children[1][u'averageRating'], 2.5)
+
     def test_user(self):
         user = db.User()
         user.name = u'Test User'
@@ -329,6 +422,19 @@ class DbTestCase(unittest.TestCase):
         playlist.remove_at_indexes([ 1, 1 ])
         self.assertSequenceEqual(playlist.get_tracks(), [ track2, track1 ])
 
+        for _ in range(3):
+            playlist.add(track1)
+        self.store.flush()
+        counter = StatementCounter()
+        install_tracer(counter)
+        try:
+            playlist.remove_at_indexes([ 4, 0, 2, 12, -1 ])
+            self.store.flush()
+        finally:
+            remove_tracer_type(StatementCounter)
+        self.assertEqual(counter.count, 2)
+        self.assertSequenceEqual(playlist.get_tracks(), [ track1, track1 ])
+
     def test_playlist_fixing(self):
         playlist = self.create_playlist()
         track1, track2 = self.create_some_tracks()
@@ -344,6 +450,66 @@ class DbTestCase(unittest.TestCase):
         playlist.tracks = u'{0},{0},some random garbage,{0}'.format(track1.id)
         self.assertSequenceEqual(playlist.get_tracks(), [ track1, track1, track1 ])
 
+        # Reading the playlist doesn't commit the migration
+        self.store.commit()
+        playlist.tracks = u'{0}'.format(track1.id)
+        self.assertSequenceEqual(playlist.get_tracks(), [ track1 ])
+        self.store.rollback()
+        self.assertSequenceEqual(playlist.get_tracks(), [ track1, track1, track1 ])
+
+class StorePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = tempfile.mkstemp()[1]
+        self.pool = db.StorePool(u'sqlite:' + self.dbfile, size = 2, timeout = 0.1)
+
+    def tearDown(self):
+        self.pool.close()
+        os.unlink(self.dbfile)
+
+    def test_sqlite(self):
+        # SQLite connections are bound to their thread, each store is opened on demand and closed when given back
+        stores = [ self.pool.get() for _ in range(3) ]
+        self.assertEqual(len(set(stores)), 3)
+
+        store = stores.pop()
+        store.execute('SELECT 1')
+        self.pool.put(store)
+        self.assertIsNot(self.pool.get(), store)
+        self.assertRaises(Exception, store.execute, 'SELECT 1')
+
+    def test_get_pool(self):
+        class Handler(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.records = []
+            def emit(self, record):
+                self.records.append(record)
+
+        uri = u'sqlite:' + self.dbfile
+        handler = Handler()
+        logger = logging.getLogger('supysonic.db')
+        logger.addHandler(handler)
+        try:
+            pool = db.get_pool(uri, 3)
+            self.assertIs(db.get_pool(uri), pool)
+            self.assertIs(db.get_pool(uri, 3), pool)
+            self.assertEqual(handler.records, [])
+
+            # Can't be resized
+            self.assertIs(db.get_pool(uri, 5), pool)
+            self.assertEqual(pool.size, 3)
+            self.assertEqual(len(handler.records), 1)
+        finally:
+            logger.removeHandler(handler)
+            db._pools.pop(uri, None)
+
+    def test_memory(self):
+        pool = db.StorePool(u'sqlite:', size = 1)
+        store = pool.get()
+        pool.put(store)
+        self.assertIsNot(pool.get(), store)
+        pool.get()
+
 if __name__ == '__main__':
     unittest.main()
 
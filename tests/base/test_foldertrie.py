@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# This file is part of Supysonic.
+# Supysonic is a Python implementation of the Subsonic server API.
+#
+# Copyright (C) 2017 Alban 'spl0k' Féron
+#
+# Distributed under terms of the GNU AGPLv3 license.
+
+import unittest
+
+from supysonic.foldertrie import FolderTrie
+
+class FolderTrieTestCase(unittest.TestCase):
+    def setUp(self):
+        self.trie = FolderTrie([
+            (u'/music', 1, True),
+            (u'/music/artist', 2, False),
+            (u'/music/artist/album', 3, False)
+        ])
+
+    def test_mapping(self):
+        self.assertEqual(len(self.trie), 3)
+        self.assertIn(u'/music/artist', self.trie)
+        self.assertNotIn(u'/music/other', self.trie)
+        self.assertNotIn(u'/', self.trie)
+        self.assertEqual(self.trie[u'/music/artist/album'], 3)
+        self.assertRaises(KeyError, self.trie.__getitem__, u'/mus')
+
+        self.trie[u'/music/other'] = 4
+        self.assertEqual(self.trie[u'/music/other'], 4)
+        self.assertEqual(len(self.trie), 4)
+
+    def test_lookups(self):
+        self.assertEqual(self.trie.ancestor(u'/music/artist/album/cd1'), (u'/music/artist/album', 3))
+        self.assertEqual(self.trie.ancestor(u'/music/artist'), (u'/music/artist', 2))
+        self.assertEqual(self.trie.ancestor(u'/music2/artist'), None)
+        self.assertEqual(self.trie.root(u'/music/artist/album/cd1'), (u'/music', 1))
+        self.assertEqual(self.trie.root(u'/other'), None)
+
+        self.assertTrue(self.trie.has_ancestor(u'/music/new'))
+        self.assertFalse(self.trie.has_ancestor(u'/musicals'))
+        self.assertTrue(self.trie.has_descendant(u'/'))
+        self.assertTrue(self.trie.has_descendant(u'/music/artist'))
+        self.assertFalse(self.trie.has_descendant(u'/music/artist/album'))
+
+    def test_discard(self):
+        self.trie.discard(u'/music/artist/album')
+        self.assertEqual(len(self.trie), 2)
+        self.assertFalse(self.trie.has_descendant(u'/music/artist'))
+
+        self.trie.discard(u'/inexistent')
+        self.assertEqual(len(self.trie), 2)
+
+        del self.trie[u'/music']
+        self.assertEqual(len(self.trie), 0)
+        self.assertFalse(self.trie.has_descendant(u'/'))
+        self.assertRaises(KeyError, self.trie.__delitem__, u'/music')
+
+if __name__ == '__main__':
+    unittest.main()
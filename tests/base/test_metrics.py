@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# This file is part of Supysonic.
+# Supysonic is a Python implementation of the Subsonic server API.
+#
+# Copyright (C) 2017 Alban 'spl0k' Féron
+#
+# Distributed under terms of the GNU AGPLv3 license.
+
+import time
+import unittest
+
+from StringIO import StringIO
+
+from supysonic.cli import SupysonicCLI
+from supysonic.metrics import WatcherMetrics, MetricsServer, fetch_metrics
+
+from ..testbase import TestConfig
+
+class FakeQueue(object):
+    def __init__(self):
+        self.metrics = WatcherMetrics()
+
+    def pending(self):
+        return 3, time.time() - 10
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queue = FakeQueue()
+        self.server = MetricsServer('localhost:0', self.queue)
+        self.server.start()
+        self.address = 'localhost:{}'.format(self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_fetch(self):
+        self.queue.metrics.scanned(4, 2.0)
+        self.queue.metrics.committed(0.5)
+        self.queue.metrics.processed(5)
+        self.queue.metrics.error(Exception(u'Something "bad"\nhappened'))
+
+        metrics = fetch_metrics(self.address)
+        self.assertEqual(metrics['queue_depth'][1], 3)
+        self.assertGreaterEqual(metrics['oldest_event_age_seconds'][1], 10)
+        self.assertEqual(metrics['events_processed_total'][1], 5)
+        self.assertGreater(metrics['events_per_second'][1], 0)
+        self.assertEqual(metrics['scan_seconds_sum'][1], 2.0)
+        self.assertEqual(metrics['scan_seconds_count'][1], 4)
+        self.assertEqual(metrics['commit_seconds_count'][1], 1)
+        self.assertEqual(metrics['errors_total'][1], 1)
+        self.assertEqual(metrics['last_error_timestamp_seconds'][0], { 'message': u'Something "bad"\nhappened' })
+
+    def test_cli_status(self):
+        self.queue.metrics.scanned(4, 2.0)
+
+        stdout = StringIO()
+        stderr = StringIO()
+        cli = SupysonicCLI(TestConfig(False, False), stdout = stdout, stderr = stderr)
+        cli.onecmd('watcher status ' + self.address)
+        self.assertIn('Pending events: 3', stdout.getvalue())
+        self.assertIn('Average scan time: 500.0ms (4 files)', stdout.getvalue())
+        self.assertNotIn('Last error', stdout.getvalue())
+
+        cli.onecmd('watcher status')
+        self.assertIn('No metrics address set', stderr.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
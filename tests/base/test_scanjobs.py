@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# This file is part of Supysonic.
+# Supysonic is a Python implementation of the Subsonic server API.
+#
+# Copyright (C) 2017 Alban 'spl0k' Féron
+#
+# Distributed under terms of the GNU AGPLv3 license.
+
+import io
+import os
+import os.path
+import tempfile
+import threading
+import time
+import unittest
+
+from supysonic import db, scanjobs
+from supysonic.managers.folder import FolderManager
+from supysonic.scanner import Scanner
+from supysonic.scanjobs import ScanJobRunner, current_job, submit_scan, latest_jobs, run_pending_jobs
+
+class ScanJobsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = tempfile.mkstemp()[1]
+        self.config = {
+            'database_uri': 'sqlite:' + self.dbfile,
+            'scanner_extensions': None,
+            'scanner_cover_names': None,
+            'scanner_workers': 1,
+            'scanner_commit_every': 0,
+            'database_pool_size': 2
+        }
+
+        self.store = db.get_store(self.config['database_uri'])
+        with io.open('schema/sqlite.sql', 'r') as f:
+            for statement in f.read().split(';'):
+                self.store.execute(statement)
+        self.store.commit()
+
+        FolderManager.add(self.store, 'folder', os.path.abspath('tests/assets'))
+        self.folder = self.store.find(db.Folder).one()
+
+    def tearDown(self):
+        self.store.close()
+        os.unlink(self.dbfile)
+
+    def test_submit(self):
+        job = submit_scan(self.store, self.folder)
+        self.assertEqual(job.status, db.ScanJob.QUEUED)
+        self.assertIs(submit_scan(self.store, self.folder), job)
+        self.assertIs(current_job(self.store, self.folder.id), job)
+
+        # Dead jobs don't prevent new ones from being submitted
+        job.status = db.ScanJob.RUNNING
+        job.updated = int(time.time()) - 3600
+        other = submit_scan(self.store, self.folder)
+        self.assertIsNot(other, job)
+        self.assertEqual(self.store.find(db.ScanJob).count(), 1)
+        self.assertIs(latest_jobs(self.store)[self.folder.id], other)
+
+    def test_runner(self):
+        job = submit_scan(self.store, self.folder)
+
+        runner = ScanJobRunner(self.config)
+        runner.start()
+        try:
+            for _ in range(100):
+                # Don't hold a lock on the database while the runner works
+                self.store.rollback()
+                if not job.is_active():
+                    break
+                time.sleep(0.1)
+        finally:
+            runner.stop()
+            runner.join()
+
+        self.assertEqual(job.status, db.ScanJob.DONE)
+        self.assertEqual(self.store.find(db.Track).count(), 1)
+
+        progress = job.as_progress()
+        self.assertEqual(progress['status'], 'done')
+        self.assertEqual(progress['added'], [ 1, 1, 1 ])
+        self.assertEqual(progress['deleted'], [ 0, 0, 0 ])
+        self.assertIsNone(progress['eta'])
+
+    def test_one_job_per_folder(self):
+        running = db.ScanJob()
+        running.folder_id = self.folder.id
+        running.status = db.ScanJob.RUNNING
+        running.updated = int(time.time())
+        queued = db.ScanJob()
+        queued.folder_id = self.folder.id
+        self.store.add(running)
+        self.store.add(queued)
+        self.store.commit()
+
+        # Left for later while the folder is being scanned
+        run_pending_jobs(self.store, self.config)
+        self.assertEqual(queued.status, db.ScanJob.QUEUED)
+        self.assertEqual(self.store.find(db.Track).count(), 0)
+
+        # Unless the running job is dead
+        running.updated -= 3600
+        self.store.commit()
+        run_pending_jobs(self.store, self.config)
+        self.assertEqual(queued.status, db.ScanJob.DONE)
+        self.assertEqual(self.store.find(db.Track).count(), 1)
+
+    def test_failed_job(self):
+        job = submit_scan(self.store, self.folder)
+        self.store.remove(self.folder)
+        self.store.commit()
+
+        run_pending_jobs(self.store, self.config)
+        self.assertEqual(job.status, db.ScanJob.FAILED)
+        self.assertEqual(job.error, u'Folder not found')
+        self.assertNotEqual(job.finished, 0)
+
+    def test_long_job(self):
+        job = submit_scan(self.store, self.folder)
+
+        # A scan finding nothing to do, taking longer than a job is given to show signs of life
+        class SlowScanner(Scanner):
+            def scan(self, folder, progress_callback = None, resume = False):
+                time.sleep(1.5)
+                Scanner.scan(self, folder, progress_callback, resume)
+
+        stale_delay = scanjobs.STALE_DELAY
+        scanjobs.STALE_DELAY = 1
+        scanjobs.Scanner = SlowScanner
+        thread = threading.Thread(target = lambda: run_pending_jobs(db.get_store(self.config['database_uri']), self.config))
+        thread.start()
+        try:
+            time.sleep(1.2)
+            self.store.rollback()
+            self.assertIs(current_job(self.store, self.folder.id), job)
+            self.assertEqual(job.status, db.ScanJob.RUNNING)
+            self.assertIs(submit_scan(self.store, self.folder), job)
+        finally:
+            thread.join()
+            scanjobs.STALE_DELAY = stale_delay
+            scanjobs.Scanner = Scanner
+
+        self.store.rollback()
+        self.assertEqual(job.status, db.ScanJob.DONE)
+        self.assertEqual(job.added_tracks, 1)
+        self.assertNotEqual(job.total, 0)
+        self.assertEqual(job.scanned, job.total)
+        self.assertEqual(self.store.find(db.ScanJob).count(), 1)
+
+    def test_heartbeat(self):
+        job = submit_scan(self.store, self.folder)
+        job.status = db.ScanJob.RUNNING
+        job.updated = int(time.time()) - 60
+        self.store.commit()
+
+        values = { db.ScanJob.scanned: 12, db.ScanJob.total: 34 }
+        scanjobs._Heartbeat(self.config['database_uri'], job.id, lambda: values, None).beat()
+        self.store.rollback()
+        self.assertEqual((job.scanned, job.total), (12, 34))
+        self.assertGreaterEqual(job.updated, int(time.time()) - 1)
+
+if __name__ == '__main__':
+    unittest.main()
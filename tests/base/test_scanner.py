@@ -12,14 +12,19 @@
 import io
 import mutagen
 import os.path
+import shutil
 import tempfile
+import time
 import unittest
 
 from contextlib import contextmanager
+from storm.databases.mysql import compile as mysql_compile
+from storm.databases.sqlite import compile as sqlite_compile
+from storm.tracer import install_tracer, remove_tracer_type
 
 from supysonic import db
 from supysonic.managers.folder import FolderManager
-from supysonic.scanner import Scanner
+from supysonic.scanner import Scanner, _below
 
 class ScannerTestCase(unittest.TestCase):
     def setUp(self):
@@ -66,10 +71,60 @@ class ScannerTestCase(unittest.TestCase):
         self.assertEqual(self.store.find(db.Track).count(), 1)
 
     def test_force_rescan(self):
+        self.scanner.finish()
         self.scanner = Scanner(self.store, True)
         self.scanner.scan(self.folder)
         self.assertEqual(self.store.find(db.Track).count(), 1)
 
+    def test_parallel_scan(self):
+        self.assertRaises(TypeError, Scanner, self.store, workers = -1)
+        self.assertRaises(TypeError, Scanner, self.store, workers = 'string')
+
+        self.scanner.finish()
+        self.scanner = Scanner(self.store, True, workers = 2)
+        with self.__temporary_track_copy() as tf:
+            self.scanner.scan(self.folder)
+            self.assertEqual(self.store.find(db.Track).count(), 2)
+            copy = self.store.find(db.Track, db.Track.path == tf.name).one()
+            self.assertEqual(copy.artist.name, 'Some artist')
+            self.assertEqual(copy.album.name, 'Awesome album')
+
+    def test_rescan_queries(self):
+        class StatementCounter(object):
+            count = 0
+            def connection_raw_execute(self, connection, raw_cursor, statement, params):
+                self.count += 1
+
+        def count_rescan_statements():
+            self.store.flush()
+            counter = StatementCounter()
+            install_tracer(counter)
+            scanner = Scanner(self.store)
+            try:
+                scanner.scan(self.folder)
+            finally:
+                remove_tracer_type(StatementCounter)
+            scanner.finish()
+            return counter.count
+
+        single = count_rescan_statements()
+        with self.__temporary_track_copy():
+            with self.__temporary_track_copy():
+                self.scanner.scan(self.folder)
+                self.assertEqual(self.store.find(db.Track).count(), 3)
+                self.assertEqual(count_rescan_statements(), single)
+
+    def test_scan_extensions(self):
+        self.scanner.finish()
+        self.scanner = Scanner(self.store, extensions = [ 'ogg' ])
+        self.scanner.scan(self.folder)
+        self.scanner.finish()
+        self.assertEqual(self.store.find(db.Track).count(), 0)
+
+        self.scanner = Scanner(self.store, extensions = [ 'mp3' ])
+        self.scanner.scan(self.folder)
+        self.assertEqual(self.store.find(db.Track).count(), 1)
+
     def test_scan_file(self):
         track = self.store.find(db.Track).one()
         self.assertRaises(TypeError, self.scanner.scan_file, None)
@@ -119,8 +174,147 @@ class ScannerTestCase(unittest.TestCase):
         self.assertEqual(self.store.find(db.Track).count(), 1)
         self.assertEqual(track.path, new_path)
 
+    def test_move_remove_directory(self):
+        track = self.store.find(db.Track).one()
+        src = os.path.dirname(track.path)
+        dst = os.path.join(os.path.dirname(src), u'moved')
+        self.assertRaises(TypeError, self.scanner.move_directory, None, dst)
+        self.assertRaises(TypeError, self.scanner.remove_directory, None)
+
+        self.scanner.move_directory(u'/some/inexistent/path', dst)
+        self.scanner.move_directory(src, dst)
+        self.scanner.finish()
+        self.assertEqual(track.path, os.path.join(dst, os.path.basename(track.path)))
+        self.assertEqual(track.folder.path, dst)
+        self.assertEqual(track.folder.name, u'moved')
+        self.assertEqual(track.folder.parent_id, self.folder.id)
+        self.assertEqual(self.store.find(db.Folder).count(), 2)
+
+        self.scanner.remove_directory(dst)
+        self.scanner.finish()
+        self.assertEqual(self.store.find(db.Track).count(), 0)
+        self.assertEqual(self.store.find(db.Folder).count(), 1)
+        self.assertEqual(self.store.find(db.Album).count(), 0)
+
+    def test_move_remove_directory_case(self):
+        root = tempfile.mkdtemp()
+        try:
+            for name in (u'Foo', u'foo'):
+                os.mkdir(os.path.join(root, name))
+                shutil.copyfile('tests/assets/folder/silence.mp3', os.path.join(root, name, u'silence.mp3'))
+            FolderManager.add(self.store, u'case', root)
+            folder = self.store.find(db.Folder, db.Folder.path == root).one()
+            self.scanner.scan(folder)
+            self.scanner.finish()
+            lower = os.path.join(root, u'foo', u'silence.mp3')
+            self.assertEqual(self.store.find(db.Track, db.Track.path == lower).count(), 1)
+
+            self.scanner.move_directory(os.path.join(root, u'Foo'), os.path.join(root, u'Bar'))
+            self.scanner.finish()
+            paths = set(self.store.find(db.Track.path, db.Track.root_folder_id == folder.id))
+            self.assertEqual(paths, { os.path.join(root, u'Bar', u'silence.mp3'), lower })
+            self.assertIsNotNone(self.store.find(db.Folder, db.Folder.path == os.path.join(root, u'foo')).one())
+
+            self.scanner.remove_directory(os.path.join(root, u'FOO'))
+            self.scanner.remove_directory(os.path.join(root, u'Bar'))
+            self.scanner.finish()
+            paths = set(self.store.find(db.Track.path, db.Track.root_folder_id == folder.id))
+            self.assertEqual(paths, { lower })
+        finally:
+            shutil.rmtree(root)
+
+    def test_resume_stats(self):
+        root = tempfile.mkdtemp()
+        try:
+            for name in (u'a.mp3', u'b.mp3', u'c.mp3'):
+                path = os.path.join(root, name)
+                shutil.copyfile('tests/assets/folder/silence.mp3', path)
+                tags = mutagen.File(path, easy = True)
+                tags['artist'] = tags['albumartist'] = 'Resumed artist'
+                tags['album'] = 'Resumed album'
+                tags.save()
+            FolderManager.add(self.store, u'resume', root)
+            folder = self.store.find(db.Folder, db.Folder.path == root).one()
+
+            # Crashes after committing the first file
+            def progress(current, total):
+                if current == 2:
+                    raise RuntimeError('Interrupted')
+            self.scanner.finish()
+            self.scanner = Scanner(self.store, commit_every = 1)
+            self.assertRaises(RuntimeError, self.scanner.scan, folder, progress)
+            self.store.rollback()
+            self.scanner.abort()
+
+            # What was committed is consistent
+            album = self.store.find(db.Album, db.Album.name == u'Resumed album').one()
+            self.assertEqual(album.song_count, 1)
+            self.assertEqual(album.artist.album_count, 1)
+
+            self.scanner = Scanner(self.store, commit_every = 1)
+            self.scanner.scan(folder, resume = True)
+            self.scanner.finish()
+            self.assertEqual(self.store.find(db.Track, db.Track.root_folder_id == folder.id).count(), 3)
+            self.assertEqual(album.song_count, 3)
+            self.assertEqual(album.artist.album_count, 1)
+        finally:
+            shutil.rmtree(root)
+
+    def test_below_mysql(self):
+        # The default collation of the MySQL schema ignores case, the prefix must be compared as bytes there
+        expr = _below(db.Track.path, u'/m/Foo')
+        self.assertIn(u'BINARY SUBSTR(', mysql_compile(expr))
+        self.assertNotIn(u'BINARY', sqlite_compile(expr))
+
+    def test_scan_directory(self):
+        track = self.store.find(db.Track).one()
+        directory = os.path.dirname(track.path)
+        self.assertRaises(TypeError, self.scanner.scan_directory, None)
+
+        with self.__temporary_track_copy() as tf:
+            self.scanner.scan_directory(directory)
+            self.scanner.finish()
+            self.assertEqual(self.store.find(db.Track).count(), 2)
+
+        # The copy is gone
+        self.scanner.scan_directory(directory)
+        self.scanner.finish()
+        self.assertEqual(self.store.find(db.Track).count(), 1)
+
+        # Folders of vanished subdirectories are removed along with their tracks
+        sub = db.Folder()
+        sub.root = False
+        sub.name = u'gone'
+        sub.path = os.path.join(directory, u'gone')
+        sub.parent = track.folder
+        self.store.add(sub)
+        self.scanner.scan_directory(directory)
+        self.scanner.finish()
+        self.assertEqual(self.store.find(db.Folder, db.Folder.name == u'gone').count(), 0)
+        self.assertEqual(self.store.find(db.Track).count(), 1)
+
+    def test_album_stats(self):
+        self.scanner.finish()
+        track = self.store.find(db.Track).one()
+        album = track.album
+        self.assertEqual(album.song_count, 1)
+        self.assertEqual(album.duration, track.duration)
+        self.assertEqual(album.created, track.created)
+        self.assertEqual(album.artist.album_count, 1)
+
+        with self.__temporary_track_copy() as tf:
+            self.scanner.scan(self.folder)
+            self.scanner.finish()
+            self.assertEqual(album.song_count, 2)
+            self.assertEqual(album.duration, 2 * track.duration)
+
+        self.scanner.scan(self.folder)
+        self.scanner.finish()
+        self.assertEqual(album.song_count, 1)
+
     def test_rescan_corrupt_file(self):
         track = self.store.find(db.Track).one()
+        self.scanner.finish()
         self.scanner = Scanner(self.store, True)
 
         with self.__temporary_track_copy() as tf:
@@ -144,7 +338,44 @@ class ScannerTestCase(unittest.TestCase):
         self.scanner.scan(self.folder)
         self.assertEqual(self.store.find(db.Track).count(), 1)
 
+    def test_rescan_removed_annotated_file(self):
+        user = db.User()
+        user.name = u'alice'
+        user.password = u'password'
+        user.salt = u'salt'
+        self.store.add(user)
+
+        with self.__temporary_track_copy() as tf:
+            self.scanner.scan(self.folder)
+            copy = self.store.find(db.Track, db.Track.path == tf.name).one()
+            user.last_play_id = copy.id
+            starred = db.StarredTrack()
+            starred.user_id = user.id
+            starred.starred_id = copy.id
+            self.store.add(starred)
+            rating = db.RatingTrack()
+            rating.user_id = user.id
+            rating.rated_id = copy.id
+            rating.rating = 5
+            self.store.add(rating)
+            playlist = db.Playlist()
+            playlist.user = user
+            playlist.name = u'playlist'
+            self.store.add(playlist)
+            playlist.add(copy)
+            playlist.add(self.store.find(db.Track, db.Track.id != copy.id).one())
+            self.store.commit()
+
+        self.scanner.scan(self.folder)
+        self.assertEqual(self.store.find(db.Track).count(), 1)
+        self.assertEqual(self.store.find(db.StarredTrack).count(), 0)
+        self.assertEqual(self.store.find(db.RatingTrack).count(), 0)
+        self.assertEqual(self.store.find(db.PlaylistTrack).count(), 1)
+        self.assertIsNone(user.last_play_id)
+        self.assertEqual(self.scanner.stats()[1][2], 1)
+
     def test_scan_tag_change(self):
+        self.scanner.finish()
         self.scanner = Scanner(self.store, True)
 
         with self.__temporary_track_copy() as tf:
@@ -165,6 +396,124 @@ class ScannerTestCase(unittest.TestCase):
             self.assertIsNotNone(self.store.find(db.Artist, db.Artist.name == 'Some artist').one())
             self.assertIsNotNone(self.store.find(db.Album, db.Album.name == 'Awesome album').one())
 
+    def test_incremental_scan(self):
+        with self.__temporary_track_copy() as tf:
+            self.scanner.scan(self.folder)
+            copy = self.store.find(db.Track, db.Track.path == tf.name).one()
+            self.assertEqual(copy.artist.name, 'Some artist')
+            folder = copy.folder
+            self.assertNotEqual(folder.last_modification, 0)
+            self.assertEqual(folder.entry_count, len(os.listdir(folder.path)))
+
+            # Changing a file in place doesn't change its directory
+            tags = mutagen.File(copy.path, easy = True)
+            tags['artist'] = 'Renamed artist'
+            tags.save()
+            os.utime(copy.path, (time.time() + 10, time.time() + 10))
+
+            self.scanner.finish()
+            self.scanner = Scanner(self.store, incremental = True)
+            self.scanner.scan(self.folder)
+            self.scanner.finish()
+            self.assertEqual(copy.artist.name, 'Some artist')
+
+            self.scanner = Scanner(self.store, True, incremental = True)
+            self.scanner.scan(self.folder)
+            self.scanner.finish()
+            self.assertEqual(copy.artist.name, 'Renamed artist')
+
+        self.scanner = Scanner(self.store, incremental = True)
+        self.scanner.scan(self.folder)
+        self.assertEqual(self.store.find(db.Track).count(), 1)
+
+    def test_cover_art(self):
+        self.assertTrue(self.folder.has_cover_art)
+        self.assertEqual(self.folder.cover_art, 'cover.jpg')
+        self.assertNotEqual(self.folder.cover_art_modification, 0)
+        track = self.store.find(db.Track).one()
+        self.assertFalse(track.folder.has_cover_art)
+        self.assertIsNone(track.folder.cover_art)
+
+        self.assertRaises(TypeError, Scanner, self.store, cover_names = 'cover.jpg')
+
+        self.scanner.finish()
+        self.scanner = Scanner(self.store, cover_names = [ 'Folder.png', 'cover.jpg' ])
+        path = os.path.join(self.folder.path, 'folder.png')
+        with io.open(path, 'wb'):
+            pass
+        try:
+            self.scanner.scan(self.folder)
+            self.assertEqual(self.folder.cover_art, 'folder.png')
+        finally:
+            os.unlink(path)
+
+        self.scanner.scan(self.folder)
+        self.assertTrue(self.folder.has_cover_art)
+        self.assertEqual(self.folder.cover_art, 'cover.jpg')
+
+    def test_commit_and_resume(self):
+        self.assertRaises(TypeError, Scanner, self.store, commit_every = -1)
+
+        with self.__temporary_track_copy() as tf1:
+            with self.__temporary_track_copy() as tf2:
+                first, second = sorted([ tf1.name, tf2.name ])
+                checkpoints = []
+                self.scanner.finish()
+                self.scanner = Scanner(self.store, commit_every = 1)
+                self.scanner.scan(self.folder, lambda c, t: checkpoints.append(self.folder.scan_checkpoint))
+                self.assertEqual(self.store.find(db.Track).count(), 3)
+                self.assertIn(first[len(self.folder.path) + 1:], checkpoints)
+                self.assertIsNone(self.folder.scan_checkpoint)
+
+                self.store.find(db.Track, db.Track.path.is_in([ first, second ])).remove()
+                self.folder.scan_checkpoint = first[len(self.folder.path) + 1:]
+                self.scanner.finish()
+                self.scanner = Scanner(self.store)
+                self.scanner.scan(self.folder, resume = True)
+                self.assertIsNone(self.store.find(db.Track, db.Track.path == first).one())
+                self.assertIsNotNone(self.store.find(db.Track, db.Track.path == second).one())
+                self.assertIsNone(self.folder.scan_checkpoint)
+
+    def test_finish_cleanup(self):
+        user = db.User()
+        user.name = u'alice'
+        user.password = u'password'
+        user.salt = u'salt'
+        self.store.add(user)
+
+        track = self.store.find(db.Track).one()
+        subdir = tempfile.mkdtemp(dir = os.path.dirname(track.path))
+        try:
+            nested = os.path.join(subdir, 'nested')
+            os.mkdir(nested)
+            with io.open(track.path, 'rb') as src, io.open(os.path.join(nested, 'copy.mp3'), 'wb') as dst:
+                dst.write(src.read())
+
+            self.scanner.scan(self.folder)
+            self.assertEqual(self.store.find(db.Folder).count(), 4)
+            copy = self.store.find(db.Track, db.Track.folder_id != track.folder_id).one()
+
+            starred = db.StarredFolder()
+            starred.user_id = user.id
+            starred.starred_id = copy.folder_id
+            self.store.add(starred)
+            rating = db.RatingFolder()
+            rating.user_id = user.id
+            rating.rated_id = copy.folder.parent_id
+            rating.rating = 3
+            self.store.add(rating)
+        finally:
+            shutil.rmtree(subdir)
+
+        self.scanner.scan(self.folder)
+        self.scanner.finish()
+        self.assertEqual(self.store.find(db.Track).count(), 1)
+        self.assertEqual(self.store.find(db.Folder).count(), 2)
+        self.assertEqual(self.store.find(db.StarredFolder).count(), 0)
+        self.assertEqual(self.store.find(db.RatingFolder).count(), 0)
+        self.assertEqual(self.store.find(db.Album).count(), 1)
+        self.assertEqual(self.store.find(db.Artist).count(), 1)
+
     def test_stats(self):
         self.assertEqual(self.scanner.stats(), ((1,1,1),(0,0,0)))
 
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# This file is part of Supysonic.
+# Supysonic is a Python implementation of the Subsonic server API.
+#
+# Copyright (C) 2017 Alban 'spl0k' Féron
+#
+# Distributed under terms of the GNU AGPLv3 license.
+
+import io
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from supysonic import db
+from supysonic.managers.folder import FolderManager
+from supysonic.scanner import Scanner
+from supysonic.verifier import SizeVerifier, file_size, verify_sizes
+
+class SizeVerifierTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = tempfile.mkstemp()[1]
+        self.musicdir = tempfile.mkdtemp()
+        self.store = db.get_store('sqlite:' + self.dbfile)
+        with io.open('schema/sqlite.sql', 'r') as f:
+            for statement in f.read().split(';'):
+                self.store.execute(statement)
+        self.store.commit()
+
+        for name in ('a.mp3', 'b.mp3', 'c.mp3'):
+            shutil.copyfile('tests/assets/folder/silence.mp3', os.path.join(self.musicdir, name))
+        FolderManager.add(self.store, 'folder', self.musicdir)
+        scanner = Scanner(self.store)
+        scanner.scan(self.store.find(db.Folder).one())
+        scanner.finish()
+        self.store.commit()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.musicdir)
+        os.unlink(self.dbfile)
+
+    def test_file_size(self):
+        self.assertEqual(file_size('tests/assets/23bytes'), 23)
+        self.assertEqual(file_size('tests/assets'), -1)
+        self.assertEqual(file_size('/some/inexistent/path'), -1)
+
+    def test_scanned_size(self):
+        size = os.path.getsize('tests/assets/folder/silence.mp3')
+        self.assertEqual(list(self.store.find(db.Track.size)), [ size ] * 3)
+
+    def test_verify(self):
+        with io.open(os.path.join(self.musicdir, 'a.mp3'), 'ab') as f:
+            f.write(b'\0' * 10)
+        os.unlink(os.path.join(self.musicdir, 'b.mp3'))
+        size = os.path.getsize('tests/assets/folder/silence.mp3')
+
+        last = verify_sizes(self.store, None, 2)
+        self.assertIsNotNone(last)
+        self.assertIsNone(verify_sizes(self.store, last, 2))
+
+        sizes = dict(self.store.find((db.Track.path, db.Track.size)))
+        self.assertEqual(sizes[os.path.join(self.musicdir, 'a.mp3')], size + 10)
+        self.assertEqual(sizes[os.path.join(self.musicdir, 'b.mp3')], -1)
+        self.assertEqual(sizes[os.path.join(self.musicdir, 'c.mp3')], size)
+
+    def test_thread(self):
+        self.store.find(db.Track).set(size = -1)
+        self.store.commit()
+
+        verifier = SizeVerifier('sqlite:' + self.dbfile, 0.1, 2)
+        verifier.start()
+        time.sleep(0.5)
+        verifier.stop()
+        verifier.join()
+
+        self.store.invalidate()
+        self.assertEqual(self.store.find(db.Track, db.Track.size == -1).count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
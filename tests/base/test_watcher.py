@@ -10,6 +10,7 @@
 # Distributed under terms of the GNU AGPLv3 license.
 
 import io
+import logging
 import mutagen
 import os
 import shutil
@@ -20,15 +21,26 @@ import unittest
 from contextlib import contextmanager
 from threading import Thread
 
-from supysonic.db import get_store, Track, Artist
+from supysonic.db import get_store, Folder, Track, Artist
+from supysonic import watcher
 from supysonic.managers.folder import FolderManager
-from supysonic.watcher import SupysonicWatcher
+from supysonic.scanner import Scanner
+from supysonic.watcher import SupysonicWatcher, ScannerProcessingQueue, OP_SCAN, FLAG_CREATE
 
 from ..testbase import TestConfig
 
 class WatcherTestConfig(TestConfig):
     DAEMON = {
         'wait_delay': 0.5,
+        'journal_file': None,
+        'startup_scan': False,
+        'metrics_address': None,
+        'size_check_interval': 0,
+        'settle_delay': 0.2,
+        'max_wait_delay': 5,
+        'max_watches': None,
+        'watch_depth': 1,
+        'poll_interval': 60,
         'log_file': None,
         'log_level': 'DEBUG'
     }
@@ -54,6 +66,7 @@ class WatcherTestBase(unittest.TestCase):
     def setUp(self):
         self.__dbfile = tempfile.mkstemp()[1]
         conf = WatcherTestConfig('sqlite:///' + self.__dbfile)
+        self._configure(conf)
         self.__sleep_time = conf.DAEMON['wait_delay'] + 1
 
         with self._get_store() as store:
@@ -68,6 +81,9 @@ class WatcherTestBase(unittest.TestCase):
     def tearDown(self):
         os.unlink(self.__dbfile)
 
+    def _configure(self, conf):
+        pass
+
     def _start(self):
         self.__thread.start()
         time.sleep(0.2)
@@ -82,6 +98,13 @@ class WatcherTestBase(unittest.TestCase):
     def _sleep(self):
         time.sleep(self.__sleep_time)
 
+    def _wait_until(self, condition, timeout = 10):
+        """ Polls until the condition holds, rather than hoping a fixed delay is enough on a slow machine """
+
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.1)
+
 class NothingToWatchTestCase(WatcherTestBase):
     def test_spawn_useless_watcher(self):
         self._start()
@@ -253,11 +276,259 @@ class WatcherTestCase(WatcherTestBase):
         self._sleep()
         self.assertTrackCountEqual(1)
 
+    def _adddir(self):
+        path = os.path.join(self.__dir, self._tempname())
+        os.makedirs(os.path.join(path, 'sub'))
+        for name in ('a.mp3', os.path.join('sub', 'b.mp3')):
+            shutil.copyfile('tests/assets/folder/silence.mp3', os.path.join(path, name))
+        return path
+
+    def test_rename_directory(self):
+        path = self._adddir()
+        self._sleep()
+        self.assertTrackCountEqual(2)
+        with self._get_store() as store:
+            trackids = set(store.find(Track.id))
+
+        newpath = unicode(os.path.join(self.__dir, self._tempname()))
+        shutil.move(path, newpath)
+        self._sleep()
+        with self._get_store() as store:
+            self.assertEqual(set(store.find(Track.id)), trackids)
+            self.assertEqual(store.find(Track, Track.path.startswith(newpath + os.sep)).count(), 2)
+            self.assertEqual(store.find(Folder, Folder.path.startswith(unicode(path))).count(), 0)
+            folder = store.find(Folder, Folder.path == newpath).one()
+            self.assertEqual(folder.name, os.path.basename(newpath))
+            self.assertEqual(folder.children.one().path, os.path.join(newpath, 'sub'))
+
+    def test_delete_directory(self):
+        path = self._adddir()
+        self._sleep()
+        self.assertTrackCountEqual(2)
+
+        shutil.rmtree(path)
+        self._sleep()
+        self.assertTrackCountEqual(0)
+        with self._get_store() as store:
+            self.assertEqual(store.find(Folder).count(), 1)
+
+    def test_move_directory_out(self):
+        path = self._adddir()
+        self._sleep()
+        self.assertTrackCountEqual(2)
+
+        newpath = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+        shutil.move(path, newpath)
+        self._sleep()
+        self.assertTrackCountEqual(0)
+        with self._get_store() as store:
+            self.assertEqual(store.find(Folder).count(), 1)
+
+        shutil.rmtree(newpath)
+
+class BatchedWatcherTestCase(WatcherTestCase):
+    def _configure(self, conf):
+        conf.BASE['scanner_workers'] = 2
+        conf.BASE['scanner_commit_every'] = 2
+
+    def test_add_multiple(self):
+        def track_count():
+            with self._get_store() as store:
+                return store.find(Track).count()
+
+        paths = [ self._addfile() for _ in range(5) ]
+        self._wait_until(lambda: track_count() == 5)
+        with self._get_store() as store:
+            self.assertEqual(store.find(Track).count(), 5)
+            self.assertEqual(store.find(Artist).count(), 1)
+
+        for path in paths[:3]:
+            os.unlink(path)
+        self._wait_until(lambda: track_count() == 2)
+        self.assertTrackCountEqual(2)
+
+class RestartTestBase(WatcherTestBase):
+    def _configure(self, conf):
+        self._db_uri = conf.BASE['database_uri']
+        self._journal = tempfile.mkstemp()[1]
+        conf.DAEMON['journal_file'] = self._journal
+
+    def setUp(self):
+        super(RestartTestBase, self).setUp()
+        self._dir = tempfile.mkdtemp()
+        with self._get_store() as store:
+            FolderManager.add(store, 'Folder', self._dir)
+
+    def tearDown(self):
+        if self._is_alive():
+            self._stop()
+        shutil.rmtree(self._dir)
+        os.unlink(self._journal)
+        super(RestartTestBase, self).tearDown()
+
+    def _addfile(self, name = 'silence.mp3'):
+        path = os.path.join(self._dir, name)
+        shutil.copyfile('tests/assets/folder/silence.mp3', path)
+        return path
+
+    def assertTrackCountEqual(self, expected):
+        with self._get_store() as store:
+            self.assertEqual(store.find(Track).count(), expected)
+
+class JournalTestCase(RestartTestBase):
+    def test_replay(self):
+        # A queue that never got to process its items, as if the daemon was killed
+        queue = ScannerProcessingQueue(self._db_uri, 0.5, logging.getLogger(__name__), journal = self._journal)
+        queue.put(self._addfile(), OP_SCAN | FLAG_CREATE)
+        del queue
+        self.assertNotEqual(os.path.getsize(self._journal), 0)
+
+        self._start()
+        self._sleep()
+        self.assertTrackCountEqual(1)
+        self.assertEqual(os.path.getsize(self._journal), 0)
+
+class StartupScanTestCase(RestartTestBase):
+    def _configure(self, conf):
+        super(StartupScanTestCase, self)._configure(conf)
+        conf.DAEMON['startup_scan'] = True
+        conf.BASE['scanner_extensions'] = 'mp3'
+        conf.BASE['scanner_cover_names'] = 'artwork.jpg'
+
+    def test_added_while_stopped(self):
+        self._addfile()
+        self._start()
+        time.sleep(0.5)
+        self.assertTrackCountEqual(1)
+
+    def test_configured_names(self):
+        self._addfile()
+        self._addfile('silence.mp2')
+        shutil.copyfile('tests/assets/cover.jpg', os.path.join(self._dir, 'artwork.jpg'))
+        self._start()
+        time.sleep(0.5)
+        self.assertTrackCountEqual(1)
+        with self._get_store() as store:
+            self.assertEqual(store.find(Folder).one().cover_art, 'artwork.jpg')
+
+class RetryTestCase(RestartTestBase):
+    def test_failed_items(self):
+        failures = []
+        class FailingScanner(Scanner):
+            def scan_files(self, paths):
+                Scanner.scan_files(self, paths)
+                if not failures:
+                    failures.append(paths)
+                    raise Exception('Failing on purpose')
+
+        watcher.Scanner = FailingScanner
+        queue = ScannerProcessingQueue(self._db_uri, 1, logging.getLogger(__name__), journal = self._journal)
+        queue.start()
+        try:
+            queue.put(self._addfile(), OP_SCAN | FLAG_CREATE)
+            # Put back after failing, to be retried a wait delay later
+            self._wait_until(lambda: failures and queue.pending()[0] == 1)
+            self.assertEqual(len(failures), 1)
+            self.assertEqual(queue.pending()[0], 1)
+            self.assertTrackCountEqual(0)
+            self.assertNotEqual(os.path.getsize(self._journal), 0)
+
+            self._wait_until(lambda: queue.pending()[0] == 0 and os.path.getsize(self._journal) == 0)
+            self.assertTrackCountEqual(1)
+            self.assertEqual(queue.pending()[0], 0)
+            self.assertEqual(os.path.getsize(self._journal), 0)
+        finally:
+            queue.stop()
+            queue.join()
+            watcher.Scanner = Scanner
+
+class AdaptiveDelayTestCase(RestartTestBase):
+    def test_busy_directory(self):
+        queue = ScannerProcessingQueue(self._db_uri, 1, logging.getLogger(__name__), settle_delay = 0.2, max_delay = 10)
+        queue.start()
+        try:
+            # A single change is processed quickly
+            queue.put(self._addfile('a.mp3'), OP_SCAN | FLAG_CREATE)
+            time.sleep(0.6)
+            self.assertTrackCountEqual(1)
+
+            # Several files changing in the same directory wait for it to be quiet for the whole delay
+            for name in ('b.mp3', 'c.mp3', 'd.mp3'):
+                queue.put(self._addfile(name), OP_SCAN | FLAG_CREATE)
+            time.sleep(0.6)
+            self.assertTrackCountEqual(1)
+            time.sleep(1)
+            self.assertTrackCountEqual(4)
+        finally:
+            queue.stop()
+            queue.join()
+
+    def test_file_being_written(self):
+        queue = ScannerProcessingQueue(self._db_uri, 0.2, logging.getLogger(__name__), settle_delay = 0.2, max_delay = 10)
+        queue.start()
+        try:
+            path = os.path.join(self._dir, 'growing.mp3')
+            with open('tests/assets/folder/silence.mp3', 'rb') as src, open(path, 'wb') as dst:
+                queue.put(path, OP_SCAN | FLAG_CREATE)
+                # Writes without any event, as when the watcher doesn't get one for every write
+                for _ in range(5):
+                    dst.write(src.read(512))
+                    dst.flush()
+                    time.sleep(0.1)
+                dst.write(src.read())
+            time.sleep(0.6)
+            self.assertTrackCountEqual(1)
+            self.assertIn('supysonic_watcher_scan_seconds_count 1\n', queue.metrics.exposition(0, None))
+        finally:
+            queue.stop()
+            queue.join()
+
+class HybridWatcherTestCase(RestartTestBase):
+    def _configure(self, conf):
+        super(HybridWatcherTestCase, self)._configure(conf)
+        conf.DAEMON['max_watches'] = 1
+        conf.DAEMON['poll_interval'] = 0.5
+        conf.BASE['scanner_extensions'] = 'mp3'
+
+    def setUp(self):
+        super(HybridWatcherTestCase, self).setUp()
+        os.mkdir(os.path.join(self._dir, 'sub'))
+        self._start()
+
+    def test_polled_directory(self):
+        # Watched top level
+        self._addfile()
+        # Polled subdirectories
+        self._addfile(os.path.join('sub', 'silence.mp3'))
+        os.mkdir(os.path.join(self._dir, 'sub', 'new'))
+        self._addfile(os.path.join('sub', 'new', 'silence.mp3'))
+        self._sleep()
+        self.assertTrackCountEqual(3)
+
+        os.unlink(os.path.join(self._dir, 'sub', 'silence.mp3'))
+        shutil.rmtree(os.path.join(self._dir, 'sub', 'new'))
+        self._sleep()
+        self.assertTrackCountEqual(1)
+        with self._get_store() as store:
+            self.assertEqual(store.find(Folder).count(), 1)
+
+    def test_polled_extensions(self):
+        self._addfile(os.path.join('sub', 'silence.mp3'))
+        self._addfile(os.path.join('sub', 'silence.mp2'))
+        self._sleep()
+        self.assertTrackCountEqual(1)
+
 def suite():
     suite = unittest.TestSuite()
 
     suite.addTest(unittest.makeSuite(NothingToWatchTestCase))
     suite.addTest(unittest.makeSuite(WatcherTestCase))
+    suite.addTest(unittest.makeSuite(BatchedWatcherTestCase, 'test_add_multiple'))
+    suite.addTest(unittest.makeSuite(JournalTestCase))
+    suite.addTest(unittest.makeSuite(StartupScanTestCase))
+    suite.addTest(unittest.makeSuite(RetryTestCase))
+    suite.addTest(unittest.makeSuite(AdaptiveDelayTestCase))
+    suite.addTest(unittest.makeSuite(HybridWatcherTestCase))
 
     return suite
 
@@ -9,9 +9,10 @@
 #
 # Distributed under terms of the GNU AGPLv3 license.
 
+import simplejson as json
 import uuid
 
-from supysonic.db import Folder
+from supysonic.db import Folder, ScanJob, Track
 
 from .frontendtestbase import FrontendTestBase
 
@@ -89,11 +90,23 @@ class FolderTestCase(FrontendTestBase):
         rv = self.client.get('/folder/scan/' + str(uuid.uuid4()), follow_redirects = True)
         self.assertIn('No such folder', rv.data)
         rv = self.client.get('/folder/scan/' + str(folder.id), follow_redirects = True)
-        self.assertIn('Added', rv.data)
-        self.assertIn('Deleted', rv.data)
+        self.assertIn('Scan started', rv.data)
+        self.assertIn('data-progress', rv.data)
+        job = self.store.find(ScanJob).one()
+        self.assertEqual(job.status, ScanJob.DONE)
+        self.assertEqual(job.added_tracks, 1)
+        self.assertEqual(self.store.find(Track).count(), 1)
+
         rv = self.client.get('/folder/scan', follow_redirects = True)
-        self.assertIn('Added', rv.data)
-        self.assertIn('Deleted', rv.data)
+        self.assertIn('Scan started', rv.data)
+        self.assertEqual(self.store.find(ScanJob).count(), 1)
+
+        rv = self.client.get('/folder/scan/status')
+        status = json.loads(rv.data)
+        self.assertIn(str(folder.id), status)
+        self.assertEqual(status[str(folder.id)]['status'], 'done')
+        self.assertEqual(status[str(folder.id)]['scanned'], status[str(folder.id)]['total'])
+        self.assertEqual(status[str(folder.id)]['added'], [ 0, 0, 0 ])
 
 if __name__ == '__main__':
     unittest.main()
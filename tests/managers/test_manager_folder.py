@@ -114,6 +114,15 @@ class FolderManagerTestCase(unittest.TestCase):
         self.assertEqual(FolderManager.add(self.store, 'parent', path), FolderManager.SUBPATH_EXISTS)
         self.assertEqual(self.store.find(db.Folder).count(), 3)
 
+        # Sibling folder sharing a name prefix with an already added path
+        path = self.media_dir + '-sibling'
+        os.mkdir(path)
+        try:
+            self.assertEqual(FolderManager.add(self.store, 'sibling', path), FolderManager.SUCCESS)
+            self.assertEqual(self.store.find(db.Folder).count(), 4)
+        finally:
+            os.rmdir(path)
+
     def test_delete_folder(self):
         # Delete existing folders
         for name in ['media', 'music']:
@@ -24,7 +24,11 @@ class TestConfig(DefaultConfig):
     LOGGER_HANDLER_POLICY = 'never'
     BASE = {
         'database_uri': 'sqlite:',
-        'scanner_extensions': None
+        'database_pool_size': 10,
+        'scanner_extensions': None,
+        'scanner_cover_names': None,
+        'scanner_workers': 1,
+        'scanner_commit_every': 0
     }
     MIMETYPES = {
         'mp3': 'audio/mpeg',